@@ -0,0 +1,106 @@
+"""
+Benchmark for the per-invocation overhead of creating boto3 clients.
+
+Compares what every handler used to do on each invocation, building a
+new 'boto3.Session()' plus its 's3' and 'sqs' clients, with fetching
+the cached clients from 'client_factory'. No AWS calls are made, so
+this only measures credential/endpoint resolution and client
+construction. Reusing keep-alive connections saves a further TLS
+handshake per connection which can only be observed against AWS.
+
+Usage:
+    python -m benchmarks.client_factory_benchmark --invocations 200
+"""
+
+import argparse
+import os
+import statistics
+import time
+from typing import Callable, List
+
+import boto3
+
+from sheiva_cloud.sheiva_aws import client_factory
+
+SERVICES = ("s3", "sqs")
+
+
+def new_session_invocation() -> None:
+    """
+    Client setup as done by the handlers before 'client_factory'.
+    """
+
+    boto3_session = boto3.Session()
+    for service_name in SERVICES:
+        boto3_session.client(service_name)
+
+
+def client_factory_invocation() -> None:
+    """
+    Client setup using the cached 'client_factory' clients.
+    """
+
+    for service_name in SERVICES:
+        client_factory.get_client(service_name)
+
+
+def time_invocations(invocation: Callable, invocations: int) -> List[float]:
+    """
+    Times a number of simulated invocations.
+    Args:
+        invocation (Callable): client setup to time
+        invocations (int): number of invocations
+    Returns:
+        List[float]: duration of each invocation in milliseconds
+    """
+
+    durations = []
+    for _ in range(invocations):
+        start = time.perf_counter()
+        invocation()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def report(name: str, durations: List[float]) -> None:
+    """
+    Prints a summary of the invocation durations.
+    Args:
+        name (str): name of the benchmark
+        durations (List[float]): durations in milliseconds
+    """
+
+    print(
+        f"{name:<16} first: {durations[0]:8.3f} ms  "
+        f"median: {statistics.median(durations):8.3f} ms  "
+        f"mean: {statistics.mean(durations):8.3f} ms"
+    )
+
+
+def main():
+    """
+    Runs the benchmark.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--invocations", type=int, default=100)
+    args = parser.parse_args()
+
+    # Client creation needs a region and credentials but never uses them
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+
+    report(
+        "boto3.Session()",
+        time_invocations(new_session_invocation, args.invocations),
+    )
+    client_factory.reset()
+    report(
+        "client_factory",
+        time_invocations(client_factory_invocation, args.invocations),
+    )
+
+
+if __name__ == "__main__":
+    main()
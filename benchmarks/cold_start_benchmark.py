@@ -0,0 +1,392 @@
+"""
+Cold start benchmark for the Lambda containers.
+
+Every 'containers/*/lambda_function.py' is imported in a fresh Python
+process, like a new Lambda execution environment, and its handler is
+invoked once with a synthetic event. The import time and the first
+invocation latency are reported per container, as the median over
+'--runs' processes. AWS and the kuda scrape/parse functions are
+replaced by in-memory fakes after the import, so only our own code and
+the import graph are measured.
+
+With '--import-time' the slowest top level imports of each container,
+from 'python -X importtime', are reported too.
+
+Usage:
+    python -m benchmarks.cold_start_benchmark --runs 5
+    python -m benchmarks.cold_start_benchmark --container workout_scraper
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+CONTAINERS_DIR = (
+    REPO_ROOT / "sheiva_cloud" / "sheiva_aws" / "aws_lambda" / "containers"
+)
+TOP_IMPORTS = 5
+
+# Environment of each container, read at import time
+CONTAINER_ENV = {
+    "workout_scraper_trigger": {"GENDER": "male"},
+    "workout_scraper_trigger_cron": {"NUMBER_WORKOUT_LINKS_PER_MESSAGE": "55"},
+    "workout_transformer_trigger": {"TRANSFORM_LIMIT": "10"},
+}
+
+
+def get_containers() -> List[str]:
+    """
+    Returns:
+        List[str]: names of the containers with a lambda function
+    """
+
+    return sorted(
+        path.parent.name
+        for path in CONTAINERS_DIR.glob("*/lambda_function.py")
+    )
+
+
+def sqs_record(body: str, attributes: Dict[str, str]) -> Dict:
+    """
+    Builds an SQS event record as delivered to a Lambda handler.
+    Args:
+        body (str): message body
+        attributes (Dict[str, str]): string message attributes
+    Returns:
+        Dict: the record
+    """
+
+    message_id = str(uuid.uuid4())
+    return {
+        "messageId": message_id,
+        "receiptHandle": message_id,
+        "body": body,
+        "messageAttributes": {
+            name: {"stringValue": value, "dataType": "String"}
+            for name, value in attributes.items()
+        },
+    }
+
+
+# Every setup takes the same arguments whether it uses them or not
+# pylint: disable=unused-argument
+def setup_workout_scraper(s3_client, module) -> Dict:
+    """
+    Fakes the scrape and builds an event of one message of urls.
+    """
+
+    module.scrape_events.scrape_urls = lambda urls, **kwargs: [
+        {"url": url, "workout": {}} for url in urls
+    ]
+    urls = [f"https://example.com/workout/{i}" for i in range(10)]
+    return {
+        "Records": [
+            sqs_record(
+                json.dumps(urls),
+                {"bucket_key": "highrise/workout-data/male/age_16_20"},
+            )
+        ]
+    }
+
+
+def setup_workout_transformer(s3_client, module) -> Dict:
+    """
+    Fakes the parse, seeds a scraped file and builds an event to
+    transform it.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from sheiva_cloud.sheiva_aws import s3
+
+    module.transform_events.parse_workout_tree = lambda workouts: {
+        "workouts": [{"id": i, "name": "w"} for i in range(len(workouts))],
+        "sets": [{"workout_id": i, "reps": 10} for i in range(len(workouts))],
+    }
+    key = "highrise/workout-data/male/age_16_20/benchmark.json"
+    s3_client.put_object(
+        Bucket=s3.SHEIVA_SCRAPE_BUCKET,
+        Key=key,
+        Body=json.dumps([{"workout": i} for i in range(100)]),
+    )
+    return {
+        "Records": [
+            sqs_record(
+                "Empty Body",
+                {
+                    "s3_input_file": key,
+                    "s3_output_bucket_key": (
+                        "highrise/transformed/workout-data"
+                    ),
+                },
+            )
+        ]
+    }
+
+
+def setup_workout_scraper_trigger(s3_client, module) -> Dict:
+    """
+    Seeds the link store and builds a trigger event.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from sheiva_cloud.sheiva_aws.s3 import link_store
+
+    store = link_store.LinkStore(s3_client=s3_client, gender="male")
+    for age_group in ("age_16_20", "age_21_25"):
+        store.write_links(
+            age_group=age_group,
+            links=[f"https://example.com/{age_group}/{i}" for i in range(99)],
+        )
+    return {"Records": [sqs_record("20", {})]}
+
+
+def setup_workout_transformer_trigger(s3_client, module) -> Dict:
+    """
+    Seeds scraped files so the manifest is bootstrapped.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from sheiva_cloud.sheiva_aws import s3
+
+    for i in range(100):
+        s3_client.put_object(
+            Bucket=s3.SHEIVA_SCRAPE_BUCKET,
+            Key=f"highrise/workout-data/male/age_16_20/{i:04d}.json",
+            Body="[]",
+        )
+    return {}
+
+
+SETUPS = {
+    "workout_scraper": setup_workout_scraper,
+    "workout_transformer": setup_workout_transformer,
+    "workout_scraper_trigger": setup_workout_scraper_trigger,
+    "workout_transformer_trigger": setup_workout_transformer_trigger,
+}
+
+
+def run_container(container: str) -> Dict:
+    """
+    Imports a container's lambda function and invokes its handler
+    once. Runs in the benchmark's child process.
+    Args:
+        container (str): name of the container
+    Returns:
+        Dict: import and first invocation time in milliseconds, or
+            the error that stopped the run.
+    """
+
+    path = CONTAINERS_DIR / container / "lambda_function.py"
+    spec = importlib.util.spec_from_file_location("lambda_function", path)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    # Imported by the benchmark itself, not the container
+    preloaded = sorted(sys.modules)
+    start = time.perf_counter()
+    try:
+        spec.loader.exec_module(module)
+    except ImportError as e:
+        return {"error": f"import failed: {e!r}", "preloaded": preloaded}
+    import_ms = (time.perf_counter() - start) * 1000
+
+    # pylint: disable=import-outside-toplevel
+    from benchmarks import fakes
+    from sheiva_cloud.sheiva_aws import client_factory
+
+    s3_client = fakes.FakeS3Client()
+    client_factory.set_client("s3", s3_client)
+    client_factory.set_client("sqs", fakes.FakeSqsClient())
+    event = SETUPS.get(container, lambda *args: {})(s3_client, module)
+
+    start = time.perf_counter()
+    try:
+        module.handler(event, None)
+    # pylint: disable=broad-except
+    except Exception as e:
+        return {
+            "import_ms": import_ms,
+            "error": f"handler failed: {e!r}",
+            "preloaded": preloaded,
+        }
+    return {
+        "import_ms": import_ms,
+        "invoke_ms": (time.perf_counter() - start) * 1000,
+        "preloaded": preloaded,
+    }
+
+
+def parse_import_times(stderr: str, preloaded: Set[str]) -> List[Dict]:
+    """
+    Gets the slowest top level imports of the container from
+    '-X importtime' output.
+    Args:
+        stderr (str): stderr of the child process
+        preloaded (Set[str]): modules imported before the container
+    Returns:
+        List[Dict]: module and cumulative time in milliseconds
+    """
+
+    imports: List[Dict[str, Any]] = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # Nested imports are indented
+        if name.startswith("  ") or name.strip() in preloaded:
+            continue
+        imports.append(
+            {"module": name.strip(), "cumulative_ms": int(cumulative) / 1000}
+        )
+    return sorted(imports, key=lambda i: -i["cumulative_ms"])[:TOP_IMPORTS]
+
+
+def spawn(container: str, import_time: bool) -> Dict:
+    """
+    Runs a container in a fresh process.
+    Args:
+        container (str): name of the container
+        import_time (bool): collect '-X importtime' output
+    Returns:
+        Dict: result of 'run_container'
+    """
+
+    env = {
+        **os.environ,
+        **CONTAINER_ENV.get(container, {}),
+        # Client creation needs a region and credentials but never uses them
+        "AWS_DEFAULT_REGION": os.getenv("AWS_DEFAULT_REGION", "eu-west-1"),
+        "AWS_ACCESS_KEY_ID": os.getenv("AWS_ACCESS_KEY_ID", "benchmark"),
+        "AWS_SECRET_ACCESS_KEY": os.getenv(
+            "AWS_SECRET_ACCESS_KEY", "benchmark"
+        ),
+    }
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [str(REPO_ROOT), env.get("PYTHONPATH")])
+    )
+    # Bytecode is cached by the first run, as it is in the image
+    command = [sys.executable]
+    if import_time:
+        command += ["-X", "importtime"]
+    completed = subprocess.run(
+        command
+        + ["-m", "benchmarks.cold_start_benchmark", "--child", container],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    try:
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+    except (IndexError, json.JSONDecodeError):
+        return {"error": completed.stderr.strip().splitlines()[-1:]}
+    preloaded = result.pop("preloaded", [])
+    if import_time:
+        result["top_imports"] = parse_import_times(
+            completed.stderr, preloaded=set(preloaded)
+        )
+    return result
+
+
+def summarise(container: str, results: List[Dict]) -> Dict:
+    """
+    Summarises the runs of a container.
+    Args:
+        container (str): name of the container
+        results (List[Dict]): results of each run
+    Returns:
+        Dict: median import and invocation times
+    """
+
+    summary: Dict = {"container": container, "runs": len(results)}
+    errors = [r["error"] for r in results if "error" in r]
+    if errors:
+        summary["error"] = errors[0]
+    for metric in ("import_ms", "invoke_ms"):
+        values = [r[metric] for r in results if metric in r]
+        if values:
+            summary[metric] = round(statistics.median(values), 3)
+    if "top_imports" in results[-1]:
+        summary["top_imports"] = results[-1]["top_imports"]
+    return summary
+
+
+def report(summary: Dict) -> None:
+    """
+    Prints a summary.
+    Args:
+        summary (Dict): summary of a container
+    """
+
+    def fmt(value: Optional[float]) -> str:
+        return "       -" if value is None else f"{value:8.1f}"
+
+    print(
+        f"{summary['container']:<30} "
+        f"import: {fmt(summary.get('import_ms'))} ms  "
+        f"first invoke: {fmt(summary.get('invoke_ms'))} ms"
+    )
+    if "error" in summary:
+        print(f"    error: {summary['error']}")
+    for top_import in summary.get("top_imports", []):
+        print(
+            f"    {top_import['module']:<48} "
+            f"{top_import['cumulative_ms']:8.1f} ms"
+        )
+
+
+def main():
+    """
+    Runs the benchmark.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument(
+        "--container",
+        action="append",
+        choices=get_containers(),
+        help="container to benchmark, repeatable, defaults to all",
+    )
+    parser.add_argument("--import-time", action="store_true")
+    parser.add_argument(
+        "--json", action="store_true", help="print the summaries as json"
+    )
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_container(args.child)))
+        return
+
+    # Warm up the bytecode cache so every run measures the same thing
+    for container in args.container or get_containers():
+        spawn(container, import_time=False)
+
+    summaries = []
+    for container in args.container or get_containers():
+        summary = summarise(
+            container,
+            [
+                spawn(container, import_time=args.import_time)
+                for _ in range(args.runs)
+            ],
+        )
+        summaries.append(summary)
+        if not args.json:
+            report(summary)
+    if args.json:
+        print(json.dumps(summaries, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+In-memory stand-ins for the boto3 S3 and SQS clients used by the
+benchmarks. They are the clients of 'local_clients' with the storage
+kept in dicts, so they never touch the disk or the network and the
+benchmarks measure our own code rather than AWS. Inject them with
+'client_factory.set_client'.
+
+Every client counts its API calls and the bytes uploaded to and
+downloaded from it in 'stats'.
+"""
+
+import hashlib
+import io
+import threading
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+
+from sheiva_cloud.sheiva_aws import local_clients
+
+
+class FakeS3Client(local_clients.BaseS3Client):
+    """
+    In-memory S3 client. Buckets are created on first write.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.objects: Dict[str, Dict[str, bytes]] = {}
+        self.etags: Dict[str, Dict[str, str]] = {}
+        self.uploads: Dict[str, Dict[int, bytes]] = {}
+        self._lock = threading.Lock()
+
+    def _open(self, bucket: str, key: str) -> Tuple[BinaryIO, int, str]:
+        with self._lock:
+            try:
+                body = self.objects[bucket][key]
+            except KeyError as e:
+                raise self.exceptions.NoSuchKey(key) from e
+            return io.BytesIO(body), len(body), self.etags[bucket][key]
+
+    def _write(self, bucket: str, key: str, chunks: Iterator[bytes]) -> str:
+        body = b"".join(chunks)
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        with self._lock:
+            self.objects.setdefault(bucket, {})[key] = body
+            self.etags.setdefault(bucket, {})[key] = etag
+        return etag
+
+    def _remove(self, bucket: str, key: str) -> None:
+        with self._lock:
+            self.objects.get(bucket, {}).pop(key, None)
+            self.etags.get(bucket, {}).pop(key, None)
+
+    def _list_entries(
+        self, bucket: str, prefix: str, delimiter: str
+    ) -> List[Tuple[str, int, str]]:
+        with self._lock:
+            keys = [
+                (key, len(body), self.etags[bucket][key])
+                for key, body in self.objects.get(bucket, {}).items()
+                if key.startswith(prefix)
+            ]
+        entries = set()
+        for key, size, etag in keys:
+            rest = key[len(prefix) :]
+            if delimiter and delimiter in rest:
+                common_prefix = rest[: rest.index(delimiter) + len(delimiter)]
+                entries.add((prefix + common_prefix, 0, ""))
+            else:
+                entries.add((key, size, etag))
+        return sorted(entries)
+
+    def _create_upload(self, upload_id: str) -> None:
+        with self._lock:
+            self.uploads[upload_id] = {}
+
+    def _write_part(self, upload_id: str, number: int, body: bytes) -> None:
+        with self._lock:
+            if upload_id not in self.uploads:
+                raise self.exceptions.NoSuchUpload(upload_id)
+            self.uploads[upload_id][number] = body
+
+    def _read_parts(
+        self, upload_id: str, numbers: List[int]
+    ) -> Iterator[bytes]:
+        with self._lock:
+            if upload_id not in self.uploads:
+                raise self.exceptions.NoSuchUpload(upload_id)
+            parts = self.uploads[upload_id]
+            return iter([parts[number] for number in numbers])
+
+    def _remove_upload(self, upload_id: str) -> None:
+        with self._lock:
+            self.uploads.pop(upload_id, None)
+
+
+class FakeSqsClient(local_clients.BaseSqsClient):
+    """
+    In-memory SQS client. Queues are created on first send.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.queues: Dict[str, Dict[str, Dict]] = {}
+        self._lock = threading.Lock()
+
+    def _put_message(self, queue_url: str, message: Dict) -> None:
+        with self._lock:
+            self.queues.setdefault(queue_url, {})[
+                message["MessageId"]
+            ] = message
+
+    def _get_messages(self, queue_url: str, max_number: int) -> List[Dict]:
+        with self._lock:
+            return list(self.queues.get(queue_url, {}).values())[:max_number]
+
+    def _remove_message(self, queue_url: str, receipt_handle: str) -> None:
+        with self._lock:
+            self.queues.get(queue_url, {}).pop(receipt_handle, None)
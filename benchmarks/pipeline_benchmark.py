@@ -0,0 +1,560 @@
+"""
+End-to-end benchmark of the scraping pipeline.
+
+The whole chain runs in process against the S3 and SQS fakes:
+
+    workout_scraper_trigger_cron -> workout_scraper_trigger
+        -> workout_scraper -> workout_transformer_trigger
+        -> workout_transformer
+
+The link store is seeded with synthetic workout links and the kuda
+scrape and parse functions are replaced by a generator of synthetic
+Highrise workouts and a matching parser, so no network is used. Each
+queue is drained like a Lambda event source mapping: batches of
+records are passed to the handler and the records not reported in
+'batchItemFailures' are deleted. For each stage the wall time,
+throughput, API calls, bytes moved and peak Python memory are
+reported.
+
+Usage:
+    python -m benchmarks.pipeline_benchmark --links-per-age-group 2000
+"""
+
+import argparse
+import contextlib
+import hashlib
+import importlib.util
+import json
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+from benchmarks import fakes
+from benchmarks.cold_start_benchmark import CONTAINERS_DIR
+from sheiva_cloud.sheiva_aws import client_factory, s3, sqs
+from sheiva_cloud.sheiva_aws.s3 import link_store, object_codecs
+
+GENDER = "male"
+# Lambda's default batch size for SQS event sources
+EVENT_BATCH_SIZE = 10
+# Receives of a message before it is left on its queue
+MAX_RECEIVES = 3
+EXERCISES = ("Squat", "Bench Press", "Deadlift", "Row", "Lunge", "Curl")
+
+
+def workout_for(url: str, max_components: int = 4) -> Dict:
+    """
+    Builds a synthetic Highrise workout, deterministic per url.
+    Args:
+        url (str): workout url
+        max_components (int): highest number of workout components
+    Returns:
+        Dict: the workout
+    """
+
+    rng = random.Random(hashlib.md5(url.encode("utf-8")).hexdigest())
+    return {
+        "url": url,
+        "name": f"Workout {rng.randint(1, 10_000)}",
+        "date": f"2023-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "workout_components": [
+            {
+                "name": f"Component {c}",
+                "sets": [
+                    {
+                        "name": f"Set {s}",
+                        "set_components": [
+                            {
+                                "exercise_name": rng.choice(EXERCISES),
+                                "reps": rng.randint(1, 20),
+                                "weight": round(rng.uniform(5, 200), 1),
+                            }
+                            for _ in range(rng.randint(1, 3))
+                        ],
+                    }
+                    for s in range(rng.randint(1, 5))
+                ],
+            }
+            for c in range(rng.randint(1, max_components))
+        ],
+    }
+
+
+def make_scrape_urls(failure_rate: float) -> Callable:
+    """
+    Builds a stand-in for 'kuda.scrapers.scrape_urls'.
+    Args:
+        failure_rate (float): fraction of urls whose scrape fails
+    Returns:
+        Callable: the scrape function
+    """
+
+    # The parser and concurrency of the real scrape do not apply
+    # pylint: disable=unused-argument
+    def scrape_urls(urls: List[str], **kwargs) -> List:
+        return [
+            url
+            if random.Random(url).random() < failure_rate
+            else workout_for(url)
+            for url in urls
+        ]
+
+    return scrape_urls
+
+
+def parse_workout_tree(workouts: List[Dict]) -> Dict[str, List[Dict]]:
+    """
+    Stand-in for kuda's 'parse_workout_tree', flattens workouts into
+    their four components.
+    Args:
+        workouts (List[Dict]): scraped workouts
+    Returns:
+        Dict[str, List[Dict]]: rows of each component
+    """
+
+    components: Dict[str, List[Dict]] = {
+        "workouts": [],
+        "workout_components": [],
+        "sets": [],
+        "set_components": [],
+    }
+    for workout in workouts:
+        workout_id = hashlib.md5(workout["url"].encode()).hexdigest()
+        components["workouts"].append(
+            {
+                "id": workout_id,
+                "name": workout["name"],
+                "date": workout["date"],
+            }
+        )
+        for c, component in enumerate(workout["workout_components"]):
+            component_id = f"{workout_id}-{c}"
+            components["workout_components"].append(
+                {
+                    "id": component_id,
+                    "workout_id": workout_id,
+                    "name": component["name"],
+                }
+            )
+            for s, set_ in enumerate(component["sets"]):
+                set_id = f"{component_id}-{s}"
+                components["sets"].append(
+                    {
+                        "id": set_id,
+                        "workout_component_id": component_id,
+                        "name": set_["name"],
+                    }
+                )
+                for set_component in set_["set_components"]:
+                    components["set_components"].append(
+                        {"set_id": set_id, **set_component}
+                    )
+    return components
+
+
+def load_container(container: str):
+    """
+    Imports a container's lambda function.
+    Args:
+        container (str): name of the container
+    Returns:
+        module: the lambda function module
+    """
+
+    spec = importlib.util.spec_from_file_location(
+        f"{container}_lambda_function",
+        CONTAINERS_DIR / container / "lambda_function.py",
+    )
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def to_record(message: Dict) -> Dict:
+    """
+    Converts a received SQS message to a Lambda event record.
+    Args:
+        message (Dict): message as returned by 'receive_message'
+    Returns:
+        Dict: the record
+    """
+
+    return {
+        "messageId": message["MessageId"],
+        "receiptHandle": message["ReceiptHandle"],
+        "body": message["Body"],
+        "messageAttributes": {
+            name: {
+                "stringValue": attribute["StringValue"],
+                "dataType": attribute["DataType"],
+            }
+            for name, attribute in message["MessageAttributes"].items()
+        },
+    }
+
+
+def drain(
+    sqs_client: fakes.FakeSqsClient,
+    queue_url: str,
+    handler: Callable,
+    delete_processed: bool = True,
+) -> int:
+    """
+    Passes the messages of a queue to a handler in batches until it
+    is empty or every message left was received 'MAX_RECEIVES' times.
+    Args:
+        sqs_client (fakes.FakeSqsClient): sqs client
+        queue_url (str): url of the queue
+        handler (Callable): Lambda handler
+        delete_processed (bool): delete the records not reported in
+            'batchItemFailures', as the event source mapping does.
+    Returns:
+        int: number of records passed to the handler
+    """
+
+    receives: Dict[str, int] = {}
+    num_records = 0
+    while True:
+        messages = [
+            message
+            for message in sqs_client.queues.get(queue_url, {}).values()
+            if receives.get(message["MessageId"], 0) < MAX_RECEIVES
+        ][:EVENT_BATCH_SIZE]
+        if not messages:
+            return num_records
+        for message in messages:
+            receives[message["MessageId"]] = (
+                receives.get(message["MessageId"], 0) + 1
+            )
+        num_records += len(messages)
+        response = handler(
+            {"Records": [to_record(message) for message in messages]}, None
+        )
+        if not delete_processed:
+            continue
+        failed = {
+            failure["itemIdentifier"]
+            for failure in (response or {}).get("batchItemFailures", [])
+        }
+        for message in messages:
+            if message["MessageId"] not in failed:
+                sqs_client.queues[queue_url].pop(message["MessageId"], None)
+
+
+def count_items(s3_client: fakes.FakeS3Client, prefix: str) -> int:
+    """
+    Counts the items of the codec encoded objects under a prefix,
+    reading the fake's storage directly so no API calls are counted.
+    """
+
+    count = 0
+    objects = s3_client.objects.get(s3.SHEIVA_SCRAPE_BUCKET, {})
+    for key, body in objects.items():
+        if key.startswith(prefix) and object_codecs.has_codec_extension(key):
+            count += len(object_codecs.detect_codec(key, None).decode(body))
+    return count
+
+
+def diff_stats(before: Dict, after: Dict) -> Dict:
+    """
+    Returns:
+        Dict: the calls and bytes between two 'ApiStats' snapshots
+    """
+
+    calls = {
+        operation: count - before["calls"].get(operation, 0)
+        for operation, count in after["calls"].items()
+        if count - before["calls"].get(operation, 0)
+    }
+    return {
+        "calls": dict(sorted(calls.items())),
+        "bytes_uploaded": after["bytes_uploaded"] - before["bytes_uploaded"],
+        "bytes_downloaded": after["bytes_downloaded"]
+        - before["bytes_downloaded"],
+    }
+
+
+class Pipeline:
+    """
+    The containers of the pipeline wired to the fakes.
+    """
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.s3_client = fakes.FakeS3Client()
+        self.sqs_client = fakes.FakeSqsClient()
+        client_factory.set_client("s3", self.s3_client)
+        client_factory.set_client("sqs", self.sqs_client)
+        os.environ.update(
+            {
+                "GENDER": GENDER,
+                "NUMBER_WORKOUT_LINKS_PER_MESSAGE": str(
+                    args.links_per_message
+                ),
+                # Every link is sent in one trigger run
+                "MESSAGES_PER_AGE_GROUP": str(
+                    math.ceil(
+                        args.links_per_age_group / args.links_per_message
+                    )
+                ),
+                "TRANSFORM_LIMIT": str(10**9),
+                "SCRAPE_CACHE_ENABLED": "false",
+                # Client creation needs a region and credentials but
+                # never uses them
+                "AWS_DEFAULT_REGION": os.getenv(
+                    "AWS_DEFAULT_REGION", "eu-west-1"
+                ),
+                "AWS_ACCESS_KEY_ID": os.getenv(
+                    "AWS_ACCESS_KEY_ID", "benchmark"
+                ),
+                "AWS_SECRET_ACCESS_KEY": os.getenv(
+                    "AWS_SECRET_ACCESS_KEY", "benchmark"
+                ),
+            }
+        )
+        self.containers = {
+            container: load_container(container)
+            for container in (
+                "workout_scraper_trigger_cron",
+                "workout_scraper_trigger",
+                "workout_scraper",
+                "workout_transformer_trigger",
+                "workout_transformer",
+            )
+        }
+        self.containers[
+            "workout_scraper"
+        ].scrape_events.scrape_urls = make_scrape_urls(args.failure_rate)
+        self.containers[
+            "workout_transformer"
+        ].transform_events.parse_workout_tree = parse_workout_tree
+
+    def seed(self) -> int:
+        """
+        Writes the synthetic workout links to the link store.
+        Returns:
+            int: number of links written
+        """
+
+        store = link_store.LinkStore(s3_client=self.s3_client, gender=GENDER)
+        for a in range(self.args.age_groups):
+            age_group = f"age_{5 * a + 16}_{5 * a + 20}"
+            store.write_links(
+                age_group=age_group,
+                links=(
+                    f"https://www.highrise.app/workouts/{age_group}/{i}"
+                    for i in range(self.args.links_per_age_group)
+                ),
+            )
+        return self.args.age_groups * self.args.links_per_age_group
+
+    def run_cron(self) -> int:
+        """
+        Invokes the cron that sends the scraper trigger message.
+        Returns:
+            int: number of invocations
+        """
+
+        self.containers["workout_scraper_trigger_cron"].handler({}, None)
+        return 1
+
+    def run_scraper_trigger(self) -> int:
+        """
+        Drains the scraper trigger queue.
+        Returns:
+            int: number of links sent to the scraper queue
+        """
+
+        # The handler deletes its trigger message itself
+        drain(
+            self.sqs_client,
+            sqs.WORKOUT_SCRAPER_TRIGGER_QUEUE,
+            self.containers["workout_scraper_trigger"].handler,
+            delete_processed=False,
+        )
+        return sum(
+            len(sqs.message_parsers.decode_urls(message["Body"]))
+            for message in self.sqs_client.queues.get(
+                sqs.WORKOUT_SCRAPER_QUEUE, {}
+            ).values()
+        )
+
+    def run_scraper(self) -> int:
+        """
+        Drains the scraper queue.
+        Returns:
+            int: number of urls in the queue before it was drained
+        """
+
+        num_urls = sum(
+            len(sqs.message_parsers.decode_urls(message["Body"]))
+            for message in self.sqs_client.queues.get(
+                sqs.WORKOUT_SCRAPER_QUEUE, {}
+            ).values()
+        )
+        drain(
+            self.sqs_client,
+            sqs.WORKOUT_SCRAPER_QUEUE,
+            self.containers["workout_scraper"].handler,
+        )
+        return num_urls
+
+    def run_transformer_trigger(self) -> int:
+        """
+        Invokes the transformer trigger.
+        Returns:
+            int: number of files sent to the transform queue
+        """
+
+        self.containers["workout_transformer_trigger"].handler({}, None)
+        return len(
+            self.sqs_client.queues.get(sqs.WORKOUT_FILE_TRANSFORM_QUEUE, {})
+        )
+
+    def run_transformer(self) -> int:
+        """
+        Drains the transform queue.
+        Returns:
+            int: number of scraped workouts transformed
+        """
+
+        num_workouts = count_items(self.s3_client, "highrise/workout-data/")
+        drain(
+            self.sqs_client,
+            sqs.WORKOUT_FILE_TRANSFORM_QUEUE,
+            self.containers["workout_transformer"].handler,
+        )
+        return num_workouts
+
+
+STAGES = (
+    ("workout_scraper_trigger_cron", "messages", Pipeline.run_cron),
+    ("workout_scraper_trigger", "links", Pipeline.run_scraper_trigger),
+    ("workout_scraper", "urls", Pipeline.run_scraper),
+    ("workout_transformer_trigger", "files", Pipeline.run_transformer_trigger),
+    ("workout_transformer", "workouts", Pipeline.run_transformer),
+)
+
+
+def run_stage(
+    pipeline: Pipeline, stage: Callable, trace_memory: bool, verbose: bool
+) -> Dict:
+    """
+    Runs a stage and measures it.
+    Args:
+        pipeline (Pipeline): the pipeline
+        stage (Callable): 'Pipeline' method of the stage
+        trace_memory (bool): measure peak memory with tracemalloc
+        verbose (bool): show what the handlers print
+    Returns:
+        Dict: time, items, API calls, bytes and peak memory
+    """
+
+    s3_before = pipeline.s3_client.stats.snapshot()
+    sqs_before = pipeline.sqs_client.stats.snapshot()
+    if trace_memory:
+        tracemalloc.reset_peak()
+        memory_before = tracemalloc.get_traced_memory()[0]
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        with contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+            start = time.perf_counter()
+            items = stage(pipeline)
+    seconds = time.perf_counter() - start
+    result = {
+        "seconds": round(seconds, 3),
+        "items": items,
+        "items_per_second": round(items / seconds, 1) if seconds else None,
+        "s3": diff_stats(s3_before, pipeline.s3_client.stats.snapshot()),
+        "sqs": diff_stats(sqs_before, pipeline.sqs_client.stats.snapshot()),
+    }
+    if trace_memory:
+        result["peak_memory_mb"] = round(
+            (tracemalloc.get_traced_memory()[1] - memory_before) / 2**20, 2
+        )
+    return result
+
+
+def report(name: str, unit: str, result: Dict) -> None:
+    """
+    Prints the result of a stage.
+    """
+
+    def fmt_bytes(num_bytes: int) -> str:
+        return f"{num_bytes / 2**20:.2f} MiB"
+
+    print(
+        f"{name:<30} {result['seconds']:8.3f} s  "
+        f"{result['items']:>8} {unit:<8} "
+        f"{result['items_per_second'] or 0:>10.1f} {unit}/s"
+    )
+    if "peak_memory_mb" in result:
+        print(f"    peak memory: {result['peak_memory_mb']:.2f} MiB")
+    for service in ("s3", "sqs"):
+        stats = result[service]
+        calls = ", ".join(f"{op}={n}" for op, n in stats["calls"].items())
+        print(
+            f"    {service}: up {fmt_bytes(stats['bytes_uploaded'])}, "
+            f"down {fmt_bytes(stats['bytes_downloaded'])}, "
+            f"calls: {calls or '-'}"
+        )
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    Runs the benchmark.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--age-groups", type=int, default=2)
+    parser.add_argument("--links-per-age-group", type=int, default=1000)
+    parser.add_argument("--links-per-message", type=int, default=55)
+    parser.add_argument("--failure-rate", type=float, default=0.02)
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="skip tracemalloc, which slows every stage down",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="show the handlers' logs"
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="print the results as json"
+    )
+    args = parser.parse_args(argv)
+
+    pipeline = Pipeline(args)
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        with contextlib.redirect_stdout(
+            sys.stdout if args.verbose else devnull
+        ):
+            seeded = pipeline.seed()
+    if not args.json:
+        print(f"Seeded {seeded} workout links")
+
+    if not args.no_memory:
+        tracemalloc.start()
+    results = {}
+    try:
+        for name, unit, stage in STAGES:
+            results[name] = run_stage(
+                pipeline,
+                stage,
+                trace_memory=not args.no_memory,
+                verbose=args.verbose,
+            )
+            if not args.json:
+                report(name, unit, results[name])
+    finally:
+        if not args.no_memory:
+            tracemalloc.stop()
+    if args.json:
+        print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
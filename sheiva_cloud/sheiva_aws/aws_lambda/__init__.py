@@ -1 +1,22 @@
-from . import event_handlers
+"""
+Submodules are imported on first access so importing this package
+does not pull in the dependencies of every Lambda function.
+"""
+
+import importlib
+from typing import Any
+
+_SUBMODULES = (
+    "concurrency",
+    "event_handlers",
+    "local_runner",
+    "scrape_cache",
+    "scrape_events",
+    "transform_events",
+)
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _SUBMODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return importlib.import_module(f".{name}", __name__)
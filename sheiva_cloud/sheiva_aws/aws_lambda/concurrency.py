@@ -0,0 +1,153 @@
+"""
+Adaptive concurrency for scraping.
+
+Urls are scraped in rounds of 'concurrency' urls. After each round the
+controller adjusts the concurrency with AIMD, additive increase and
+multiplicative decrease: it grows by 'increase' while the round's
+failure rate and latency are healthy and is multiplied by
+'decrease_factor' when either spikes. Kuda reports timeouts as failed
+scrapes, so they count as failures.
+
+A controller is shared by the messages scraped concurrently and kept
+for the lifetime of the Lambda execution environment, so a warm
+invocation starts at the concurrency the last one settled on.
+"""
+
+import threading
+from typing import TypedDict
+
+
+class ConcurrencyStats(TypedDict):
+    """
+    Structure of the concurrency chosen during an invocation.
+    concurrency: concurrency at the end of the invocation
+    min_concurrency: lowest concurrency used
+    max_concurrency: highest concurrency used
+    rounds: number of scrape rounds
+    urls: number of urls scraped
+    failed: number of failed scrapes
+    """
+
+    concurrency: int
+    min_concurrency: int
+    max_concurrency: int
+    rounds: int
+    urls: int
+    failed: int
+
+
+# pylint: disable=too-many-instance-attributes
+class AimdController:
+    """
+    Additive increase, multiplicative decrease concurrency controller.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        initial: int = 10,
+        minimum: int = 1,
+        maximum: int = 50,
+        increase: int = 1,
+        decrease_factor: float = 0.5,
+        max_failure_rate: float = 0.1,
+        max_round_seconds: float = 10.0,
+    ):
+        """
+        Args:
+            initial (int): concurrency of the first round
+            minimum (int): lowest concurrency
+            maximum (int): highest concurrency
+            increase (int): added to the concurrency after a healthy
+                round
+            decrease_factor (float): the concurrency is multiplied by
+                it after an unhealthy round
+            max_failure_rate (float): highest healthy failure rate of
+                a round
+            max_round_seconds (float): longest healthy round
+        """
+
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.max_failure_rate = max_failure_rate
+        self.max_round_seconds = max_round_seconds
+        self._concurrency = min(max(initial, minimum), maximum)
+        self._lock = threading.Lock()
+        self.start_invocation()
+
+    @property
+    def concurrency(self) -> int:
+        """
+        Returns:
+            int: concurrency of the next round
+        """
+
+        with self._lock:
+            return self._concurrency
+
+    def start_invocation(self) -> None:
+        """
+        Resets the stats of the invocation, not the concurrency.
+        """
+
+        with self._lock:
+            self._stats = ConcurrencyStats(
+                concurrency=self._concurrency,
+                min_concurrency=self._concurrency,
+                max_concurrency=self._concurrency,
+                rounds=0,
+                urls=0,
+                failed=0,
+            )
+
+    def record(self, num_urls: int, num_failed: int, seconds: float) -> int:
+        """
+        Records the outcome of a round and adjusts the concurrency.
+        Args:
+            num_urls (int): number of urls scraped in the round
+            num_failed (int): number of failed scrapes
+            seconds (float): duration of the round
+        Returns:
+            int: concurrency of the next round
+        """
+
+        if not num_urls:
+            return self.concurrency
+        healthy = (
+            num_failed / num_urls <= self.max_failure_rate
+            and seconds <= self.max_round_seconds
+        )
+        with self._lock:
+            if healthy:
+                self._concurrency = min(
+                    self._concurrency + self.increase, self.maximum
+                )
+            else:
+                self._concurrency = max(
+                    int(self._concurrency * self.decrease_factor),
+                    self.minimum,
+                )
+            stats = self._stats
+            stats["concurrency"] = self._concurrency
+            stats["min_concurrency"] = min(
+                stats["min_concurrency"], self._concurrency
+            )
+            stats["max_concurrency"] = max(
+                stats["max_concurrency"], self._concurrency
+            )
+            stats["rounds"] += 1
+            stats["urls"] += num_urls
+            stats["failed"] += num_failed
+            return self._concurrency
+
+    def invocation_stats(self) -> ConcurrencyStats:
+        """
+        Returns:
+            ConcurrencyStats: the concurrency chosen since
+                'start_invocation'
+        """
+
+        with self._lock:
+            return ConcurrencyStats(**self._stats)
@@ -3,50 +3,107 @@ Lambda function for scraping workout links.
 Requires the following environment variables:
     - MAIN_QUEUE: url of the workout link SQS queue
     - BUCKET: name of the s3 sheiva bucket
+    - MAX_CONCURRENT_MESSAGES: number of records scraped concurrently
+    - ASYNC_BATCH_SIZE: urls of a record scraped concurrently, the
+        initial value if ADAPTIVE_CONCURRENCY is 'true'
+    - ADAPTIVE_CONCURRENCY: adapt ASYNC_BATCH_SIZE to the failure
+        rate and latency of the scrapes, 'true' by default
+    - MAX_ASYNC_BATCH_SIZE: highest adaptive concurrency
+    - DEADLINE_MARGIN_SECONDS: time before the Lambda timeout at which
+        scraping stops and the unscraped urls are requeued
+    - SCRAPE_CACHE_ENABLED: cache scrape results in memory and /tmp
+        across warm invocations, 'true' by default
+    - SCRAPE_CACHE_TTL_SECONDS: age at which a cached result expires
+    - SCRAPE_OUTPUT_CODEC: codec of the scraped files e.g. 'jsonl-gzip'
+    - URL_INDEX_ENABLED: skip urls in the scraped url index, 'true'
+        by default
 """
 
 import os
 
-import boto3
 from kuda.scrapers import parse_workout_html
 
-from sheiva_cloud.sheiva_aws import aws_lambda, sqs
+from sheiva_cloud.sheiva_aws import client_factory, metrics, sqs
+from sheiva_cloud.sheiva_aws.aws_lambda import (
+    concurrency,
+    scrape_cache,
+    scrape_events,
+)
+from sheiva_cloud.sheiva_aws.s3 import url_index
 
 ASYNC_BATCH_SIZE = int(os.getenv("ASYNC_BATCH_SIZE", "10"))
+MAX_CONCURRENT_MESSAGES = int(os.getenv("MAX_CONCURRENT_MESSAGES", "10"))
+SCRAPE_OUTPUT_CODEC = os.getenv("SCRAPE_OUTPUT_CODEC", "jsonl-gzip")
+URL_INDEX_ENABLED = os.getenv("URL_INDEX_ENABLED", "true") == "true"
+ADAPTIVE_CONCURRENCY = os.getenv("ADAPTIVE_CONCURRENCY", "true") == "true"
+MAX_ASYNC_BATCH_SIZE = int(os.getenv("MAX_ASYNC_BATCH_SIZE", "50"))
+DEADLINE_MARGIN_SECONDS = float(os.getenv("DEADLINE_MARGIN_SECONDS", "30"))
+SCRAPE_CACHE_ENABLED = os.getenv("SCRAPE_CACHE_ENABLED", "true") == "true"
+SCRAPE_CACHE_TTL_SECONDS = float(
+    os.getenv("SCRAPE_CACHE_TTL_SECONDS", "86400")
+)
+
+# Kept across warm invocations
+CONCURRENCY_CONTROLLER = (
+    concurrency.AimdController(
+        initial=ASYNC_BATCH_SIZE, maximum=MAX_ASYNC_BATCH_SIZE
+    )
+    if ADAPTIVE_CONCURRENCY
+    else None
+)
+SCRAPE_CACHE = (
+    scrape_cache.ScrapeCache(ttl_seconds=SCRAPE_CACHE_TTL_SECONDS)
+    if SCRAPE_CACHE_ENABLED
+    else None
+)
 
 
-# pylint: disable=unused-argument
+@metrics.flushed
 def handler(event, context):
     """
-    Lambda handler for scraping workout links.
+    Lambda handler for scraping workout links. Every record in the
+    batch is processed, failed records are reported back to Lambda
+    via 'batchItemFailures' so the event source mapping must have
+    'ReportBatchItemFailures' enabled. Urls left unscraped near the
+    timeout are requeued to the scraper queue.
     Args:
         event (Dict): event object
         context (Dict): context object
+    Returns:
+        Dict: the batch item failures response
     """
 
-    boto3_session = boto3.Session()
-    sqs_client = boto3_session.client("sqs")
-    s3_client = boto3_session.client("s3")
+    sqs_client = client_factory.get_client("sqs")
+    s3_client = client_factory.get_client("s3")
 
-    messages = sqs.utils.process_sqs_event(
-        sqs_event=event,
-        parse_function=sqs.message_parsers.scrape_message_parser,
-    )
-
-    sqs_response = aws_lambda.event_handlers.process_scrape_event(
+    return scrape_events.ScrapeEvent(
+        event=event,
         s3_client=s3_client,
-        message=messages[0],
-        html_parser=parse_workout_html,
-    )
-
-    sqs.utils.process_sqs_response(
-        source_queue=sqs.StandardSqsClient(
-            queue_url=sqs.WORKOUT_SCRAPER_QUEUE,
-            sqs_client=sqs_client,
-        ),
         dlq=sqs.StandardSqsClient(
             queue_url=sqs.WORKOUT_SCRAPER_DEADLETTER_QUEUE,
             sqs_client=sqs_client,
+            s3_client=s3_client,
         ),
-        sqs_response=sqs_response,
-    )
+        scraper=scrape_events.Scraper(
+            html_parser=parse_workout_html,
+            async_batch_size=ASYNC_BATCH_SIZE,
+            concurrency_controller=CONCURRENCY_CONTROLLER,
+            scrape_cache=SCRAPE_CACHE,
+        ),
+        max_workers=MAX_CONCURRENT_MESSAGES,
+        codec=SCRAPE_OUTPUT_CODEC,
+        scraped_url_index=url_index.ScrapedUrlIndex(s3_client=s3_client)
+        if URL_INDEX_ENABLED
+        else None,
+        deadline=scrape_events.Deadline(
+            queue=sqs.StandardSqsClient(
+                queue_url=sqs.WORKOUT_SCRAPER_QUEUE,
+                sqs_client=sqs_client,
+                s3_client=s3_client,
+            ),
+            get_remaining_time_in_millis=context.get_remaining_time_in_millis,
+            margin_seconds=DEADLINE_MARGIN_SECONDS,
+        )
+        if hasattr(context, "get_remaining_time_in_millis")
+        else None,
+    ).process()
@@ -4,113 +4,179 @@ Requires the following environment variables:
     - WORKOUT_SCRAPER_QUEUE
     - WORKOUT_SCRAPER_TRIGGER_QUEUE: url of the workout link SQS queue
     - WORKOUT_LINKS_BUCKET: name of the s3 bucket
+    - GENDER: gender of the workout link store to claim links from
+    - MESSAGES_PER_AGE_GROUP: messages sent per age group per run
+    - URL_INDEX_ENABLED: skip links in the scraped url index, 'true'
+        by default
+    - URL_MESSAGE_ENCODING: encoding of the links in each message, one
+        of 'sqs.message_parsers.URL_ENCODINGS', 'v1' by default
+    - CLAIM_CHECK_BUCKET: bucket oversized messages are put in, see
+        'sqs.claim_check', the scraped data bucket by default
 """
 
-import json
 import os
-from typing import List
+from typing import List, Optional, Tuple
 
-import boto3
-
-from sheiva_cloud.sheiva_aws import s3, sqs
+from sheiva_cloud.sheiva_aws import client_factory, metrics, sqs
+from sheiva_cloud.sheiva_aws.s3 import link_store, url_index
 
 GENDER = os.getenv("GENDER", "")
-
-
-def get_workout_link_bucket_dirs(s3_client: boto3.client) -> List:
-    """
-    Builds a list of workout link bucket dirs.
-    Returns:
-        List: list of workout link buckets dirs.
-    """
-
-    print("Getting workout link bucket dirs")
-    paginator = s3_client.get_paginator("list_objects_v2")
-    page_iterator = paginator.paginate(Bucket=s3.SHEIVA_SCRAPE_BUCKET)
-    return [
-        f["Key"]
-        for f in page_iterator.search(
-            "Contents[?starts_with(Key, 'highrise/user-data/user-workout-links"
-            f"/{GENDER}/') && ends_with(Key, '.json')]"
-        )
-    ]
+# Number of messages of 'num_workout_links_to_scrape' links sent
+# per age group on each run.
+MESSAGES_PER_AGE_GROUP = int(os.getenv("MESSAGES_PER_AGE_GROUP", "2"))
+URL_INDEX_ENABLED = os.getenv("URL_INDEX_ENABLED", "true") == "true"
+# 'json' sends links in the format read by scrapers that predate the
+# url codec
+URL_MESSAGE_ENCODING = os.getenv(
+    "URL_MESSAGE_ENCODING", sqs.message_parsers.DEFAULT_URL_ENCODING
+)
 
 
 def send_workout_links_to_queue(
     workout_links: List,
     bucket_key: str,
-    workout_link_queue: boto3.client,
-) -> str:
+    workout_link_queue: sqs.StandardSqsClient,
+    links_per_message: int,
+) -> int:
     """
-    Sends workout links to the workout link queue.
+    Sends workout links to the workout link queue, as batch requests.
+    Each message holds up to 'links_per_message' links, fewer if more
+    would not fit in an SQS message.
     Args:
         workout_links (List): list of workout links
         bucket_key (str): key of the s3 bucket
-        workout_link_queue (boto3.client): workout link queue
+        workout_link_queue (sqs.StandardSqsClient): workout link queue
+        links_per_message (int): most links in each message
+    Returns:
+        int: number of links, from the start of 'workout_links', that
+            were sent before the first failed message.
     """
 
     print(
         f"Sending {len(workout_links)} workout links "
         f"bucket_key: '{bucket_key}' to workout link queue"
     )
-    workout_link_queue.send_message(
-        message_body=json.dumps(workout_links),
-        message_attributes={
-            "bucket_key": {
-                "StringValue": bucket_key,
-                "DataType": "String",
-            }
-        },
+    message_attributes = {
+        "bucket_key": {
+            "StringValue": bucket_key,
+            "DataType": "String",
+        }
+    }
+    packed = sqs.message_parsers.pack_urls(
+        urls=workout_links,
+        max_bytes=sqs.MAX_MESSAGE_BYTES
+        - sqs.message_size(
+            {"message_body": "", "message_attributes": message_attributes}
+        ),
+        max_urls=links_per_message,
+        encoding=URL_MESSAGE_ENCODING,
+    )
+    link_batches = [link_batch for link_batch, _ in packed]
+    result = workout_link_queue.send_messages(
+        messages=[
+            {"message_body": body, "message_attributes": message_attributes}
+            for _, body in packed
+        ]
     )
+    for failure in result["failed"]:
+        print(f"Error sending workout links to queue: {failure}")
 
-    return "Success"
+    first_failed = min(
+        (int(failure["id"]) for failure in result["failed"]),
+        default=len(link_batches),
+    )
+    return sum(len(link_batch) for link_batch in link_batches[:first_failed])
+
+
+def skip_scraped_links(
+    workout_links: List[str],
+    scraped_url_index: Optional[url_index.ScrapedUrlIndex],
+) -> Tuple[List[str], List[int]]:
+    """
+    Removes the links that have already been scraped.
+    Args:
+        workout_links (List[str]): claimed workout links
+        scraped_url_index (url_index.ScrapedUrlIndex, optional):
+            scraped url index, nothing is removed if None
+    Returns:
+        Tuple[List[str], List[int]]: the links to send and their
+            positions in 'workout_links'.
+    """
+
+    if scraped_url_index is None:
+        return workout_links, list(range(len(workout_links)))
+    try:
+        scraped = scraped_url_index.contains(workout_links)
+    # pylint: disable=broad-except
+    except Exception as e:
+        print(f"Error reading the scraped url index: {repr(e)}")
+        return workout_links, list(range(len(workout_links)))
+
+    positions = [i for i, is_scraped in enumerate(scraped) if not is_scraped]
+    print(
+        f"Skipping {len(workout_links) - len(positions)} workout links "
+        "already scraped"
+    )
+    return [workout_links[i] for i in positions], positions
 
 
 def get_and_post_workout_links(
-    s3_client: boto3.client,
-    workout_link_queue: boto3.resource,
-    workout_link_bucket_dirs: List,
+    workout_link_store: link_store.LinkStore,
+    workout_link_queue: sqs.StandardSqsClient,
     num_workout_links_to_scrape: int,
+    scraped_url_index: Optional[url_index.ScrapedUrlIndex] = None,
 ) -> str:
     """
-    Gets and posts workout links to the workout link queue.
+    Claims workout links from each age group of the link store and
+    posts them to the workout link queue. The cursor of an age group
+    is only moved past the links that were sent, or skipped because
+    they were already scraped.
     Args:
-        s3_client (boto3.client): s3 client
-        workout_link_queue (boto3.resource): workout link queue
-        workout_link_bucket_dirs (List): list of workout link bucket dirs
+        workout_link_store (link_store.LinkStore): workout link store
+        workout_link_queue (sqs.StandardSqsClient): workout link queue
         num_workout_links_to_scrape (int): number of workout links
-            to scrape per age group
+            to scrape per message
+        scraped_url_index (url_index.ScrapedUrlIndex, optional):
+            scraped url index of the links to skip
     """
 
-    for bucket_dir in workout_link_bucket_dirs*2:
-        print(f"Getting workout links from bucket: {bucket_dir}")
-        bucket = s3_client.get_object(
-            Bucket=s3.SHEIVA_SCRAPE_BUCKET, Key=bucket_dir
+    for age_group in workout_link_store.age_groups():
+        print(f"Getting workout links from age group: {age_group}")
+        workout_links, cursor = workout_link_store.read_links(
+            age_group=age_group,
+            num_links=num_workout_links_to_scrape * MESSAGES_PER_AGE_GROUP,
         )
-        bucket_contents = json.loads(bucket["Body"].read().decode("utf-8"))
-        workout_links = bucket_contents[:num_workout_links_to_scrape]
-        print(f"Sending {len(workout_links)} workout links to queue")
-        age_group = bucket_dir.split("/")[-1].split(".")[0]
-        send_workout_links_to_queue(
-            workout_links=workout_links,
-            bucket_key=f"highrise/workout-data/{GENDER}/{age_group}",
-            workout_link_queue=workout_link_queue,
+        if not workout_links:
+            print(f"No workout links left in age group: {age_group}")
+            continue
+
+        links_to_send, positions = skip_scraped_links(
+            workout_links=workout_links, scraped_url_index=scraped_url_index
         )
-        print(
-            f"Deleting {len(workout_links)} workout "
-            f"links from bucket {bucket_dir}"
+        num_sent = 0
+        if links_to_send:
+            num_sent = send_workout_links_to_queue(
+                workout_links=links_to_send,
+                bucket_key=f"highrise/workout-data/{GENDER}/{age_group}",
+                workout_link_queue=workout_link_queue,
+                links_per_message=num_workout_links_to_scrape,
+            )
+        # Skipped links before the first unsent link are claimed too
+        num_claimed = (
+            positions[num_sent]
+            if num_sent < len(links_to_send)
+            else len(workout_links)
         )
-        bucket_contents = bucket_contents[num_workout_links_to_scrape:]
-        s3_client.put_object(
-            Bucket=s3.SHEIVA_SCRAPE_BUCKET,
-            Key=bucket_dir,
-            Body=json.dumps(bucket_contents),
+        print(f"Claiming {num_claimed} workout links from {age_group}")
+        workout_link_store.advance(
+            age_group=age_group, cursor=cursor, num_links=num_claimed
         )
     print("Finished sending workout links to queue")
     return "Success"
 
 
 # pylint: disable=unused-argument
+@metrics.flushed
 def handler(event, context):
     """
     Lambda handler for scraping workout links.
@@ -120,12 +186,13 @@ def handler(event, context):
     """
 
     print("Received SQS event")
-    boto3_session = boto3.Session()
-    s3_client = boto3_session.client("s3")
-    sqs_client = boto3_session.client("sqs")
+    s3_client = client_factory.get_client("s3")
+    sqs_client = client_factory.get_client("sqs")
 
     workout_link_queue = sqs.StandardSqsClient(
-        queue_url=sqs.WORKOUT_SCRAPER_QUEUE, sqs_client=sqs_client
+        queue_url=sqs.WORKOUT_SCRAPER_QUEUE,
+        sqs_client=sqs_client,
+        s3_client=s3_client,
     )
 
     workout_scrape_trigger_messages = sqs.utils.process_sqs_event(
@@ -138,15 +205,24 @@ def handler(event, context):
         receipt_handle,
     ) = workout_scrape_trigger_messages[0]
 
-    workout_link_bucket_dirs = get_workout_link_bucket_dirs(
-        s3_client=s3_client
-    )
+    scraped_url_index = None
+    if URL_INDEX_ENABLED:
+        scraped_url_index = url_index.ScrapedUrlIndex(s3_client=s3_client)
+        try:
+            # Each gender's trigger compacts into its own shards
+            num_compacted = scraped_url_index.compact(owner=GENDER)
+            print(f"Compacted {num_compacted} scraped url index deltas")
+        # pylint: disable=broad-except
+        except Exception as e:
+            print(f"Error compacting the scraped url index: {repr(e)}")
 
     get_and_post_workout_links(
-        s3_client=s3_client,
+        workout_link_store=link_store.LinkStore(
+            s3_client=s3_client, gender=GENDER
+        ),
         workout_link_queue=workout_link_queue,
-        workout_link_bucket_dirs=workout_link_bucket_dirs,
         num_workout_links_to_scrape=num_workout_links_to_scrape,
+        scraped_url_index=scraped_url_index,
     )
 
     print("Deleting workout scrape trigger message")
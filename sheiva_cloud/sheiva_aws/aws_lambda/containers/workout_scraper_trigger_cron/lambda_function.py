@@ -7,9 +7,7 @@ Requires the following environment variables:
 
 import os
 
-import boto3
-
-from sheiva_cloud.sheiva_aws import sqs
+from sheiva_cloud.sheiva_aws import client_factory, metrics, sqs
 
 NUMBER_WORKOUT_LINKS_PER_MESSAGE = os.getenv(
     "NUMBER_WORKOUT_LINKS_PER_MESSAGE", None
@@ -17,6 +15,7 @@ NUMBER_WORKOUT_LINKS_PER_MESSAGE = os.getenv(
 
 
 # pylint: disable=unused-argument
+@metrics.flushed
 def handler(event, context):
     """
     Lambda handler for putting messages on the
@@ -27,8 +26,7 @@ def handler(event, context):
     """
 
     print("Received SQS event")
-    boto3_session = boto3.Session()
-    sqs_client = boto3_session.client("sqs")
+    sqs_client = client_factory.get_client("sqs")
 
     queue = sqs.StandardSqsClient(
         queue_url=sqs.WORKOUT_SCRAPER_TRIGGER_QUEUE, sqs_client=sqs_client
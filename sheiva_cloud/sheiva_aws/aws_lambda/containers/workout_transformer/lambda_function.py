@@ -1,25 +1,50 @@
 """
 Lambda function for transforming a Highrise Workout json file into
-four seperate csv files which aim to mimic the Grau ORM model structures
+four seperate csv or Parquet files which aim to mimic the Grau ORM
+model structures
 """
 
-import boto3
+import os
 
-from sheiva_cloud.sheiva_aws import aws_lambda
+from sheiva_cloud.sheiva_aws import client_factory, metrics, sqs
+from sheiva_cloud.sheiva_aws.aws_lambda import transform_events
+
+# Number of workouts streamed through the transform at a time,
+# 0 reads and transforms the whole file in one go.
+TRANSFORM_BATCH_SIZE = int(os.getenv("TRANSFORM_BATCH_SIZE", "500"))
+# 'csv' or 'parquet'
+TRANSFORM_OUTPUT_FORMAT = os.getenv("TRANSFORM_OUTPUT_FORMAT", "csv")
+# Number of files of the batch transformed concurrently
+TRANSFORM_MAX_WORKERS = int(os.getenv("TRANSFORM_MAX_WORKERS", "4"))
 
 
 # pylint: disable=unused-argument
+@metrics.flushed
 def handler(event, context):
     """
-    Lambda handler for scraping workout links.
+    Lambda handler for transforming workout files. Every record in
+    the batch is transformed, failed records are reported back to
+    Lambda via 'batchItemFailures' so the event source mapping must
+    have 'ReportBatchItemFailures' enabled. Records that fail to parse
+    are sent to the dead-letter queue instead.
     Args:
         event (Dict): event object
         context (Dict): context object
+    Returns:
+        Dict: the batch item failures response
     """
 
-    boto3_session = boto3.Session()
-    s3_client = boto3_session.client("s3")
+    s3_client = client_factory.get_client("s3")
 
-    aws_lambda.event_handlers.HighriseWorkoutTransformEvent(
-        event=event, s3_client=s3_client
+    return transform_events.HighriseWorkoutTransformEvent(
+        event=event,
+        s3_client=s3_client,
+        batch_size=TRANSFORM_BATCH_SIZE,
+        output_format=TRANSFORM_OUTPUT_FORMAT,
+        max_workers=TRANSFORM_MAX_WORKERS,
+        dlq=sqs.StandardSqsClient(
+            queue_url=sqs.WORKOUT_FILE_TRANSFORM_QUEUE_DEAD_LETTER_QUEUE,
+            sqs_client=client_factory.get_client("sqs"),
+            s3_client=s3_client,
+        ),
     ).process()
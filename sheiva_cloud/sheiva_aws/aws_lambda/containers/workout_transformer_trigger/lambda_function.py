@@ -1,6 +1,7 @@
 """
 Lambda function that sends messages to the workout file
-transform queue.
+transform queue. Candidates come from the transform manifest which
+is bootstrapped from a full bucket listing the first time it runs.
 """
 
 import os
@@ -9,9 +10,16 @@ from typing import List
 
 import boto3
 
-from sheiva_cloud.sheiva_aws import s3, sqs
+from sheiva_cloud.sheiva_aws import client_factory, metrics, sqs
+from sheiva_cloud.sheiva_aws.s3 import (
+    listing,
+    object_codecs,
+    transform_manifest,
+)
 
 TRANSFORM_LIMIT = int(os.getenv("TRANSFORM_LIMIT", "10"))
+SCRAPED_DATA_DIR = "highrise/workout-data"
+TRANSFORMED_OUTPUT_DIR = "highrise/transformed/workout-data"
 
 
 def get_scraped_file_paths(s3_client: boto3.client) -> List:
@@ -23,14 +31,15 @@ def get_scraped_file_paths(s3_client: boto3.client) -> List:
     """
 
     print("Getting scraped workout files")
-    paginator = s3_client.get_paginator("list_objects_v2")
-    page_iterator = paginator.paginate(Bucket=s3.SHEIVA_SCRAPE_BUCKET)
+    # Fans out over the gender/age group sub-prefixes
     return [
-        f["Key"]
-        for f in page_iterator.search(
-            "Contents[?starts_with(Key, 'highrise/workout-data') "
-            "&& ends_with(Key, '.json')]"
+        key
+        for key in listing.list_keys(
+            s3_client=s3_client,
+            prefix=f"{SCRAPED_DATA_DIR}/",
+            fan_out_depth=2,
         )
+        if object_codecs.has_codec_extension(key)
     ]
 
 
@@ -43,37 +52,43 @@ def get_transformed_file_paths(s3_client: boto3.client) -> List[str]:
     """
 
     print("Getting transformed workout files")
-    paginator = s3_client.get_paginator("list_objects_v2")
-    page_iterator = paginator.paginate(Bucket=s3.SHEIVA_SCRAPE_BUCKET)
     return [
-        f["Key"]
-        for f in page_iterator.search(
-            "Contents[?starts_with(Key, "
-            "'highrise/workout-data/transformed/workouts') "
-            "&& ends_with(Key, '.csv')]"
+        key
+        for key in listing.list_keys(
+            s3_client=s3_client, prefix=f"{TRANSFORMED_OUTPUT_DIR}/workouts/"
         )
+        if key.endswith((".csv", ".parquet"))
     ]
 
 
 def get_transform_canidates(s3_client: boto3.client) -> List[str]:
     """
-    Retrives scraped files and transformed files. A transformed
-    file has the same uuid file name as it's source file. Gets
-    a list of all the scraped files that has not been transformed.
+    Loads the transform manifest, bootstrapping it from the scraped
+    and transformed file listings if it does not exist. A transformed
+    file has the same uuid file name as it's source file. Folds in the
+    files scraped and transformed since the last run, saves the
+    manifest, prunes the journal and gets all the scraped files that
+    have not been transformed.
     Returns:
         List[str]: list of all scraped files to be transformed.
     """
 
-    scraped_files = get_scraped_file_paths(s3_client=s3_client)
-    print(f"Retreived {len(scraped_files)} scraped file bucket keys")
-    transformed_files = get_transformed_file_paths(s3_client=s3_client)
-    print(f"Retreived {len(transformed_files)} transformed file uuids")
-    transformed_files_uuids = [key.split(".")[0] for key in transformed_files]
-    return [
-        key
-        for key in scraped_files
-        if key.split(".")[0] not in transformed_files_uuids
-    ]
+    manifest = transform_manifest.TransformManifest.load(s3_client)
+    if manifest is None:
+        print("No transform manifest found, bootstrapping from listings")
+        manifest = transform_manifest.TransformManifest.from_listings(
+            scraped_files=get_scraped_file_paths(s3_client=s3_client),
+            transformed_files=get_transformed_file_paths(s3_client=s3_client),
+        )
+    manifest.sync(s3_client=s3_client)
+    manifest.save(s3_client=s3_client)
+    num_pruned = manifest.prune_journal(s3_client=s3_client)
+    print(f"Pruned {num_pruned} transform journal entries")
+    print(
+        f"Transform manifest has {len(manifest.scraped)} scraped and "
+        f"{len(manifest.transformed)} transformed files"
+    )
+    return manifest.candidates()
 
 
 def send_messages_to_transform_queue(
@@ -86,23 +101,33 @@ def send_messages_to_transform_queue(
     transform_queue = sqs.StandardSqsClient(
         queue_url=sqs.WORKOUT_FILE_TRANSFORM_QUEUE, sqs_client=sqs_client
     )
-    for message in files_to_transform:
-        transform_queue.send_message(
-            message_body="Empty Body",
-            message_attributes={
-                "s3_input_file": {
-                    "DataType": "String",
-                    "StringValue": message,
+    result = transform_queue.send_messages(
+        messages=[
+            {
+                "message_body": "Empty Body",
+                "message_attributes": {
+                    "s3_input_file": {
+                        "DataType": "String",
+                        "StringValue": message,
+                    },
+                    "s3_output_bucket_key": {
+                        "DataType": "String",
+                        "StringValue": TRANSFORMED_OUTPUT_DIR,
+                    },
                 },
-                "s3_output_bucket_key": {
-                    "DataType": "String",
-                    "StringValue": "highrise/transformed/workout-data",
-                },
-            },
+            }
+            for message in files_to_transform
+        ]
+    )
+    for failure in result["failed"]:
+        print(
+            "Error sending transform message for "
+            f"'{files_to_transform[int(failure['id'])]}': {failure}"
         )
 
 
 # pylint: disable=unused-argument
+@metrics.flushed
 def handler(event, context):
     """
     Lambda handler for scraping workout links.
@@ -111,12 +136,12 @@ def handler(event, context):
         context (Dict): context object
     """
 
-    boto3_session = boto3.Session()
-    s3_client = boto3_session.client("s3")
-    sqs_client = boto3_session.client("sqs")
+    s3_client = client_factory.get_client("s3")
+    sqs_client = client_factory.get_client("sqs")
 
+    transform_canidates = get_transform_canidates(s3_client=s3_client)
     files_to_transform = sample(
-        get_transform_canidates(s3_client=s3_client), TRANSFORM_LIMIT
+        transform_canidates, min(TRANSFORM_LIMIT, len(transform_canidates))
     )
 
     print(f"Sending {len(files_to_transform)} messages to transform queue")
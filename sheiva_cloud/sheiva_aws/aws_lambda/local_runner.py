@@ -0,0 +1,532 @@
+"""
+Runs the scrape and transform event handlers on a single machine, for
+backfills too large to be worth millions of Lambda invocations.
+
+The work is split into the same SQS records the Lambdas receive and
+batches of them are handed to a pool of worker processes, each calling
+the handler's event processor like one invocation would, so every core
+is kept busy. Records reported in 'batchItemFailures' are retried like
+SQS would redeliver them.
+
+Storage is pluggable:
+    - 'local': a directory laid out like the bucket, see
+        'local_clients'. Dead-lettered messages are written to
+        '<root>/.queues/'.
+    - 's3': the real bucket and queues.
+
+Commands:
+    - transform: transforms the scraped files under '--prefix' that
+        have not been transformed, taken from the transform manifest.
+    - scrape: scrapes the unclaimed links of a gender's link store and
+        claims the links of every message that was processed.
+
+Usage:
+    python -m sheiva_cloud.sheiva_aws.aws_lambda.local_runner \\
+        --storage local --root ./data transform
+    python -m sheiva_cloud.sheiva_aws.aws_lambda.local_runner \\
+        --storage s3 --processes 32 scrape --gender male
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+import uuid
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+
+import boto3
+from kuda.scrapers import parse_workout_html
+
+from sheiva_cloud.sheiva_aws import client_factory, local_clients, metrics, sqs
+from sheiva_cloud.sheiva_aws.aws_lambda import (
+    concurrency,
+    scrape_events,
+    transform_events,
+)
+from sheiva_cloud.sheiva_aws.s3 import (
+    link_store,
+    listing,
+    object_codecs,
+    transform_manifest,
+    url_index,
+)
+
+SCRAPED_DATA_DIR = "highrise/workout-data"
+TRANSFORMED_OUTPUT_DIR = "highrise/transformed/workout-data"
+QUEUES_DIR = ".queues"
+
+# State of each worker process, set by '_init_worker'
+_worker: Dict = {}
+
+
+def get_clients(
+    storage: str, root: Optional[str] = None
+) -> Tuple[boto3.client, boto3.client]:
+    """
+    Builds the clients of a storage backend.
+    Args:
+        storage (str): 'local' or 's3'
+        root (str, optional): directory of the local storage,
+            required with 'local'
+    Returns:
+        Tuple[boto3.client, boto3.client]: s3 and sqs clients
+    Raises:
+        ValueError: if the storage is unknown or 'root' is missing
+    """
+
+    if storage == "local":
+        if root is None:
+            raise ValueError("A root is required with local storage")
+        return (
+            local_clients.LocalS3Client(root=root),
+            local_clients.LocalSqsClient(root=os.path.join(root, QUEUES_DIR)),
+        )
+    if storage == "s3":
+        # boto3 clients are not safe to share across a fork
+        client_factory.reset()
+        return (
+            client_factory.get_client("s3"),
+            client_factory.get_client("sqs"),
+        )
+    raise ValueError(f"Unknown storage: '{storage}'")
+
+
+def _init_worker(storage: str, root: Optional[str], options: Dict) -> None:
+    """
+    Creates the clients and the state kept across the batches of a
+    worker process, like a warm Lambda execution environment.
+    """
+
+    s3_client, sqs_client = get_clients(storage=storage, root=root)
+    client_factory.set_client("s3", s3_client)
+    client_factory.set_client("sqs", sqs_client)
+    _worker["options"] = options
+    _worker["concurrency_controller"] = (
+        concurrency.AimdController(
+            initial=options["async_batch_size"],
+            maximum=options["max_async_batch_size"],
+        )
+        if options.get("adaptive_concurrency")
+        else None
+    )
+    _worker["scraped_url_index"] = (
+        url_index.ScrapedUrlIndex(s3_client=s3_client)
+        if options.get("url_index_enabled")
+        else None
+    )
+
+
+def sqs_record(
+    body: str, attributes: Dict[str, str]
+) -> sqs.ReceivedSqsMessage:
+    """
+    Builds an SQS record as delivered to a Lambda handler.
+    Args:
+        body (str): message body
+        attributes (Dict[str, str]): string message attributes
+    Returns:
+        Dict: the record
+    """
+
+    message_id = str(uuid.uuid4())
+    return sqs.ReceivedSqsMessage(
+        messageId=message_id,
+        receiptHandle=message_id,
+        body=body,
+        messageAttributes={
+            name: {"stringValue": value, "dataType": "String"}
+            for name, value in attributes.items()
+        },
+    )
+
+
+@metrics.flushed
+def _process_batch(
+    records: List[sqs.ReceivedSqsMessage], process_batch: Callable
+) -> List[str]:
+    """
+    Calls 'process_batch', flushing the metrics of the batch like an
+    invocation would.
+    """
+
+    return process_batch(records)
+
+
+def scrape_batch(records: List[sqs.ReceivedSqsMessage]) -> List[str]:
+    """
+    Processes a batch of scrape records in a worker process.
+    Args:
+        records (List[sqs.ReceivedSqsMessage]): SQS records of urls to scrape
+    Returns:
+        List[str]: ids of the records that failed
+    """
+
+    options = _worker["options"]
+    response = scrape_events.ScrapeEvent(
+        event={"Records": records},
+        s3_client=client_factory.get_client("s3"),
+        dlq=sqs.StandardSqsClient(
+            queue_url=sqs.WORKOUT_SCRAPER_DEADLETTER_QUEUE,
+            sqs_client=client_factory.get_client("sqs"),
+            s3_client=client_factory.get_client("s3"),
+        ),
+        scraper=scrape_events.Scraper(
+            html_parser=parse_workout_html,
+            async_batch_size=options["async_batch_size"],
+            concurrency_controller=_worker["concurrency_controller"],
+        ),
+        max_workers=options["max_concurrent_messages"],
+        codec=options["codec"],
+        scraped_url_index=_worker["scraped_url_index"],
+    ).process()
+    return [f["itemIdentifier"] for f in response["batchItemFailures"]]
+
+
+def transform_batch(records: List[sqs.ReceivedSqsMessage]) -> List[str]:
+    """
+    Processes a batch of transform records in a worker process.
+    Args:
+        records (List[sqs.ReceivedSqsMessage]): SQS records of files
+            to transform
+    Returns:
+        List[str]: ids of the records that failed
+    """
+
+    options = _worker["options"]
+    response = transform_events.HighriseWorkoutTransformEvent(
+        event={"Records": records},
+        s3_client=client_factory.get_client("s3"),
+        batch_size=options["transform_batch_size"],
+        output_format=options["output_format"],
+        max_workers=options["transform_max_workers"],
+        dlq=sqs.StandardSqsClient(
+            queue_url=sqs.WORKOUT_FILE_TRANSFORM_QUEUE_DEAD_LETTER_QUEUE,
+            sqs_client=client_factory.get_client("sqs"),
+            s3_client=client_factory.get_client("s3"),
+        ),
+    ).process()
+    return [f["itemIdentifier"] for f in response["batchItemFailures"]]
+
+
+# pylint: disable=too-many-arguments
+def run_records(
+    records: List[sqs.ReceivedSqsMessage],
+    process_batch: Callable[[List[sqs.ReceivedSqsMessage]], List[str]],
+    storage: str,
+    root: Optional[str],
+    options: Dict,
+    processes: int,
+    records_per_batch: int,
+    max_receives: int,
+) -> List[sqs.ReceivedSqsMessage]:
+    """
+    Processes records on a pool of worker processes, retrying failed
+    records until they have been received 'max_receives' times.
+    Args:
+        records (List[sqs.ReceivedSqsMessage]): SQS records to process
+        process_batch (Callable): processes a batch of records in a
+            worker and returns the ids of the failed records
+        storage (str): 'local' or 's3'
+        root (str, optional): directory of the local storage
+        options (Dict): options of the workers
+        processes (int): number of worker processes
+        records_per_batch (int): records per handler call
+        max_receives (int): number of times a record is processed
+            before it is given up on
+    Returns:
+        List[sqs.ReceivedSqsMessage]: the records that still failed
+    """
+
+    if not records:
+        return []
+    with multiprocessing.Pool(
+        processes=processes,
+        initializer=_init_worker,
+        initargs=(storage, root, options),
+    ) as pool:
+        for receive in range(1, max_receives + 1):
+            batches = [
+                records[i : i + records_per_batch]
+                for i in range(0, len(records), records_per_batch)
+            ]
+            print(
+                f"Processing {len(records)} records in {len(batches)} "
+                f"batches, attempt {receive}"
+            )
+            start = time.monotonic()
+            failed_ids = set()
+            for i, batch_failed_ids in enumerate(
+                pool.imap_unordered(
+                    partial(_process_batch, process_batch=process_batch),
+                    batches,
+                ),
+                start=1,
+            ):
+                failed_ids.update(batch_failed_ids)
+                if i % max(1, len(batches) // 20) == 0:
+                    print(
+                        f"{i}/{len(batches)} batches done in "
+                        f"{time.monotonic() - start:.1f}s"
+                    )
+            records = [r for r in records if r["messageId"] in failed_ids]
+            if not records:
+                break
+            print(f"{len(records)} records failed")
+    return records
+
+
+def get_transform_records(
+    s3_client: boto3.client, prefix: str
+) -> List[sqs.ReceivedSqsMessage]:
+    """
+    Builds a transform record for each scraped file under a prefix
+    that has not been transformed. The transform manifest is loaded,
+    or bootstrapped from listings, and synced like the transformer
+    trigger does.
+    Args:
+        s3_client (boto3.client): s3 client
+        prefix (str): prefix of the scraped files
+    Returns:
+        List[sqs.ReceivedSqsMessage]: the records
+    """
+
+    manifest = transform_manifest.TransformManifest.load(s3_client)
+    if manifest is None:
+        print("No transform manifest found, bootstrapping from listings")
+        manifest = transform_manifest.TransformManifest.from_listings(
+            scraped_files=(
+                key
+                for key in listing.list_keys(
+                    s3_client=s3_client,
+                    prefix=f"{SCRAPED_DATA_DIR}/",
+                    fan_out_depth=2,
+                )
+                if object_codecs.has_codec_extension(key)
+            ),
+            transformed_files=listing.list_keys(
+                s3_client=s3_client,
+                prefix=f"{TRANSFORMED_OUTPUT_DIR}/workouts/",
+            ),
+        )
+    manifest.sync(s3_client=s3_client)
+    manifest.save(s3_client=s3_client)
+    manifest.prune_journal(s3_client=s3_client)
+    return [
+        sqs_record(
+            "Empty Body",
+            {
+                "s3_input_file": key,
+                "s3_output_bucket_key": TRANSFORMED_OUTPUT_DIR,
+            },
+        )
+        for key in manifest.candidates()
+        if key.startswith(prefix)
+    ]
+
+
+def get_scrape_records(
+    store: link_store.LinkStore,
+    age_groups: Optional[List[str]],
+    links_per_message: int,
+    max_links: Optional[int],
+) -> Dict[str, Tuple[List[sqs.ReceivedSqsMessage], link_store.LinkCursor]]:
+    """
+    Builds the scrape records of the unclaimed links of each age
+    group, without claiming them.
+    Args:
+        store (link_store.LinkStore): link store
+        age_groups (List[str], optional): age groups to scrape,
+            defaults to all
+        links_per_message (int): number of links in each record
+        max_links (int, optional): most links read per age group
+    Returns:
+        Dict[str, Tuple[List[sqs.ReceivedSqsMessage],
+            link_store.LinkCursor]]: records and the cursor they were
+            read at, by age group.
+    """
+
+    records = {}
+    for age_group in age_groups or store.age_groups():
+        cursor = store.load_cursor(age_group)
+        links, cursor = store.read_links(
+            age_group=age_group,
+            num_links=max_links or cursor["total_links"],
+        )
+        print(f"Read {len(links)} unclaimed links of {age_group}")
+        records[age_group] = (
+            [
+                sqs_record(
+                    sqs.message_parsers.encode_urls(
+                        links[i : i + links_per_message]
+                    ),
+                    {
+                        "bucket_key": (
+                            f"{SCRAPED_DATA_DIR}/{store.gender}/{age_group}"
+                        )
+                    },
+                )
+                for i in range(0, len(links), links_per_message)
+            ],
+            cursor,
+        )
+    return records
+
+
+def claim_scraped_links(
+    store: link_store.LinkStore,
+    records: Dict[
+        str, Tuple[List[sqs.ReceivedSqsMessage], link_store.LinkCursor]
+    ],
+    failed_ids: set,
+) -> None:
+    """
+    Claims the links of each age group up to its first failed record.
+    Args:
+        store (link_store.LinkStore): link store
+        records (Dict): records and cursors from 'get_scrape_records'
+        failed_ids (set): ids of the failed records
+    """
+
+    for age_group, (age_group_records, cursor) in records.items():
+        num_claimed = 0
+        for record in age_group_records:
+            if record["messageId"] in failed_ids:
+                break
+            num_claimed += len(sqs.message_parsers.decode_urls(record["body"]))
+        print(f"Claiming {num_claimed} workout links from {age_group}")
+        store.advance(
+            age_group=age_group, cursor=cursor, num_links=num_claimed
+        )
+
+
+def main(args: argparse.Namespace) -> List[sqs.ReceivedSqsMessage]:
+    """
+    Runs a command.
+    Args:
+        args (argparse.Namespace): parsed command line arguments
+    Returns:
+        List[sqs.ReceivedSqsMessage]: records that still failed
+    """
+
+    s3_client, _ = get_clients(storage=args.storage, root=args.root)
+    options = {
+        "async_batch_size": args.async_batch_size,
+        "max_async_batch_size": args.max_async_batch_size,
+        "adaptive_concurrency": args.adaptive_concurrency,
+        "max_concurrent_messages": args.max_concurrent_messages,
+        "codec": args.codec,
+        "url_index_enabled": args.url_index,
+        "transform_batch_size": args.transform_batch_size,
+        "output_format": args.output_format,
+        "transform_max_workers": args.transform_max_workers,
+    }
+    run = partial(
+        run_records,
+        storage=args.storage,
+        root=args.root,
+        options=options,
+        processes=args.processes,
+        records_per_batch=args.records_per_batch,
+        max_receives=args.max_receives,
+    )
+
+    if args.command == "transform":
+        failed = run(
+            records=get_transform_records(s3_client, prefix=args.prefix),
+            process_batch=transform_batch,
+        )
+    else:
+        store = link_store.LinkStore(s3_client=s3_client, gender=args.gender)
+        records = get_scrape_records(
+            store=store,
+            age_groups=args.age_group,
+            links_per_message=args.links_per_message,
+            max_links=args.max_links,
+        )
+        failed = run(
+            records=[r for rs, _ in records.values() for r in rs],
+            process_batch=scrape_batch,
+        )
+        claim_scraped_links(
+            store=store,
+            records=records,
+            failed_ids={r["messageId"] for r in failed},
+        )
+    print(f"Finished with {len(failed)} failed records")
+    return failed
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parses the command line arguments.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Run the scrape or transform handlers locally."
+    )
+    parser.add_argument("--storage", choices=("local", "s3"), default="local")
+    parser.add_argument(
+        "--root", default="data", help="directory of the local storage"
+    )
+    parser.add_argument(
+        "--processes", type=int, default=multiprocessing.cpu_count()
+    )
+    parser.add_argument(
+        "--records-per-batch",
+        type=int,
+        default=10,
+        help="records per handler call, like the event source batch size",
+    )
+    parser.add_argument("--max-receives", type=int, default=3)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    transform = subparsers.add_parser("transform")
+    transform.add_argument("--prefix", default=f"{SCRAPED_DATA_DIR}/")
+    transform.add_argument("--transform-batch-size", type=int, default=500)
+    transform.add_argument(
+        "--output-format", choices=("csv", "parquet"), default="csv"
+    )
+    transform.add_argument("--transform-max-workers", type=int, default=4)
+
+    scrape = subparsers.add_parser("scrape")
+    scrape.add_argument("--gender", required=True)
+    scrape.add_argument(
+        "--age-group", action="append", help="repeatable, defaults to all"
+    )
+    scrape.add_argument("--links-per-message", type=int, default=55)
+    scrape.add_argument(
+        "--max-links", type=int, help="most links scraped per age group"
+    )
+    scrape.add_argument("--async-batch-size", type=int, default=10)
+    scrape.add_argument("--max-async-batch-size", type=int, default=50)
+    scrape.add_argument(
+        "--no-adaptive-concurrency",
+        dest="adaptive_concurrency",
+        action="store_false",
+    )
+    scrape.add_argument("--max-concurrent-messages", type=int, default=10)
+    scrape.add_argument(
+        "--codec",
+        choices=sorted(object_codecs.CODECS),
+        default=object_codecs.DEFAULT_CODEC,
+    )
+    scrape.add_argument(
+        "--no-url-index", dest="url_index", action="store_false"
+    )
+    parser.set_defaults(
+        async_batch_size=10,
+        max_async_batch_size=50,
+        adaptive_concurrency=True,
+        max_concurrent_messages=10,
+        codec=object_codecs.DEFAULT_CODEC,
+        url_index=True,
+        transform_batch_size=500,
+        output_format="csv",
+        transform_max_workers=4,
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,186 @@
+"""
+Cache of scrape results keyed by url.
+
+Results are kept in process memory, least recently used first out,
+and spill to a directory, Lambda's '/tmp' by default, once memory is
+full. Both survive between warm invocations of the same execution
+environment, so a retried or redriven message only fetches the urls
+that failed. Entries expire after 'ttl_seconds' and the directory is
+bounded by 'max_disk_bytes', oldest files first out.
+
+Only successful results are cached, failed scrapes are always
+fetched again.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Tuple
+
+DEFAULT_DIRECTORY = "/tmp/scrape-cache"
+
+
+def _file_name(url: str) -> str:
+    return hashlib.blake2b(url.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# pylint: disable=too-many-instance-attributes
+class ScrapeCache:
+    """
+    Size and TTL bounded cache of scrape results.
+    """
+
+    def __init__(
+        self,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+        ttl_seconds: float = 24 * 60 * 60,
+        directory: str = DEFAULT_DIRECTORY,
+    ):
+        """
+        Args:
+            max_memory_bytes (int): size of the encoded results held
+                in memory
+            max_disk_bytes (int): size of the results spilled to the
+                directory, 0 disables spilling
+            ttl_seconds (float): age at which a result expires
+            directory (str): directory results are spilled to
+        """
+
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Url to the time it was cached and its encoded result
+        self._memory: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._memory_bytes = 0
+        # File name to its size, oldest first
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        if self.max_disk_bytes:
+            self._load_disk()
+
+    def _load_disk(self) -> None:
+        """
+        Indexes the files spilled by earlier invocations.
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_bytes += size
+
+    def _remove_file(self, name: str) -> None:
+        self._disk_bytes -= self._disk.pop(name, 0)
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    def _spill(self, url: str, cached_at: float, data: bytes) -> None:
+        """
+        Writes an entry evicted from memory to the directory.
+        """
+
+        if not self.max_disk_bytes or len(data) > self.max_disk_bytes:
+            return
+        name = _file_name(url)
+        self._remove_file(name)
+        while (
+            self._disk and self._disk_bytes + len(data) > self.max_disk_bytes
+        ):
+            self._remove_file(next(iter(self._disk)))
+        path = os.path.join(self.directory, name)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(data)
+        os.utime(f"{path}.tmp", (cached_at, cached_at))
+        os.replace(f"{path}.tmp", path)
+        self._disk[name] = len(data)
+        self._disk_bytes += len(data)
+
+    def _load_file(self, url: str) -> Tuple[float, bytes]:
+        """
+        Reads a spilled entry, raises FileNotFoundError if there is
+        none.
+        """
+
+        name = _file_name(url)
+        if name not in self._disk:
+            raise FileNotFoundError(name)
+        path = os.path.join(self.directory, name)
+        cached_at = os.path.getmtime(path)
+        with open(path, "rb") as f:
+            data = f.read()
+        self._remove_file(name)
+        return cached_at, data
+
+    def _put(self, url: str, cached_at: float, data: bytes) -> None:
+        if url in self._memory:
+            self._memory_bytes -= len(self._memory.pop(url)[1])
+        self._memory[url] = (cached_at, data)
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            evicted_url, (evicted_at, evicted) = self._memory.popitem(
+                last=False
+            )
+            self._memory_bytes -= len(evicted)
+            self._spill(evicted_url, evicted_at, evicted)
+
+    def get_many(self, urls: Iterable[str]) -> Dict[str, Any]:
+        """
+        Args:
+            urls (Iterable[str]): urls to look up
+        Returns:
+            Dict[str, Any]: cached result of each url found
+        """
+
+        found = {}
+        now = time.time()
+        with self._lock:
+            for url in urls:
+                if url in found:
+                    continue
+                entry = self._memory.get(url)
+                if entry is None:
+                    try:
+                        entry = self._load_file(url)
+                    except OSError:
+                        self._remove_file(_file_name(url))
+                        self.misses += 1
+                        continue
+                    self._put(url, *entry)
+                if now - entry[0] > self.ttl_seconds:
+                    self._memory_bytes -= len(self._memory.pop(url)[1])
+                    self.misses += 1
+                    continue
+                self._memory.move_to_end(url)
+                found[url] = json.loads(entry[1])
+                self.hits += 1
+        return found
+
+    def put_many(self, results: Dict[str, Any]) -> None:
+        """
+        Args:
+            results (Dict[str, Any]): successful result of each url
+        """
+
+        now = time.time()
+        with self._lock:
+            for url, result in results.items():
+                data = json.dumps(result, separators=(",", ":")).encode(
+                    "utf-8"
+                )
+                if len(data) <= self.max_memory_bytes:
+                    self._put(url, now, data)
@@ -0,0 +1,635 @@
+"""
+Event handlers for the workout scraper Lambda.
+
+An event is processed by 'ScrapeEvent' in steps: its records are
+parsed and the urls already scraped removed, each message's urls are
+scraped in rounds by a 'Scraper' and streamed to S3, then failed
+scrapes are dead-lettered and unscraped urls requeued.
+
+Given a 'Deadline', no round is started within its margin of the
+Lambda timeout: the results so far are written and the unscraped urls
+are sent back to the scraper queue as a new message, so the original
+message can be deleted without losing work.
+"""
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+from uuid import uuid4
+
+import boto3
+from kuda.scrapers import scrape_urls
+
+from sheiva_cloud.sheiva_aws import metrics, s3, sqs
+from sheiva_cloud.sheiva_aws.aws_lambda.concurrency import AimdController
+from sheiva_cloud.sheiva_aws.aws_lambda.scrape_cache import ScrapeCache
+from sheiva_cloud.sheiva_aws.s3 import (
+    object_codecs,
+    transform_manifest,
+    url_index,
+)
+
+# Uncompressed size at which a scraped file is completed
+MAX_SCRAPED_FILE_BYTES = 32 * 1024 * 1024
+
+
+def urls_message(
+    urls: List[str],
+    bucket_key: str,
+    encoding: str = sqs.message_parsers.DEFAULT_URL_ENCODING,
+) -> sqs.SqsMessage:
+    """
+    Args:
+        urls (List[str]): workout urls
+        bucket_key (str): key the scraped workouts are written under
+        encoding (str): encoding of the urls, see
+            'sqs.message_parsers.encode_urls'
+    Returns:
+        sqs.SqsMessage: a scraper message of the urls
+    """
+
+    return {
+        "message_body": sqs.message_parsers.encode_urls(urls, encoding),
+        "message_attributes": {
+            "bucket_key": {
+                "DataType": "String",
+                "StringValue": bucket_key,
+            }
+        },
+    }
+
+
+class Scraper:
+    """
+    Scrapes urls in rounds of 'async_batch_size' urls, or of the
+    controller's concurrency if one is given. Urls in the cache are
+    returned first, as a single round, and are not fetched.
+    """
+
+    def __init__(
+        self,
+        html_parser: Callable,
+        async_batch_size: int = 10,
+        concurrency_controller: Optional[AimdController] = None,
+        scrape_cache: Optional[ScrapeCache] = None,
+    ):
+        """
+        Args:
+            html_parser (Callable): html parser
+            async_batch_size (int, optional): batch size for async
+                scraping without a controller.
+            concurrency_controller (AimdController, optional): adaptive
+                concurrency controller, shared by the messages scraped
+                concurrently.
+            scrape_cache (ScrapeCache, optional): cache of successful
+                scrape results, so retried urls are not fetched again
+        """
+
+        self.html_parser = html_parser
+        self.async_batch_size = async_batch_size
+        self.concurrency_controller = concurrency_controller
+        self.scrape_cache = scrape_cache
+
+    def start_invocation(self) -> None:
+        """
+        Resets the concurrency stats of the controller, if any.
+        """
+
+        if self.concurrency_controller is not None:
+            self.concurrency_controller.start_invocation()
+
+    def log_invocation(self) -> None:
+        """
+        Logs the concurrency the controller chose, if any.
+        """
+
+        if self.concurrency_controller is not None:
+            print(
+                "Scrape concurrency: "
+                f"{json.dumps(self.concurrency_controller.invocation_stats())}"
+            )
+
+    def scrape_rounds(
+        self,
+        urls: List[str],
+        should_stop: Optional[Callable[[], bool]] = None,
+    ) -> Iterator[Tuple[List[str], List[Any]]]:
+        """
+        Args:
+            urls (List[str]): urls to scrape
+            should_stop (Callable[[], bool], optional): checked before
+                each round, no more rounds are started once it is True.
+        Yields:
+            Tuple[List[str], List[Any]]: the urls of each
+                round and their results, the url itself if the scrape
+                failed. Not every url is covered if the scrape was
+                stopped.
+        """
+
+        if self.scrape_cache is not None:
+            cached = self.scrape_cache.get_many(urls)
+            if cached:
+                print(
+                    f"Found {len(cached)} of {len(urls)} urls in scrape cache"
+                )
+                metrics.count("CachedUrls", len(cached), Stage="ScrapeRound")
+                cached_urls = [url for url in urls if url in cached]
+                yield cached_urls, [cached[url] for url in cached_urls]
+                urls = [url for url in urls if url not in cached]
+
+        num_scraped = 0
+        while num_scraped < len(urls):
+            if should_stop is not None and should_stop():
+                return
+            round_urls = urls[num_scraped : num_scraped + self.concurrency]
+            yield round_urls, self.scrape_round(round_urls)
+            num_scraped += len(round_urls)
+
+    @property
+    def concurrency(self) -> int:
+        """
+        Returns:
+            int: number of urls of the next round
+        """
+
+        if self.concurrency_controller is not None:
+            return self.concurrency_controller.concurrency
+        return self.async_batch_size
+
+    def scrape_round(self, urls: List[str]) -> List[Any]:
+        """
+        Scrapes a round of urls concurrently, recording the outcome
+        with the controller and caching the successful results.
+        Args:
+            urls (List[str]): urls of the round
+        Returns:
+            List[Any]: the result of each url, the url itself if the
+                scrape failed.
+        """
+
+        start = time.monotonic()
+        with metrics.timer(Stage="ScrapeRound"):
+            results = scrape_urls(
+                urls=urls, html_parser=self.html_parser, batch_size=len(urls)
+            )
+        num_failed = sum(isinstance(r, str) for r in results)
+        metrics.count("Urls", len(urls), Stage="ScrapeRound")
+        metrics.count("FailedUrls", num_failed, Stage="ScrapeRound")
+        if self.concurrency_controller is not None:
+            self.concurrency_controller.record(
+                num_urls=len(urls),
+                num_failed=num_failed,
+                seconds=time.monotonic() - start,
+            )
+        if self.scrape_cache is not None:
+            self.scrape_cache.put_many(
+                {
+                    url: result
+                    for url, result in zip(urls, results)
+                    if not isinstance(result, str)
+                }
+            )
+        return results
+
+
+class Deadline:
+    """
+    Deadline of an invocation. No scrape round is started within
+    'margin_seconds' of it and the urls left are requeued to 'queue'.
+    """
+
+    def __init__(
+        self,
+        queue: sqs.StandardSqsClient,
+        get_remaining_time_in_millis: Callable[[], int],
+        margin_seconds: float = 30,
+    ):
+        """
+        Args:
+            queue (sqs.StandardSqsClient): scraper queue the unscraped
+                urls are requeued to
+            get_remaining_time_in_millis (Callable[[], int]): time
+                left in the invocation, usually from the Lambda context
+            margin_seconds (float, optional): time kept to finish a
+                round, write the results and requeue the rest.
+        """
+
+        self.queue = queue
+        self.get_remaining_time_in_millis = get_remaining_time_in_millis
+        self.margin_seconds = margin_seconds
+
+    def reached(self) -> bool:
+        """
+        Returns:
+            bool: whether no more rounds should be started
+        """
+
+        return self.get_remaining_time_in_millis() < self.margin_seconds * 1000
+
+
+class ScrapedFileWriter:
+    """
+    Streams scraped workouts into files under a bucket key, starting
+    a new file once one holds 'max_file_bytes' of uncompressed data.
+    Each file is recorded for the transformer as soon as it is
+    complete, and at most one part of a file is held in memory.
+    """
+
+    def __init__(
+        self,
+        s3_client: boto3.client,
+        bucket_key: str,
+        codec: str = object_codecs.DEFAULT_CODEC,
+        max_file_bytes: int = MAX_SCRAPED_FILE_BYTES,
+    ):
+        """
+        Args:
+            s3_client (boto3.client): s3 client
+            bucket_key (str): key the files are written under
+            codec (str): codec of the files, one of
+                'object_codecs.CODECS'
+            max_file_bytes (int): uncompressed size at which a file
+                is completed
+        """
+
+        self.s3_client = s3_client
+        self.bucket_key = bucket_key
+        self.codec = object_codecs.get_codec(codec)
+        self.max_file_bytes = max_file_bytes
+        self.keys: List[str] = []
+        self._writer: Optional[object_codecs.ItemWriter] = None
+
+    def __enter__(self) -> "ScrapedFileWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        elif self._writer is not None:
+            self._writer.abort()
+
+    def write(self, workout: Dict) -> None:
+        """
+        Args:
+            workout (Dict): scraped workout
+        """
+
+        if self._writer is None:
+            self._writer = object_codecs.ItemWriter(
+                s3_client=self.s3_client,
+                key=f"{self.bucket_key}/{uuid4()}{self.codec.key_extension}",
+                codec=self.codec,
+                bucket=s3.SHEIVA_SCRAPE_BUCKET,
+            )
+        self._writer.write(workout)
+        if self._writer.bytes_written >= self.max_file_bytes:
+            self.close()
+
+    def close(self) -> None:
+        """
+        Completes the current file, if any, and records it.
+        """
+
+        if self._writer is None:
+            return
+        writer, self._writer = self._writer, None
+        writer.close()
+        metrics.count("Files", Stage="ScrapedFile")
+        metrics.count("Workouts", writer.num_items, Stage="ScrapedFile")
+        metrics.gauge_bytes(
+            "UncompressedBytes", writer.bytes_written, Stage="ScrapedFile"
+        )
+        transform_manifest.record_scraped_file(
+            s3_client=self.s3_client, key=writer.key
+        )
+        self.keys.append(writer.key)
+
+
+def skip_scraped_urls(
+    scraped_url_index: url_index.ScrapedUrlIndex,
+    messages: List[sqs.ScraperMessage],
+) -> List[sqs.ScraperMessage]:
+    """
+    Removes the urls that have already been scraped, or that appear
+    earlier in the event, from each message.
+    Args:
+        scraped_url_index (url_index.ScrapedUrlIndex): scraped url index
+        messages (List[sqs.ScraperMessage]): messages of the event
+    Returns:
+        List[sqs.ScraperMessage]: the messages with only the
+            urls left to scrape.
+    """
+
+    urls = [url for message in messages for url in message["urls"]]
+    scraped = set(
+        url
+        for url, is_scraped in zip(urls, scraped_url_index.contains(urls))
+        if is_scraped
+    )
+    print(f"Skipping {len(scraped)} of {len(urls)} urls already scraped")
+    seen = set()
+    filtered_messages = []
+    for message in messages:
+        urls_to_scrape = []
+        for url in message["urls"]:
+            if url not in scraped and url not in seen:
+                seen.add(url)
+                urls_to_scrape.append(url)
+        filtered_message = message.copy()
+        filtered_message["urls"] = urls_to_scrape
+        filtered_messages.append(filtered_message)
+    return filtered_messages
+
+
+# pylint: disable=too-many-instance-attributes
+class ScrapeEvent:
+    """
+    Represents a scrape event. Every record of the event is scraped,
+    up to 'max_workers' at a time. Failed scrapes are sent to the
+    dead-letter queue and any record that could not be parsed or
+    processed is reported as a batch item failure so Lambda retries it.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        event: sqs.SqsEvent,
+        s3_client: boto3.client,
+        dlq: sqs.StandardSqsClient,
+        scraper: Scraper,
+        max_workers: int = 10,
+        codec: str = object_codecs.DEFAULT_CODEC,
+        max_file_bytes: int = MAX_SCRAPED_FILE_BYTES,
+        scraped_url_index: Optional[url_index.ScrapedUrlIndex] = None,
+        deadline: Optional[Deadline] = None,
+    ):
+        """
+        Args:
+            event (sqs.SqsEvent): the SQS event to be processed
+            s3_client (boto3.client): s3 client
+            dlq (sqs.StandardSqsClient): dead-letter queue for failed
+                scrapes and records that fail to parse
+            scraper (Scraper): scraper of the urls
+            max_workers (int, optional): number of messages processed
+                concurrently.
+            codec (str, optional): codec of the scraped files, one of
+                'object_codecs.CODECS'
+            max_file_bytes (int, optional): uncompressed size of the
+                scraped files
+            scraped_url_index (url_index.ScrapedUrlIndex, optional): if
+                set, urls already in the index are not scraped and the
+                scraped urls are recorded in it.
+            deadline (Deadline, optional): deadline of the invocation,
+                the urls left unscraped at it are requeued.
+        """
+
+        self.event = event
+        self.s3_client = s3_client
+        self.dlq = dlq
+        self.scraper = scraper
+        self.max_workers = max_workers
+        self.codec = codec
+        self.max_file_bytes = max_file_bytes
+        self.scraped_url_index = scraped_url_index
+        self.deadline = deadline
+        self.messages, self.dead_lettered_ids = self.parse_messages()
+
+    def parse_messages(self) -> Tuple[List[sqs.ScraperMessage], List[str]]:
+        """
+        Parses the records of the event, sending those that fail to
+        the dead-letter queue, and removes the urls already scraped.
+        Returns:
+            Tuple[List[sqs.ScraperMessage], List[str]]: the messages
+                and the ids of the dead-lettered records
+        """
+
+        messages: List[sqs.ScraperMessage]
+        messages, dead_lettered_ids = sqs.utils.parse_sqs_event(
+            sqs_event=self.event,
+            parse_function=partial(
+                sqs.message_parsers.scrape_message_parser,
+                s3_client=self.s3_client,
+            ),
+            dlq=self.dlq,
+        )
+        if self.scraped_url_index is not None and messages:
+            try:
+                messages = skip_scraped_urls(
+                    scraped_url_index=self.scraped_url_index,
+                    messages=messages,
+                )
+            # pylint: disable=broad-except
+            except Exception as e:
+                print(f"Error reading the scraped url index: {repr(e)}")
+        return messages, dead_lettered_ids
+
+    @metrics.timed(Stage="ScrapeMessage")
+    def process_message(
+        self, message: sqs.ScraperMessage
+    ) -> sqs.ScrapeResponse:
+        """
+        Scrapes the urls of a message. Workouts are streamed to S3 as
+        each round completes, see 'ScrapedFileWriter', so memory does
+        not grow with the number of urls. No file is written without
+        workouts.
+        Args:
+            message (sqs.ScraperMessage): the message to be processed
+        Returns:
+            sqs.ScrapeResponse: the message to delete, the failed
+                scrapes to send to the dead-letter queue, the urls
+                that were scraped and the urls left to requeue.
+        """
+
+        bucket_key = message["bucket_key"]
+        failed_scrapes: List[str] = []
+        scraped_urls: List[str] = []
+        processed_urls = set()
+        with ScrapedFileWriter(
+            s3_client=self.s3_client,
+            bucket_key=bucket_key,
+            codec=self.codec,
+            max_file_bytes=self.max_file_bytes,
+        ) as scraped_file_writer:
+            for round_urls, round_results in self.scraper.scrape_rounds(
+                urls=message["urls"],
+                should_stop=self.deadline.reached
+                if self.deadline is not None
+                else None,
+            ):
+                round_failed = set()
+                for result in round_results:
+                    # Will return the url if the scrape failed
+                    if isinstance(result, str):
+                        round_failed.add(result)
+                        failed_scrapes.append(result)
+                    # Can be an empty dict e.g. Workout Inaccessible
+                    elif result:
+                        scraped_file_writer.write(result)
+                scraped_urls.extend(
+                    url for url in round_urls if url not in round_failed
+                )
+                processed_urls.update(round_urls)
+
+        unscraped_urls = [
+            url for url in message["urls"] if url not in processed_urls
+        ]
+        if unscraped_urls:
+            print(
+                f"Requeueing {len(unscraped_urls)} unscraped urls of "
+                f"message {message['messageId']}"
+            )
+        metrics.count("ScrapedUrls", len(scraped_urls), Stage="ScrapeMessage")
+        metrics.count("FailedUrls", len(failed_scrapes), Stage="ScrapeMessage")
+        metrics.count(
+            "RequeuedUrls", len(unscraped_urls), Stage="ScrapeMessage"
+        )
+        return {
+            "receipt_handles_to_delete": [message["receiptHandle"]],
+            "messages_to_dlq": [urls_message(failed_scrapes, bucket_key)]
+            if failed_scrapes
+            else [],
+            "scraped_urls": scraped_urls,
+            "messages_to_requeue": [urls_message(unscraped_urls, bucket_key)]
+            if unscraped_urls
+            else [],
+        }
+
+    def process_messages(self) -> Dict[str, sqs.ScrapeResponse]:
+        """
+        Processes the messages concurrently.
+        Returns:
+            Dict[str, sqs.ScrapeResponse]: the response of each message
+                processed without an exception, by message id
+        """
+
+        responses: Dict[str, sqs.ScrapeResponse] = {}
+        if not self.messages:
+            return responses
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_workers, len(self.messages))
+        ) as executor:
+            futures = {
+                executor.submit(self.process_message, message): message
+                for message in self.messages
+            }
+            for future in as_completed(futures):
+                message = futures[future]
+                try:
+                    responses[message["messageId"]] = future.result()
+                # pylint: disable=broad-except
+                except Exception as e:
+                    print(
+                        f"Error processing message {message['messageId']} "
+                        f"with exception: {repr(e)}"
+                    )
+        return responses
+
+    @staticmethod
+    def send_messages(
+        queue: sqs.StandardSqsClient,
+        messages_by_id: Dict[str, List[sqs.SqsMessage]],
+        description: str,
+    ) -> Set[str]:
+        """
+        Sends the messages of each record to a queue.
+        Args:
+            queue (sqs.StandardSqsClient): the queue
+            messages_by_id (Dict[str, List[sqs.SqsMessage]]): messages
+                to send by the id of the record they come from
+            description (str): what the messages are, logged on failure
+        Returns:
+            Set[str]: ids of the records whose messages were not all
+                sent, to be retried rather than lose them.
+        """
+
+        message_ids = []
+        messages = []
+        for message_id, record_messages in messages_by_id.items():
+            for message in record_messages:
+                message_ids.append(message_id)
+                messages.append(message)
+        if not messages:
+            return set()
+        failed_message_ids = set()
+        for failure in queue.send_messages(messages=messages)["failed"]:
+            message_id = message_ids[int(failure["id"])]
+            print(f"Error sending {description} of {message_id}: {failure}")
+            failed_message_ids.add(message_id)
+        return failed_message_ids
+
+    def record_scraped_urls(self, scraped_urls: List[str]) -> None:
+        """
+        Records the scraped urls in the scraped url index, if any.
+        Args:
+            scraped_urls (List[str]): the scraped urls
+        """
+
+        if self.scraped_url_index is None:
+            return
+        try:
+            self.scraped_url_index.record(scraped_urls)
+        # pylint: disable=broad-except
+        except Exception as e:
+            # The urls are scraped again if they are ever re-queued
+            print(f"Error recording scraped urls: {repr(e)}")
+
+    @metrics.timed(Stage="ScrapeEvent")
+    def process(self) -> sqs.BatchItemFailuresResponse:
+        """
+        Processes every message of the event, then sends the failed
+        scrapes to the dead-letter queue and requeues the urls left
+        at the deadline.
+        Returns:
+            sqs.BatchItemFailuresResponse: the records to be retried
+        """
+
+        self.scraper.start_invocation()
+        responses = self.process_messages()
+        self.scraper.log_invocation()
+
+        unsent_message_ids = self.send_messages(
+            queue=self.dlq,
+            messages_by_id={
+                message_id: response["messages_to_dlq"]
+                for message_id, response in responses.items()
+            },
+            description="failed scrapes",
+        )
+        # Urls are only left unscraped when there is a deadline
+        if self.deadline is not None:
+            unsent_message_ids |= self.send_messages(
+                queue=self.deadline.queue,
+                messages_by_id={
+                    message_id: response["messages_to_requeue"]
+                    for message_id, response in responses.items()
+                },
+                description="unscraped urls",
+            )
+        self.record_scraped_urls(
+            [
+                url
+                for response in responses.values()
+                for url in response["scraped_urls"]
+            ]
+        )
+
+        response = sqs.utils.build_batch_item_failures(
+            sqs_event=self.event,
+            processed_message_ids=list(self.dead_lettered_ids)
+            + [
+                message_id
+                for message_id in responses
+                if message_id not in unsent_message_ids
+            ],
+        )
+        metrics.count(
+            "Messages", len(self.event["Records"]), Stage="ScrapeEvent"
+        )
+        metrics.count(
+            "FailedMessages",
+            len(response["batchItemFailures"]),
+            Stage="ScrapeEvent",
+        )
+        return response
@@ -0,0 +1,358 @@
+"""
+Event handlers for the workout file transformer Lambda.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import boto3
+from kuda.data_pipelining.highrise.file_transformers import parse_workout_tree
+
+from sheiva_cloud.sheiva_aws import metrics, s3, sqs
+from sheiva_cloud.sheiva_aws.s3 import (
+    component_writers,
+    object_codecs,
+    transform_manifest,
+)
+
+
+class FileTransformEvent:
+    """
+    Represents a file transform event. Every record of the event is
+    transformed, up to 'max_workers' files at a time, so the S3 reads,
+    parsing and S3 writes of different files overlap.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        event: sqs.SqsEvent,
+        s3_client: boto3.client,
+        batch_size: Optional[int] = None,
+        output_format: str = "csv",
+        max_workers: int = 4,
+        dlq: Optional[sqs.StandardSqsClient] = None,
+    ):
+        """
+        Args:
+            event (sqs.SqsEvent): sqs event object
+            s3_client (boto3.client): s3 client
+            batch_size (Optional[int]): if set the source file is
+                streamed and transformed 'batch_size' items at a time,
+                otherwise it is read and transformed in one go.
+            output_format (str): format of the transformed files, one
+                of 'component_writers.OUTPUT_FORMATS'
+            max_workers (int): number of files transformed concurrently
+            dlq (Optional[sqs.StandardSqsClient]): dead-letter queue
+                records that fail to parse are sent to
+        """
+
+        self.event = event
+        self.s3_client = s3_client
+        self.batch_size = batch_size
+        self.output_format = output_format
+        self.max_workers = max_workers
+        self.messages: List[sqs.FileTransformerMessage]
+        self.messages, self.dead_lettered_ids = sqs.utils.parse_sqs_event(
+            sqs_event=event,
+            parse_function=partial(
+                sqs.message_parsers.file_transformer_message,
+                s3_client=s3_client,
+            ),
+            dlq=dlq,
+        )
+
+    @metrics.timed(Stage="TransformEvent")
+    def process(self) -> sqs.BatchItemFailuresResponse:
+        """
+        Processes every message of the event concurrently.
+        Returns:
+            sqs.BatchItemFailuresResponse: the records to be retried
+        """
+
+        processed_message_ids = list(self.dead_lettered_ids)
+        if self.messages:
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_workers, len(self.messages))
+            ) as executor:
+                futures = {
+                    executor.submit(self.process_message, message): message
+                    for message in self.messages
+                }
+                for future in as_completed(futures):
+                    message = futures[future]
+                    try:
+                        future.result()
+                    # pylint: disable=broad-except
+                    except Exception as e:
+                        print(
+                            f"Error transforming {message['s3_input_file']} "
+                            f"with exception: {repr(e)}"
+                        )
+                        continue
+                    processed_message_ids.append(message["messageId"])
+
+        response = sqs.utils.build_batch_item_failures(
+            sqs_event=self.event, processed_message_ids=processed_message_ids
+        )
+        metrics.count(
+            "Messages", len(self.event["Records"]), Stage="TransformEvent"
+        )
+        metrics.count(
+            "FailedMessages",
+            len(response["batchItemFailures"]),
+            Stage="TransformEvent",
+        )
+        return response
+
+    def process_message(self, message: sqs.FileTransformerMessage):
+        """
+        Processes a single message of the event.
+        """
+
+    def parse_source_file(self, message: sqs.FileTransformerMessage):
+        """
+        Parses the source file from the
+        's3_input_file' of the message.
+        """
+
+    def store_parsed_results(
+        self,
+        message: sqs.FileTransformerMessage,
+        file_name: str,
+        parsed_results: Any,
+    ):
+        """
+        Stores the parsed results in the
+        's3_output_bucket_key' of the message.
+        """
+
+
+class HighriseWorkoutTransformEvent(FileTransformEvent):
+    """
+    Represents a highrise workout transform event.
+    """
+
+    @metrics.timed(Stage="TransformFile")
+    def process_message(self, message: sqs.FileTransformerMessage) -> str:
+        """
+        Transforms the 's3_input_file' of a message.
+        Args:
+            message (sqs.FileTransformerMessage): the message
+        """
+
+        if self.batch_size:
+            self.process_streaming(message)
+        else:
+            file_name, parsed_results = self.parse_source_file(message)
+            self.store_parsed_results(
+                message=message,
+                file_name=file_name,
+                parsed_results=parsed_results,
+            )
+        transform_manifest.record_transformed_file(
+            s3_client=self.s3_client, key=message["s3_input_file"]
+        )
+        return "Success"
+
+    @staticmethod
+    def get_file_name(message: sqs.FileTransformerMessage) -> str:
+        """
+        Extracts file name from the 's3_input_file' of the message.
+        Args:
+            message (sqs.FileTransformerMessage): the message
+        Returns:
+            str: file name
+        """
+
+        return message["s3_input_file"].split("/")[-1].split(".")[0]
+
+    def get_component_writer(
+        self,
+        message: sqs.FileTransformerMessage,
+        file_name: str,
+        component_key: str,
+    ) -> component_writers.ComponentWriter:
+        """
+        Opens a writer for a component in the 's3_output_bucket_key'
+        of the message.
+        Args:
+            message (sqs.FileTransformerMessage): the message
+            file_name (str): file name
+            component_key (str): name of the component e.g. 'workouts'
+        Returns:
+            component_writers.ComponentWriter: the component writer
+        """
+
+        return component_writers.get_component_writer(
+            output_format=self.output_format,
+            s3_client=self.s3_client,
+            output_dir=f"{message['s3_output_bucket_key']}/{component_key}",
+            file_name=file_name,
+            component=component_key,
+        )
+
+    @metrics.timed(Stage="WriteComponents")
+    def write_components(
+        self,
+        message: sqs.FileTransformerMessage,
+        file_name: str,
+        writers: Dict[str, component_writers.ComponentWriter],
+        parsed_results: Dict[str, List],
+    ) -> None:
+        """
+        Writes each component of the parsed results to its writer,
+        opening writers as needed. Components are written
+        concurrently.
+        Args:
+            message (sqs.FileTransformerMessage): the message
+            file_name (str): file name
+            writers (Dict[str, component_writers.ComponentWriter]):
+                open writers by component
+            parsed_results (Dict[str, List]): parsed results
+        """
+
+        for component_key in parsed_results:
+            if component_key not in writers:
+                writers[component_key] = self.get_component_writer(
+                    message=message,
+                    file_name=file_name,
+                    component_key=component_key,
+                )
+        with ThreadPoolExecutor(
+            max_workers=max(1, len(parsed_results))
+        ) as executor:
+            list(
+                executor.map(
+                    lambda item: writers[item[0]].write(item[1]),
+                    parsed_results.items(),
+                )
+            )
+
+    @staticmethod
+    @metrics.timed(Stage="CloseWriters")
+    def close_writers(
+        writers: Dict[str, component_writers.ComponentWriter]
+    ) -> None:
+        """
+        Completes the uploads of all writers concurrently.
+        Args:
+            writers (Dict[str, component_writers.ComponentWriter]):
+                open writers by component
+        """
+
+        with ThreadPoolExecutor(max_workers=max(1, len(writers))) as executor:
+            list(executor.map(lambda writer: writer.close(), writers.values()))
+
+    def parse_source_file(
+        self, message: sqs.FileTransformerMessage
+    ) -> Tuple[str, Dict[str, List]]:
+        """
+        Extracts file name from the 's3_input_file' of the message.
+        Parses the source file from the 's3_input_file' of the message,
+        detecting its codec.
+        Args:
+            message (sqs.FileTransformerMessage): the message
+        Returns:
+            Tuple[str, Dict[str, List]]: file name and parsed results
+        """
+        file_name = self.get_file_name(message)
+        workouts = object_codecs.read_items(
+            s3_client=self.s3_client,
+            key=message["s3_input_file"],
+            bucket=s3.SHEIVA_SCRAPE_BUCKET,
+        )
+        return file_name, self.parse_workouts(workouts)
+
+    @staticmethod
+    @metrics.timed(Stage="Parse")
+    def parse_workouts(workouts: List[Dict]) -> Dict[str, List]:
+        """
+        Parses workouts into their components.
+        Args:
+            workouts (List[Dict]): scraped workouts
+        Returns:
+            Dict[str, List]: rows of each component
+        """
+
+        metrics.count("Workouts", len(workouts), Stage="Parse")
+        return parse_workout_tree(workouts=workouts)
+
+    def iter_workout_batches(
+        self, message: sqs.FileTransformerMessage
+    ) -> Iterator[List[Dict]]:
+        """
+        Streams the workouts of the 's3_input_file' of the message
+        in batches of 'batch_size'.
+        Args:
+            message (sqs.FileTransformerMessage): the message
+        Yields:
+            List[Dict]: batches of workouts
+        """
+
+        batch = []
+        for workout in object_codecs.iter_items(
+            s3_client=self.s3_client,
+            key=message["s3_input_file"],
+            bucket=s3.SHEIVA_SCRAPE_BUCKET,
+        ):
+            batch.append(workout)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def process_streaming(self, message: sqs.FileTransformerMessage) -> None:
+        """
+        Streams the source file through 'parse_workout_tree' a batch
+        at a time, appending each batch's components to their output
+        files. Peak memory depends on the batch size, not file size.
+        Args:
+            message (sqs.FileTransformerMessage): the message
+        """
+
+        file_name = self.get_file_name(message)
+        writers: Dict[str, component_writers.ComponentWriter] = {}
+        try:
+            for workouts in self.iter_workout_batches(message):
+                self.write_components(
+                    message=message,
+                    file_name=file_name,
+                    writers=writers,
+                    parsed_results=self.parse_workouts(workouts),
+                )
+            self.close_writers(writers)
+        except Exception:
+            for writer in writers.values():
+                writer.abort()
+            raise
+
+    def store_parsed_results(
+        self,
+        message: sqs.FileTransformerMessage,
+        file_name: str,
+        parsed_results: Dict[str, List],
+    ) -> None:
+        """
+        Stores the parsed results in the 's3_output_bucket_key' of the message.
+        Args:
+            message (sqs.FileTransformerMessage): the message
+            file_name (str): file name
+            parsed_results (Dict[str, List]): parsed results
+        """
+
+        writers: Dict[str, component_writers.ComponentWriter] = {}
+        try:
+            self.write_components(
+                message=message,
+                file_name=file_name,
+                writers=writers,
+                parsed_results=parsed_results,
+            )
+            self.close_writers(writers)
+        except Exception:
+            for writer in writers.values():
+                writer.abort()
+            raise
@@ -0,0 +1,105 @@
+"""
+Module for creating boto3 clients.
+
+Clients are cached per process so warm Lambda invocations reuse the
+session's credentials, the resolved endpoints and the HTTP keep-alive
+connections of the previous invocation. Clients are thread safe, the
+session is not, so clients are only ever created under a lock.
+
+Tests and local runs can inject their own clients with 'set_client'.
+S3 and SQS clients are instrumented when metrics are enabled, see
+'metrics.instrument_client'.
+"""
+
+import os
+import threading
+from typing import Dict, Optional
+
+import boto3
+from botocore.config import Config
+
+from sheiva_cloud.sheiva_aws import metrics
+
+# Should be at least the number of threads sharing a client
+MAX_POOL_CONNECTIONS = int(os.getenv("BOTO3_MAX_POOL_CONNECTIONS", "50"))
+MAX_RETRY_ATTEMPTS = int(os.getenv("BOTO3_MAX_RETRY_ATTEMPTS", "5"))
+RETRY_MODE = os.getenv("BOTO3_RETRY_MODE", "standard")
+
+_lock = threading.Lock()
+_session: Optional[boto3.Session] = None
+_clients: Dict[str, boto3.client] = {}
+
+
+def get_config() -> Config:
+    """
+    Builds the botocore config shared by all clients.
+    Returns:
+        Config: botocore client config
+    """
+
+    return Config(
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        retries={"max_attempts": MAX_RETRY_ATTEMPTS, "mode": RETRY_MODE},
+    )
+
+
+def get_session() -> boto3.Session:
+    """
+    Gets the process wide boto3 session, creating it on first use.
+    Returns:
+        boto3.Session: boto3 session
+    """
+
+    global _session  # pylint: disable=global-statement
+    with _lock:
+        if _session is None:
+            _session = boto3.Session()
+        return _session
+
+
+def get_client(service_name: str) -> boto3.client:
+    """
+    Gets the cached client for a service, creating it on first use.
+    Args:
+        service_name (str): name of the AWS service e.g. 's3'
+    Returns:
+        boto3.client: client for the service
+    """
+
+    client = _clients.get(service_name)
+    if client is not None:
+        return client
+
+    session = get_session()
+    with _lock:
+        if service_name not in _clients:
+            _clients[service_name] = metrics.instrument_client(
+                session.client(service_name, config=get_config()),
+                service_name,
+            )
+        return _clients[service_name]
+
+
+def set_client(service_name: str, client: boto3.client) -> None:
+    """
+    Injects a client for a service e.g. a stub in tests.
+    Args:
+        service_name (str): name of the AWS service e.g. 's3'
+        client (boto3.client): client to return from 'get_client'
+    """
+
+    with _lock:
+        _clients[service_name] = metrics.instrument_client(
+            client, service_name
+        )
+
+
+def reset() -> None:
+    """
+    Drops the cached session and clients.
+    """
+
+    global _session  # pylint: disable=global-statement
+    with _lock:
+        _session = None
+        _clients.clear()
@@ -0,0 +1,687 @@
+"""
+Stand-ins for the boto3 S3 and SQS clients, for running the pipeline
+without AWS. They implement only the calls made by this package and
+are injected with 'client_factory.set_client'.
+
+'BaseS3Client' and 'BaseSqsClient' implement the API, pagination and
+multipart uploads included, on top of a few abstract storage methods
+that each client implements. The filesystem clients here run the pipeline on a
+single machine, the in-memory clients of the benchmarks are built on
+the same bases. Every client counts its API calls and the bytes
+uploaded to and downloaded from it in 'stats'.
+
+Objects of the filesystem clients are stored as files under
+'<root>/<bucket>/<key>' so the same tree can be synced to and from a
+real bucket with 'aws s3 sync'. Writes go through a temporary file and
+a rename, so readers in other processes never see a partial object.
+SQS messages are stored as one JSON file each under
+'<root>/<queue name>/'.
+"""
+
+import io
+import json
+import os
+import shutil
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+# Directories of the root that are not buckets, bucket names can not
+# start with a dot
+TMP_DIR = ".tmp"
+UPLOADS_DIR = ".uploads"
+
+
+class ApiStats:
+    """
+    API call and byte counts of a client.
+    """
+
+    def __init__(self):
+        self.calls: Counter = Counter()
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+        self._lock = threading.Lock()
+
+    def record(
+        self, operation: str, uploaded: int = 0, downloaded: int = 0
+    ) -> None:
+        """
+        Records an API call.
+        Args:
+            operation (str): name of the call e.g. 'put_object'
+            uploaded (int): bytes sent to the service
+            downloaded (int): bytes received from the service
+        """
+
+        with self._lock:
+            self.calls[operation] += 1
+            self.bytes_uploaded += uploaded
+            self.bytes_downloaded += downloaded
+
+    def snapshot(self) -> Dict:
+        """
+        Returns:
+            Dict: copy of the counts
+        """
+
+        with self._lock:
+            return {
+                "calls": dict(self.calls),
+                "bytes_uploaded": self.bytes_uploaded,
+                "bytes_downloaded": self.bytes_downloaded,
+            }
+
+
+class LocalClientError(Exception):
+    """
+    Raised for the error responses of the local clients.
+    """
+
+
+class _Exceptions:
+    """
+    Mirrors the 'client.exceptions' namespace of a boto3 client.
+    """
+
+    class NoSuchKey(LocalClientError):
+        """
+        The requested key does not exist.
+        """
+
+    class NoSuchUpload(LocalClientError):
+        """
+        The multipart upload does not exist.
+        """
+
+
+class _Paginator:
+    """
+    Paginator for 'list_objects_v2'.
+    """
+
+    def __init__(self, client: "BaseS3Client"):
+        self.client = client
+
+    def paginate(self, **kwargs):
+        """
+        Yields the pages of a 'list_objects_v2' call.
+        """
+
+        yield from self.client.iter_pages(**kwargs)
+
+
+def _to_bytes(body) -> bytes:
+    if isinstance(body, str):
+        return body.encode("utf-8")
+    if hasattr(body, "read"):
+        return body.read()
+    return bytes(body)
+
+
+def _page(contents: List[Dict], common_prefixes: List[str], next_token: str):
+    page = {
+        "Contents": contents,
+        "CommonPrefixes": [{"Prefix": p} for p in common_prefixes],
+        "KeyCount": len(contents) + len(common_prefixes),
+        "IsTruncated": bool(next_token),
+    }
+    if next_token:
+        page["NextContinuationToken"] = next_token
+    return page
+
+
+def _etag(stat: os.stat_result) -> str:
+    # Changes whenever the object is rewritten, without hashing it
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+# The calls take the arguments of boto3, used or not
+# pylint: disable=unused-argument
+class BaseS3Client(ABC):
+    """
+    S3 API over the storage methods of a subclass.
+    """
+
+    exceptions = _Exceptions
+
+    def __init__(self):
+        self.stats = ApiStats()
+
+    @abstractmethod
+    def _open(self, bucket: str, key: str) -> Tuple[BinaryIO, int, str]:
+        """
+        Opens an object.
+        Returns:
+            Tuple[BinaryIO, int, str]: body, size and ETag
+        Raises:
+            NoSuchKey: if the object does not exist
+        """
+
+    @abstractmethod
+    def _write(self, bucket: str, key: str, chunks: Iterator[bytes]) -> str:
+        """
+        Atomically writes an object.
+        Returns:
+            str: ETag of the object
+        """
+
+    @abstractmethod
+    def _remove(self, bucket: str, key: str) -> None:
+        """
+        Removes an object if it exists.
+        """
+
+    @abstractmethod
+    def _list_entries(
+        self, bucket: str, prefix: str, delimiter: str
+    ) -> List[Tuple[str, int, str]]:
+        """
+        Lists the keys under a prefix, grouping the keys with the
+        delimiter after the prefix into common prefixes.
+        Returns:
+            List[Tuple[str, int, str]]: sorted keys with their size
+                and ETag, common prefixes end with the delimiter and
+                have an empty ETag.
+        """
+
+    @abstractmethod
+    def _create_upload(self, upload_id: str) -> None:
+        """
+        Creates an empty multipart upload.
+        """
+
+    @abstractmethod
+    def _write_part(self, upload_id: str, number: int, body: bytes) -> None:
+        """
+        Raises:
+            NoSuchUpload: if the upload does not exist
+        """
+
+    @abstractmethod
+    def _read_parts(
+        self, upload_id: str, numbers: List[int]
+    ) -> Iterator[bytes]:
+        """
+        Returns:
+            Iterator[bytes]: the parts in the order of 'numbers'
+        Raises:
+            NoSuchUpload: if the upload does not exist
+        """
+
+    @abstractmethod
+    def _remove_upload(self, upload_id: str) -> None:
+        """
+        Removes a multipart upload and its parts if it exists.
+        """
+
+    def put_object(self, Bucket: str, Key: str, Body=b"", **kwargs):
+        """
+        Stores an object.
+        """
+
+        body = _to_bytes(Body)
+        self.stats.record("put_object", uploaded=len(body))
+        return {"ETag": self._write(Bucket, Key, iter([body]))}
+
+    def get_object(self, Bucket: str, Key: str, **kwargs):
+        """
+        Gets an object, the body is a readable stream.
+        """
+
+        try:
+            body, size, etag = self._open(Bucket, Key)
+        except self.exceptions.NoSuchKey:
+            self.stats.record("get_object")
+            raise
+        self.stats.record("get_object", downloaded=size)
+        return {"Body": body, "ContentLength": size, "ETag": etag}
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs):
+        """
+        Deletes an object.
+        """
+
+        self.stats.record("delete_object")
+        self._remove(Bucket, Key)
+        return {}
+
+    def delete_objects(self, Bucket: str, Delete: Dict, **kwargs):
+        """
+        Deletes a batch of objects.
+        """
+
+        self.stats.record("delete_objects")
+        for obj in Delete["Objects"]:
+            self._remove(Bucket, obj["Key"])
+        return {"Deleted": Delete["Objects"]}
+
+    # pylint: disable=too-many-arguments
+    def iter_pages(
+        self,
+        Bucket: str,
+        Prefix: str = "",
+        Delimiter: str = "",
+        StartAfter: str = "",
+        ContinuationToken: str = "",
+        MaxKeys: int = 1000,
+        **kwargs,
+    ) -> Iterator[Dict]:
+        """
+        Yields the pages of a listing from a single listing of the
+        storage. Keys are in lexicographical order, with 'Delimiter'
+        grouping into 'CommonPrefixes' like S3.
+        """
+
+        after = max(StartAfter, ContinuationToken)
+        contents: List[Dict] = []
+        common_prefixes: List[str] = []
+        for entry, size, etag in self._list_entries(Bucket, Prefix, Delimiter):
+            is_key = bool(etag)
+            if is_key and entry <= after:
+                continue
+            # A common prefix is skipped once returned, or when every
+            # key under it is before 'StartAfter'
+            if not is_key and (
+                entry == ContinuationToken
+                or (entry < after and not after.startswith(entry))
+            ):
+                continue
+            if len(contents) + len(common_prefixes) == MaxKeys:
+                self.stats.record("list_objects_v2")
+                yield _page(contents, common_prefixes, next_token=after)
+                contents, common_prefixes = [], []
+            if is_key:
+                contents.append({"Key": entry, "Size": size, "ETag": etag})
+            else:
+                common_prefixes.append(entry)
+            after = entry
+        self.stats.record("list_objects_v2")
+        yield _page(contents, common_prefixes, next_token="")
+
+    def list_objects_v2(self, **kwargs):
+        """
+        Lists a page of keys, see 'iter_pages'.
+        """
+
+        return next(self.iter_pages(**kwargs))
+
+    def get_paginator(self, operation_name: str) -> _Paginator:
+        """
+        Only 'list_objects_v2' is supported.
+        """
+
+        if operation_name != "list_objects_v2":
+            raise NotImplementedError(operation_name)
+        return _Paginator(self)
+
+    def create_multipart_upload(self, Bucket: str, Key: str, **kwargs):
+        """
+        Starts a multipart upload, parts are kept apart until the
+        upload is completed.
+        """
+
+        self.stats.record("create_multipart_upload")
+        upload_id = uuid.uuid4().hex
+        self._create_upload(upload_id)
+        return {"UploadId": upload_id}
+
+    # pylint: disable=too-many-arguments
+    def upload_part(
+        self,
+        Bucket: str,
+        Key: str,
+        UploadId: str,
+        PartNumber: int,
+        Body=b"",
+        **kwargs,
+    ):
+        """
+        Uploads a part.
+        """
+
+        body = _to_bytes(Body)
+        self.stats.record("upload_part", uploaded=len(body))
+        self._write_part(UploadId, PartNumber, body)
+        return {"ETag": f'"{UploadId}-{PartNumber}"'}
+
+    def complete_multipart_upload(
+        self,
+        Bucket: str,
+        Key: str,
+        UploadId: str,
+        MultipartUpload: Dict,
+        **kwargs,
+    ):
+        """
+        Joins the listed parts into the object.
+        """
+
+        self.stats.record("complete_multipart_upload")
+        parts = self._read_parts(
+            UploadId, [part["PartNumber"] for part in MultipartUpload["Parts"]]
+        )
+        etag = self._write(Bucket, Key, parts)
+        self._remove_upload(UploadId)
+        return {"Key": Key, "ETag": etag}
+
+    def abort_multipart_upload(
+        self, Bucket: str, Key: str, UploadId: str, **kwargs
+    ):
+        """
+        Aborts a multipart upload.
+        """
+
+        self.stats.record("abort_multipart_upload")
+        self._remove_upload(UploadId)
+        return {}
+
+
+class LocalS3Client(BaseS3Client):
+    """
+    S3 client storing objects in a local directory.
+    """
+
+    def __init__(self, root: str):
+        """
+        Args:
+            root (str): directory holding a sub-directory per bucket
+        """
+
+        super().__init__()
+        self.root = os.path.abspath(root)
+        os.makedirs(os.path.join(self.root, TMP_DIR), exist_ok=True)
+
+    def _path(self, bucket: str, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, bucket, key))
+        if not path.startswith(os.path.join(self.root, bucket) + os.sep):
+            raise ValueError(f"Invalid key: '{key}'")
+        return path
+
+    def _open(self, bucket: str, key: str) -> Tuple[BinaryIO, int, str]:
+        try:
+            with open(self._path(bucket, key), "rb") as f:
+                stat = os.fstat(f.fileno())
+                body = f.read()
+        except (FileNotFoundError, IsADirectoryError) as e:
+            raise self.exceptions.NoSuchKey(key) from e
+        return io.BytesIO(body), stat.st_size, _etag(stat)
+
+    def _write(self, bucket: str, key: str, chunks: Iterator[bytes]) -> str:
+        path = self._path(bucket, key)
+        tmp_path = os.path.join(self.root, TMP_DIR, uuid.uuid4().hex)
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return _etag(os.stat(path))
+
+    def _remove(self, bucket: str, key: str) -> None:
+        # Also removes the directories the object leaves empty
+        path = self._path(bucket, key)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        bucket_dir = os.path.join(self.root, bucket)
+        directory = os.path.dirname(path)
+        while directory != bucket_dir:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                return
+            directory = os.path.dirname(directory)
+
+    def _list_entries(
+        self, bucket: str, prefix: str, delimiter: str
+    ) -> List[Tuple[str, int, str]]:
+        # With a '/' delimiter only the prefix's directory is scanned
+        if delimiter not in ("", "/"):
+            raise NotImplementedError(f"Delimiter: '{delimiter}'")
+        bucket_dir = os.path.join(self.root, bucket)
+        directory = os.path.join(bucket_dir, prefix.rsplit("/", 1)[0])
+        if "/" not in prefix:
+            directory = bucket_dir
+        if not os.path.isdir(directory):
+            return []
+
+        paths = []
+        if delimiter == "/":
+            with os.scandir(directory) as scan:
+                paths = [(entry.path, entry.is_dir()) for entry in scan]
+        else:
+            for dir_path, _, file_names in os.walk(directory):
+                paths.extend(
+                    (os.path.join(dir_path, file_name), False)
+                    for file_name in file_names
+                )
+        entries = []
+        for path, is_dir in paths:
+            key = os.path.relpath(path, bucket_dir).replace(os.sep, "/")
+            if is_dir:
+                entries.append((f"{key}/", 0, ""))
+            elif key.startswith(prefix):
+                stat = os.stat(path)
+                entries.append((key, stat.st_size, _etag(stat)))
+        return sorted(e for e in entries if e[0].startswith(prefix))
+
+    def _upload_dir(self, upload_id: str) -> str:
+        directory = os.path.join(self.root, UPLOADS_DIR, upload_id)
+        if not os.path.isdir(directory):
+            raise self.exceptions.NoSuchUpload(upload_id)
+        return directory
+
+    def _create_upload(self, upload_id: str) -> None:
+        os.makedirs(os.path.join(self.root, UPLOADS_DIR, upload_id))
+
+    def _write_part(self, upload_id: str, number: int, body: bytes) -> None:
+        path = os.path.join(self._upload_dir(upload_id), f"{number:05d}")
+        with open(path, "wb") as f:
+            f.write(body)
+
+    def _read_parts(
+        self, upload_id: str, numbers: List[int]
+    ) -> Iterator[bytes]:
+        directory = self._upload_dir(upload_id)
+
+        def read_parts() -> Iterator[bytes]:
+            for number in numbers:
+                path = os.path.join(directory, f"{number:05d}")
+                with open(path, "rb") as f:
+                    while chunk := f.read(1024 * 1024):
+                        yield chunk
+
+        return read_parts()
+
+    def _remove_upload(self, upload_id: str) -> None:
+        shutil.rmtree(
+            os.path.join(self.root, UPLOADS_DIR, upload_id), ignore_errors=True
+        )
+
+
+class BaseSqsClient(ABC):
+    """
+    SQS API over the storage methods of a subclass. Received messages
+    are never hidden, only deleted.
+    """
+
+    exceptions = _Exceptions
+
+    def __init__(self):
+        self.stats = ApiStats()
+
+    @abstractmethod
+    def _put_message(self, queue_url: str, message: Dict) -> None:
+        """
+        Adds a message to a queue.
+        """
+
+    @abstractmethod
+    def _get_messages(self, queue_url: str, max_number: int) -> List[Dict]:
+        """
+        Returns:
+            List[Dict]: up to 'max_number' messages of a queue
+        """
+
+    @abstractmethod
+    def _remove_message(self, queue_url: str, receipt_handle: str) -> None:
+        """
+        Removes a message from a queue if it is still there.
+        """
+
+    def _send(
+        self, queue_url: str, body: str, attributes: Optional[Dict]
+    ) -> str:
+        message_id = str(uuid.uuid4())
+        self._put_message(
+            queue_url,
+            {
+                "MessageId": message_id,
+                "ReceiptHandle": message_id,
+                "Body": body,
+                "MessageAttributes": attributes or {},
+            },
+        )
+        return message_id
+
+    def send_message(
+        self,
+        QueueUrl: str,
+        MessageBody: str,
+        MessageAttributes: Optional[Dict] = None,
+        **kwargs,
+    ):
+        """
+        Sends a message.
+        """
+
+        self.stats.record("send_message", uploaded=len(MessageBody))
+        return {
+            "MessageId": self._send(QueueUrl, MessageBody, MessageAttributes)
+        }
+
+    def send_message_batch(self, QueueUrl: str, Entries: List[Dict]):
+        """
+        Sends a batch of messages, every entry succeeds.
+        """
+
+        self.stats.record(
+            "send_message_batch",
+            uploaded=sum(len(entry["MessageBody"]) for entry in Entries),
+        )
+        successful = []
+        for entry in Entries:
+            message_id = self._send(
+                QueueUrl, entry["MessageBody"], entry.get("MessageAttributes")
+            )
+            successful.append({"Id": entry["Id"], "MessageId": message_id})
+        return {"Successful": successful, "Failed": []}
+
+    def receive_message(
+        self, QueueUrl: str, MaxNumberOfMessages: int = 1, **kwargs
+    ):
+        """
+        Receives up to 'MaxNumberOfMessages' messages.
+        """
+
+        messages = self._get_messages(QueueUrl, MaxNumberOfMessages)
+        self.stats.record(
+            "receive_message",
+            downloaded=sum(len(message["Body"]) for message in messages),
+        )
+        return {"Messages": messages}
+
+    def delete_message(self, QueueUrl: str, ReceiptHandle: str, **kwargs):
+        """
+        Deletes a message.
+        """
+
+        self.stats.record("delete_message")
+        self._remove_message(QueueUrl, ReceiptHandle)
+        return {}
+
+    def delete_message_batch(self, QueueUrl: str, Entries: List[Dict]):
+        """
+        Deletes a batch of messages, every entry succeeds.
+        """
+
+        self.stats.record("delete_message_batch")
+        for entry in Entries:
+            self._remove_message(QueueUrl, entry["ReceiptHandle"])
+        return {
+            "Successful": [{"Id": entry["Id"]} for entry in Entries],
+            "Failed": [],
+        }
+
+
+class LocalSqsClient(BaseSqsClient):
+    """
+    SQS client storing each message as a JSON file in a directory
+    per queue.
+    """
+
+    def __init__(self, root: str):
+        """
+        Args:
+            root (str): directory holding a sub-directory per queue
+        """
+
+        super().__init__()
+        self.root = os.path.abspath(root)
+
+    def queue_dir(self, queue_url: str) -> str:
+        """
+        Args:
+            queue_url (str): url of the queue
+        Returns:
+            str: directory of the queue's messages, named after the
+                last part of its url.
+        """
+
+        return os.path.join(self.root, queue_url.rstrip("/").rsplit("/")[-1])
+
+    def _put_message(self, queue_url: str, message: Dict) -> None:
+        directory = self.queue_dir(queue_url)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{message['MessageId']}.json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(message, f)
+        os.replace(f"{path}.tmp", path)
+
+    def _get_messages(self, queue_url: str, max_number: int) -> List[Dict]:
+        directory = self.queue_dir(queue_url)
+        if not os.path.isdir(directory):
+            return []
+        messages: List[Dict] = []
+        for file_name in sorted(os.listdir(directory)):
+            if len(messages) == max_number:
+                break
+            if not file_name.endswith(".json"):
+                continue
+            try:
+                with open(
+                    os.path.join(directory, file_name), encoding="utf-8"
+                ) as f:
+                    messages.append(json.load(f))
+            except FileNotFoundError:
+                # Deleted by another consumer
+                continue
+        return messages
+
+    def _remove_message(self, queue_url: str, receipt_handle: str) -> None:
+        path = os.path.join(
+            self.queue_dir(queue_url),
+            f"{os.path.basename(receipt_handle)}.json",
+        )
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
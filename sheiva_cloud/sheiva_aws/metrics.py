@@ -0,0 +1,369 @@
+"""
+Module for per-stage metrics in CloudWatch Embedded Metric Format.
+
+Timers, counters and byte gauges are aggregated in memory by
+dimensions, counters as a sum and the others as a list of values, and
+printed by 'flush' as one EMF JSON line per set of
+dimensions. CloudWatch extracts the metrics from the Lambda logs, so
+emitting them makes no API calls. Every metric has a 'FunctionName'
+dimension, the Lambda function or 'local', and usually a 'Stage' e.g.
+'ScrapeRound'. Handlers wrapped in 'flushed' flush at the end of each
+invocation.
+
+S3 and SQS calls are timed and their bytes counted by wrapping the
+clients of 'client_factory', see 'instrument_client'.
+
+Metrics are only collected when METRICS_ENABLED is 'true'. Otherwise
+clients are not wrapped, 'timer' returns a shared no-op context
+manager and the other functions return straight away.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Tuple
+
+import boto3
+
+NAMESPACE = os.getenv("METRICS_NAMESPACE", "SheivaCloud")
+FUNCTION_NAME = os.getenv("AWS_LAMBDA_FUNCTION_NAME", "local")
+# EMF allows at most 100 values per metric in a line
+MAX_VALUES = 100
+
+MILLISECONDS = "Milliseconds"
+COUNT = "Count"
+BYTES = "Bytes"
+
+_enabled = os.getenv("METRICS_ENABLED", "false") == "true"
+_lock = threading.Lock()
+# Unit and values of each metric, by sorted dimensions
+_metrics: Dict[Tuple[Tuple[str, str], ...], Dict[str, Tuple[str, List]]] = {}
+_NULL_TIMER = nullcontext()
+
+
+def enabled() -> bool:
+    """
+    Returns:
+        bool: whether metrics are collected
+    """
+
+    return _enabled
+
+
+def set_enabled(enable: bool) -> None:
+    """
+    Turns metrics on or off, clients are only instrumented if metrics
+    were on when they were created or injected.
+    Args:
+        enable (bool): collect metrics
+    """
+
+    global _enabled  # pylint: disable=global-statement
+    _enabled = enable
+
+
+def put_metric(name: str, value: float, unit: str, **dimensions: str) -> None:
+    """
+    Records a value of a metric.
+    Args:
+        name (str): name of the metric e.g. 'Duration'
+        value (float): the value
+        unit (str): CloudWatch unit e.g. 'Milliseconds'
+        dimensions (str): dimensions of the metric e.g. Stage='Parse'
+    """
+
+    if not _enabled:
+        return
+    key = tuple(sorted({"FunctionName": FUNCTION_NAME, **dimensions}.items()))
+    with _lock:
+        values = _metrics.setdefault(key, {}).setdefault(name, (unit, []))[1]
+        # Counts are summed, other values are kept as a distribution
+        if unit == COUNT and values:
+            values[0] += value
+        else:
+            values.append(value)
+        full = len(values) >= MAX_VALUES
+    if full:
+        flush()
+
+
+def count(name: str, value: int = 1, **dimensions: str) -> None:
+    """
+    Records a count, see 'put_metric'.
+    """
+
+    if _enabled:
+        put_metric(name, value, COUNT, **dimensions)
+
+
+def gauge_bytes(name: str, num_bytes: int, **dimensions: str) -> None:
+    """
+    Records a number of bytes, see 'put_metric'.
+    """
+
+    if _enabled:
+        put_metric(name, num_bytes, BYTES, **dimensions)
+
+
+class _Timer:
+    """
+    Records the milliseconds spent in its block, failed or not.
+    """
+
+    def __init__(self, name: str, dimensions: Dict[str, str]):
+        self.name = name
+        self.dimensions = dimensions
+        self._start = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        put_metric(
+            self.name,
+            (time.perf_counter() - self._start) * 1000,
+            MILLISECONDS,
+            **self.dimensions,
+        )
+
+
+def timer(name: str = "Duration", **dimensions: str):
+    """
+    Times a block e.g. 'with metrics.timer(Stage="Parse"):'.
+    Args:
+        name (str): name of the metric
+        dimensions (str): dimensions of the metric
+    Returns:
+        ContextManager: the timer
+    """
+
+    if not _enabled:
+        return _NULL_TIMER
+    return _Timer(name, dimensions)
+
+
+def timed(name: str = "Duration", **dimensions: str) -> Callable:
+    """
+    Decorates a function to time each call, see 'timer'.
+    Args:
+        name (str): name of the metric
+        dimensions (str): dimensions of the metric
+    Returns:
+        Callable: the decorator
+    """
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Timer(name, dimensions):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def flush() -> None:
+    """
+    Prints the recorded metrics as EMF lines and clears them.
+    """
+
+    global _metrics  # pylint: disable=global-statement
+    with _lock:
+        metrics, _metrics = _metrics, {}
+    timestamp = int(time.time() * 1000)
+    for key, named_values in metrics.items():
+        dimensions = dict(key)
+        line: Dict[str, Any] = {
+            "_aws": {
+                "Timestamp": timestamp,
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": NAMESPACE,
+                        "Dimensions": [sorted(dimensions)],
+                        "Metrics": [
+                            {"Name": name, "Unit": unit}
+                            for name, (unit, _) in named_values.items()
+                        ],
+                    }
+                ],
+            },
+            **dimensions,
+        }
+        for name, (_, values) in named_values.items():
+            line[name] = values if len(values) > 1 else values[0]
+        print(json.dumps(line, separators=(",", ":")))
+
+
+def flushed(handler: Callable) -> Callable:
+    """
+    Decorates a Lambda handler to flush the metrics after each
+    invocation, even a failed one.
+    Args:
+        handler (Callable): Lambda handler
+    Returns:
+        Callable: the decorated handler
+    """
+
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            if _enabled:
+                flush()
+
+    return wrapper
+
+
+def _s3_bytes(operation: str, kwargs: Dict, response: Dict) -> Tuple[int, int]:
+    if operation == "get_object":
+        return 0, response.get("ContentLength", 0)
+    body = kwargs.get("Body")
+    if isinstance(body, (bytes, bytearray, memoryview, str)):
+        return len(body), 0
+    return 0, 0
+
+
+def _sqs_bytes(
+    operation: str, kwargs: Dict, response: Dict
+) -> Tuple[int, int]:
+    if operation == "send_message":
+        return len(kwargs["MessageBody"]), 0
+    if operation == "send_message_batch":
+        return sum(len(e["MessageBody"]) for e in kwargs["Entries"]), 0
+    if operation == "receive_message":
+        return 0, sum(len(m["Body"]) for m in response.get("Messages", []))
+    return 0, 0
+
+
+# Operations timed per service and how to count their bytes
+_OPERATIONS = {
+    "s3": (
+        {
+            "get_object",
+            "put_object",
+            "list_objects_v2",
+            "delete_object",
+            "delete_objects",
+            "create_multipart_upload",
+            "upload_part",
+            "complete_multipart_upload",
+            "abort_multipart_upload",
+        },
+        _s3_bytes,
+    ),
+    "sqs": (
+        {
+            "send_message",
+            "send_message_batch",
+            "receive_message",
+            "delete_message",
+            "delete_message_batch",
+        },
+        _sqs_bytes,
+    ),
+}
+
+
+class _InstrumentedPaginator:
+    """
+    Times each page fetched by a paginator.
+    """
+
+    def __init__(self, paginator, service: str, operation: str):
+        self._paginator = paginator
+        self._dimensions = {"Service": service, "Operation": operation}
+
+    def paginate(self, **kwargs):
+        """
+        Yields the pages of the wrapped paginator.
+        """
+
+        pages = iter(self._paginator.paginate(**kwargs))
+        while True:
+            start = time.perf_counter()
+            page = next(pages, None)
+            if page is None:
+                return
+            put_metric(
+                "Latency",
+                (time.perf_counter() - start) * 1000,
+                MILLISECONDS,
+                **self._dimensions,
+            )
+            count("Calls", **self._dimensions)
+            yield page
+
+
+class InstrumentedClient:
+    """
+    Wraps a boto3 client, timing its S3 or SQS calls and counting
+    their errors and bytes. Everything else is passed through.
+    """
+
+    def __init__(self, client: boto3.client, service: str):
+        """
+        Args:
+            client (boto3.client): client to wrap
+            service (str): name of the service, 's3' or 'sqs'
+        """
+
+        self._client = client
+        self._service = service
+        self._operations, self._count_bytes = _OPERATIONS[service]
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._client, name)
+        if name == "get_paginator":
+            return lambda operation: _InstrumentedPaginator(
+                attribute(operation), self._service, operation
+            )
+        if name not in self._operations:
+            return attribute
+
+        dimensions = {"Service": self._service, "Operation": name}
+
+        @functools.wraps(attribute)
+        def call(**kwargs):
+            try:
+                with timer("Latency", **dimensions):
+                    response = attribute(**kwargs)
+            except Exception:
+                count("Errors", **dimensions)
+                raise
+            count("Calls", **dimensions)
+            uploaded, downloaded = self._count_bytes(name, kwargs, response)
+            if uploaded:
+                gauge_bytes("BytesUploaded", uploaded, **dimensions)
+            if downloaded:
+                gauge_bytes("BytesDownloaded", downloaded, **dimensions)
+            return response
+
+        return call
+
+
+def instrument_client(client: boto3.client, service: str) -> boto3.client:
+    """
+    Wraps a client in an 'InstrumentedClient' if metrics are enabled
+    and its service is instrumented.
+    Args:
+        client (boto3.client): the client
+        service (str): name of the service e.g. 's3'
+    Returns:
+        boto3.client: the wrapped or original client
+    """
+
+    if (
+        not _enabled
+        or service not in _OPERATIONS
+        or isinstance(client, InstrumentedClient)
+    ):
+        return client
+    return InstrumentedClient(client, service)
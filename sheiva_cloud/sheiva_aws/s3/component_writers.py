@@ -0,0 +1,327 @@
+"""
+Module for writing transformed components (workouts, sets, ...)
+to S3 in batches.
+
+Every writer streams to its object through an 'S3UploadStream' so
+only the current batch is held in memory. CSV is kept for
+compatibility, Parquet output is compressed.
+
+The columns of a component are declared in 'COMPONENT_SCHEMAS' and
+every batch is converted to them before it is written, so each
+source file gives exactly one file per component and every file of
+a component has the same schema. Fields a component does not
+declare are kept as a JSON object in its 'EXTRA_COLUMN'.
+
+Parquet output requires the optional 'pyarrow' dependency.
+"""
+
+import json
+import math
+from typing import Any, Callable, Dict, List, Optional
+
+import boto3
+import pandas as pd
+
+from . import SHEIVA_SCRAPE_BUCKET, streaming
+
+PARQUET_COMPRESSION = "zstd"
+INT64 = "int64"
+FLOAT64 = "float64"
+STRING = "string"
+EXTRA_COLUMN = "extra"
+
+# Columns of each component and their types, every column is nullable
+COMPONENT_SCHEMAS: Dict[str, Dict[str, str]] = {
+    "workouts": {"id": STRING, "name": STRING, "date": STRING},
+    "workout_components": {
+        "id": STRING,
+        "workout_id": STRING,
+        "name": STRING,
+    },
+    "sets": {"id": STRING, "workout_component_id": STRING, "name": STRING},
+    "set_components": {
+        "set_id": STRING,
+        "exercise_name": STRING,
+        "reps": INT64,
+        "weight": FLOAT64,
+    },
+}
+
+
+def component_columns(component: str) -> Dict[str, str]:
+    """
+    Args:
+        component (str): name of the component e.g. 'workouts'
+    Returns:
+        Dict[str, str]: types of the component's columns by name,
+            'EXTRA_COLUMN' last.
+    """
+
+    return {**COMPONENT_SCHEMAS.get(component, {}), EXTRA_COLUMN: STRING}
+
+
+def _to_int(value: Any) -> int:
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(f"{value!r} is not an integer")
+    return int(value)
+
+
+def _to_string(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+_CONVERTERS: Dict[str, Callable[[Any], Any]] = {
+    INT64: _to_int,
+    FLOAT64: float,
+    STRING: _to_string,
+}
+
+
+def _is_null(value: Any) -> bool:
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def conform_rows(rows: List[Dict], columns: Dict[str, str]) -> Dict[str, List]:
+    """
+    Converts rows to the values of the declared columns.
+    Args:
+        rows (List[Dict]): rows of a component
+        columns (Dict[str, str]): types of the columns by name, see
+            'component_columns'
+    Returns:
+        Dict[str, List]: values of each column, None where missing
+    Raises:
+        ValueError: if a value cannot be converted to the type of
+            its column
+    """
+
+    values: Dict[str, List] = {name: [] for name in columns}
+    for row in rows:
+        extra = {}
+        for name, value in row.items():
+            if name not in columns or name == EXTRA_COLUMN:
+                if not _is_null(value):
+                    extra[name] = value
+        for name, type_name in columns.items():
+            if name == EXTRA_COLUMN:
+                values[name].append(
+                    json.dumps(extra, default=str) if extra else None
+                )
+                continue
+            value = row.get(name)
+            if _is_null(value):
+                values[name].append(None)
+                continue
+            try:
+                values[name].append(_CONVERTERS[type_name](value))
+            except (TypeError, ValueError) as e:
+                raise ValueError(
+                    f"Column '{name}' expects {type_name}, got {value!r}"
+                ) from e
+    return values
+
+
+class ComponentWriter:
+    """
+    Base class for a component writer. Rows are appended with
+    'write' and the object is only created on 'close'.
+    """
+
+    extension = ""
+    content_type = ""
+
+    def __init__(
+        self,
+        s3_client: boto3.client,
+        output_dir: str,
+        file_name: str,
+        component: str,
+    ):
+        """
+        Args:
+            s3_client (boto3.client): s3 client
+            output_dir (str): key prefix of the component
+            file_name (str): file name without extension
+            component (str): name of the component, its columns are
+                those of 'component_columns'
+        """
+
+        self.s3_client = s3_client
+        self.output_dir = output_dir
+        self.file_name = file_name
+        self.columns = component_columns(component)
+        self.upload_stream = streaming.S3UploadStream(
+            s3_client=s3_client,
+            bucket=SHEIVA_SCRAPE_BUCKET,
+            key=f"{output_dir}/{file_name}.{self.extension}",
+            extra_args={"ContentType": self.content_type},
+        )
+
+    def write(self, components: List[Dict]) -> None:
+        """
+        Appends rows to the component file.
+        Args:
+            components (List[Dict]): rows to append
+        """
+
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """
+        Completes the upload.
+        """
+
+        self.upload_stream.close()
+
+    def abort(self) -> None:
+        """
+        Aborts the upload.
+        """
+
+        self.upload_stream.abort()
+
+
+class CsvComponentWriter(ComponentWriter):
+    """
+    Writes a component as csv, the header is written with the first
+    batch.
+    """
+
+    extension = "csv"
+    content_type = "text/csv"
+
+    def __init__(
+        self,
+        s3_client: boto3.client,
+        output_dir: str,
+        file_name: str,
+        component: str,
+    ):
+        super().__init__(
+            s3_client=s3_client,
+            output_dir=output_dir,
+            file_name=file_name,
+            component=component,
+        )
+        self.header_written = False
+
+    def write(self, components: List[Dict]) -> None:
+        if not components:
+            return
+        # Object columns keep integers from being written as floats
+        pd.DataFrame(
+            conform_rows(components, self.columns),
+            columns=list(self.columns),
+            dtype=object,
+        ).to_csv(
+            self.upload_stream, header=not self.header_written, index=False
+        )
+        self.header_written = True
+
+
+class ParquetComponentWriter(ComponentWriter):
+    """
+    Writes a component as compressed Parquet with its declared
+    schema, one row group per batch.
+    """
+
+    extension = "parquet"
+    content_type = "application/vnd.apache.parquet"
+
+    def __init__(
+        self,
+        s3_client: boto3.client,
+        output_dir: str,
+        file_name: str,
+        component: str,
+        compression: str = PARQUET_COMPRESSION,
+    ):
+        # pylint: disable=import-outside-toplevel
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError(
+                "Parquet output requires the 'pyarrow' package"
+            ) from e
+
+        super().__init__(
+            s3_client=s3_client,
+            output_dir=output_dir,
+            file_name=file_name,
+            component=component,
+        )
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.compression = compression
+        self.schema = pyarrow.schema(
+            pyarrow.field(name, getattr(pyarrow, type_name)())
+            for name, type_name in self.columns.items()
+        )
+        self.parquet_writer: Optional[Any] = None
+
+    def write(self, components: List[Dict]) -> None:
+        if not components:
+            return
+        if self.parquet_writer is None:
+            self.parquet_writer = self.pq.ParquetWriter(
+                self.upload_stream,
+                self.schema,
+                compression=self.compression,
+            )
+        self.parquet_writer.write_table(
+            self.pa.Table.from_pydict(
+                conform_rows(components, self.columns), schema=self.schema
+            )
+        )
+
+    def close(self) -> None:
+        # An empty Parquet object is not a valid file, skip it
+        if self.parquet_writer is None:
+            self.abort()
+            return
+        self.parquet_writer.close()
+        self.parquet_writer = None
+        super().close()
+
+
+OUTPUT_FORMATS = {
+    "csv": CsvComponentWriter,
+    "parquet": ParquetComponentWriter,
+}
+
+
+def get_component_writer(
+    output_format: str,
+    s3_client: boto3.client,
+    output_dir: str,
+    file_name: str,
+    component: str,
+) -> ComponentWriter:
+    """
+    Opens a writer for a component.
+    Args:
+        output_format (str): one of 'OUTPUT_FORMATS'
+        s3_client (boto3.client): s3 client
+        output_dir (str): key prefix of the component
+        file_name (str): file name without extension
+        component (str): name of the component e.g. 'workouts'
+    Returns:
+        ComponentWriter: the component writer
+    """
+
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"Unsupported output format: '{output_format}', expected "
+            f"one of {list(OUTPUT_FORMATS)}"
+        )
+    return OUTPUT_FORMATS[output_format](
+        s3_client=s3_client,
+        output_dir=output_dir,
+        file_name=file_name,
+        component=component,
+    )
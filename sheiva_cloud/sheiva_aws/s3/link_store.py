@@ -0,0 +1,568 @@
+"""
+Module for the chunked workout link store used by the scraper trigger.
+
+Each age group's workout links are sharded into fixed size, immutable
+chunk objects next to a small cursor object that records how many
+links have been claimed:
+
+    {WORKOUT_LINK_DIR}/{gender}/{age_group}/cursor.json
+    .../{age_group}/chunks/{generation}/00000000.json.gz
+    .../{age_group}/chunks/{generation}/00000001.json.gz
+
+Claiming links reads the cursor and the one or two chunks it points
+into and only ever rewrites the cursor. The codec of the chunks is
+recorded in the cursor, cursors written before it was are plain JSON.
+
+Rewriting an age group writes a new generation of chunks and then
+switches the cursor to it, so a chunk a cursor points into is never
+rewritten. The generation before the new one is kept for readers
+still holding the old cursor, older ones are deleted. Cursors written
+before generations existed point at chunks directly under 'chunks/'.
+
+Progress is read from the cursors, which record the total and claimed
+links of their age group, so no listing or download of the links is
+needed to report it.
+"""
+
+import json
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from typing import Dict, Iterable, List, Optional, Set, Tuple, TypedDict
+from uuid import uuid4
+
+import boto3
+
+from . import SHEIVA_SCRAPE_BUCKET, listing, object_codecs
+
+WORKOUT_LINK_DIR = "highrise/user-data/user-workout-links"
+CHUNK_SIZE = 500
+CURSOR_FILE_NAME = "cursor.json"
+CHUNK_CODEC = "json-gzip"
+LINK_STORE_VERSION = 3
+
+
+class LinkCursor(TypedDict):
+    """
+    Structure of an age group's cursor object.
+    chunk_size: number of links per chunk
+    num_chunks: number of chunk objects
+    total_links: number of links across all chunks
+    offset: number of links claimed so far
+    codec: codec of the chunks, one of 'object_codecs.CODECS'
+    generation: generation of the chunks, '' for chunks written
+        before generations existed
+    updated_at: unix time the cursor was saved
+    """
+
+    version: int
+    chunk_size: int
+    num_chunks: int
+    total_links: int
+    offset: int
+    codec: str
+    generation: str
+    updated_at: float
+
+
+class AgeGroupStats(TypedDict):
+    """
+    Structure of an age group's progress, read from its cursor.
+    total_links: number of links written to the age group
+    claimed: number of links claimed so far
+    updated_at: unix time of the last update, 0 if unknown
+    """
+
+    total_links: int
+    claimed: int
+    updated_at: float
+
+
+class LinkStoreStats(TypedDict):
+    """
+    Structure of a gender's stats, see 'LinkStore.load_stats'.
+    """
+
+    version: int
+    age_groups: Dict[str, AgeGroupStats]
+
+
+class LinkStore:
+    """
+    Chunked workout link store for a single gender.
+    """
+
+    def __init__(
+        self,
+        s3_client: boto3.client,
+        gender: str,
+        max_workers: int = 8,
+        codec: str = CHUNK_CODEC,
+    ):
+        """
+        Args:
+            s3_client (boto3.client): s3 client
+            gender (str): gender of the workout links
+            max_workers (int): number of concurrent chunk requests
+            codec (str): codec of newly written chunks
+        """
+
+        self.s3_client = s3_client
+        self.gender = gender
+        self.max_workers = max_workers
+        self.codec = codec
+        self.gender_dir = f"{WORKOUT_LINK_DIR}/{gender}"
+
+    def age_group_dir(self, age_group: str) -> str:
+        """
+        Args:
+            age_group (str): age group e.g. 'age_16_20'
+        Returns:
+            str: key prefix of the age group
+        """
+
+        return f"{self.gender_dir}/{age_group}"
+
+    def chunks_dir(self, age_group: str, generation: str = "") -> str:
+        """
+        Args:
+            age_group (str): age group e.g. 'age_16_20'
+            generation (str): generation of the chunks
+        Returns:
+            str: key prefix of a generation's chunks, ending with '/'
+        """
+
+        chunks_dir = f"{self.age_group_dir(age_group)}/chunks/"
+        return f"{chunks_dir}{generation}/" if generation else chunks_dir
+
+    def chunk_key(
+        self, age_group: str, index: int, codec: str, generation: str = ""
+    ) -> str:
+        """
+        Args:
+            age_group (str): age group e.g. 'age_16_20'
+            index (int): index of the chunk
+            codec (str): codec of the chunk
+            generation (str): generation of the chunk
+        Returns:
+            str: bucket key of the chunk
+        """
+
+        return (
+            f"{self.chunks_dir(age_group, generation)}{index:08d}"
+            f"{object_codecs.get_codec(codec).key_extension}"
+        )
+
+    def cursor_key(self, age_group: str) -> str:
+        """
+        Args:
+            age_group (str): age group e.g. 'age_16_20'
+        Returns:
+            str: bucket key of the age group's cursor
+        """
+
+        return f"{self.age_group_dir(age_group)}/{CURSOR_FILE_NAME}"
+
+    def age_groups(self) -> List[str]:
+        """
+        Lists the age groups in the store.
+        Returns:
+            List[str]: age groups e.g. ['age_16_20', ...]
+        """
+
+        age_group_dirs, _ = listing.list_sub_prefixes(
+            s3_client=self.s3_client, prefix=f"{self.gender_dir}/"
+        )
+        # Age groups without a cursor are still being written
+        return sorted(
+            key.split("/")[-2]
+            for key in listing.list_keys(
+                s3_client=self.s3_client,
+                prefix=f"{self.gender_dir}/",
+                sub_prefixes=[
+                    f"{age_group_dir}{CURSOR_FILE_NAME}"
+                    for age_group_dir in age_group_dirs
+                ],
+            )
+        )
+
+    def load_cursor(self, age_group: str) -> LinkCursor:
+        """
+        Args:
+            age_group (str): age group e.g. 'age_16_20'
+        Returns:
+            LinkCursor: the age group's cursor
+        """
+
+        response = self.s3_client.get_object(
+            Bucket=SHEIVA_SCRAPE_BUCKET, Key=self.cursor_key(age_group)
+        )
+        cursor = json.loads(response["Body"].read())
+        cursor.setdefault("codec", "json")
+        cursor.setdefault("generation", "")
+        cursor.setdefault("updated_at", 0.0)
+        return cursor
+
+    def save_cursor(self, age_group: str, cursor: LinkCursor) -> LinkCursor:
+        """
+        Saves a cursor, stamping its 'updated_at'.
+        Args:
+            age_group (str): age group e.g. 'age_16_20'
+            cursor (LinkCursor): cursor to save
+        Returns:
+            LinkCursor: the saved cursor
+        """
+
+        cursor = LinkCursor(**{**cursor, "updated_at": time.time()})
+        self.s3_client.put_object(
+            Bucket=SHEIVA_SCRAPE_BUCKET,
+            Key=self.cursor_key(age_group),
+            Body=json.dumps(cursor),
+            ContentType="application/json",
+        )
+        return cursor
+
+    def load_stats(self) -> LinkStoreStats:
+        """
+        Reads the total and claimed links of every age group from
+        their cursors, concurrently.
+        Returns:
+            LinkStoreStats: the stats of every age group
+        """
+
+        age_groups = self.age_groups()
+        stats = LinkStoreStats(version=LINK_STORE_VERSION, age_groups={})
+        if not age_groups:
+            return stats
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_workers, len(age_groups))
+        ) as executor:
+            cursors = executor.map(self.load_cursor, age_groups)
+            for age_group, cursor in zip(age_groups, cursors):
+                stats["age_groups"][age_group] = AgeGroupStats(
+                    total_links=cursor["total_links"],
+                    claimed=cursor["offset"],
+                    updated_at=cursor["updated_at"],
+                )
+        return stats
+
+    def read_chunk(
+        self, age_group: str, index: int, codec: str, generation: str = ""
+    ) -> List[str]:
+        """
+        Args:
+            age_group (str): age group e.g. 'age_16_20'
+            index (int): index of the chunk
+            codec (str): codec of the chunk
+            generation (str): generation of the chunk
+        Returns:
+            List[str]: links in the chunk
+        """
+
+        return object_codecs.read_items(
+            s3_client=self.s3_client,
+            key=self.chunk_key(age_group, index, codec, generation),
+            bucket=SHEIVA_SCRAPE_BUCKET,
+        )
+
+    def put_chunk(
+        self, age_group: str, index: int, links: List[str], generation: str
+    ) -> None:
+        """
+        Args:
+            age_group (str): age group e.g. 'age_16_20'
+            index (int): index of the chunk
+            links (List[str]): links of the chunk
+            generation (str): generation of the chunk
+        """
+
+        object_codecs.put_items(
+            s3_client=self.s3_client,
+            key=self.chunk_key(age_group, index, self.codec, generation),
+            items=links,
+            codec=object_codecs.get_codec(self.codec),
+            bucket=SHEIVA_SCRAPE_BUCKET,
+        )
+
+    def delete_generations(
+        self, age_group: str, keep: Iterable[str]
+    ) -> List[str]:
+        """
+        Deletes the chunks of every generation of an age group but
+        those kept.
+        Args:
+            age_group (str): age group e.g. 'age_16_20'
+            keep (Iterable[str]): generations to keep, '' for chunks
+                written before generations existed
+        Returns:
+            List[str]: the deleted generations
+        """
+
+        keep = set(keep)
+        chunks_dir = self.chunks_dir(age_group)
+        generation_dirs, legacy_chunks = listing.list_sub_prefixes(
+            s3_client=self.s3_client, prefix=chunks_dir
+        )
+        deleted = [
+            generation_dir[len(chunks_dir) : -1]
+            for generation_dir in generation_dirs
+            if generation_dir[len(chunks_dir) : -1] not in keep
+        ]
+        keys = [] if "" in keep else list(legacy_chunks)
+        if "" not in keep and legacy_chunks:
+            deleted.append("")
+        for generation in deleted:
+            if generation:
+                keys.extend(
+                    listing.list_keys(
+                        s3_client=self.s3_client,
+                        prefix=self.chunks_dir(age_group, generation),
+                    )
+                )
+        for i in range(0, len(keys), 1000):
+            self.s3_client.delete_objects(
+                Bucket=SHEIVA_SCRAPE_BUCKET,
+                Delete={
+                    "Objects": [{"Key": key} for key in keys[i : i + 1000]],
+                    "Quiet": True,
+                },
+            )
+        return deleted
+
+    def open_writer(
+        self,
+        age_group: str,
+        chunk_size: int = CHUNK_SIZE,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ) -> "LinkWriter":
+        """
+        Opens a writer that replaces an age group's links, see
+        'LinkWriter'.
+        Args:
+            age_group (str): age group e.g. 'age_16_20'
+            chunk_size (int): number of links per chunk
+            executor (ThreadPoolExecutor, optional): executor to upload
+                chunks with, shared by writers open at the same time.
+        Returns:
+            LinkWriter: the writer
+        """
+
+        return LinkWriter(
+            store=self,
+            age_group=age_group,
+            chunk_size=chunk_size,
+            executor=executor,
+        )
+
+    def write_links(
+        self,
+        age_group: str,
+        links: Iterable[str],
+        chunk_size: int = CHUNK_SIZE,
+    ) -> LinkCursor:
+        """
+        Writes an age group's links as chunks, uploaded concurrently,
+        followed by a fresh cursor. The cursor is written last so a
+        partially written age group is never claimed from.
+        Args:
+            age_group (str): age group e.g. 'age_16_20'
+            links (Iterable[str]): links of the age group
+            chunk_size (int): number of links per chunk
+        Returns:
+            LinkCursor: the new cursor
+        """
+
+        writer = self.open_writer(age_group=age_group, chunk_size=chunk_size)
+        writer.write(links)
+        return writer.close()
+
+    def read_links(
+        self, age_group: str, num_links: int
+    ) -> Tuple[List[str], LinkCursor]:
+        """
+        Reads the next unclaimed links of an age group without
+        claiming them, see 'advance'.
+        Args:
+            age_group (str): age group e.g. 'age_16_20'
+            num_links (int): maximum number of links to read
+        Returns:
+            Tuple[List[str], LinkCursor]: the links and the cursor
+                they were read at.
+        """
+
+        cursor = self.load_cursor(age_group)
+        start = cursor["offset"]
+        end = min(start + num_links, cursor["total_links"])
+        if start >= end:
+            return [], cursor
+
+        chunk_size = cursor["chunk_size"]
+        first_chunk = start // chunk_size
+        chunk_indexes = range(first_chunk, (end - 1) // chunk_size + 1)
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_workers, len(chunk_indexes))
+        ) as executor:
+            chunks = executor.map(
+                lambda index: self.read_chunk(
+                    age_group, index, cursor["codec"], cursor["generation"]
+                ),
+                chunk_indexes,
+            )
+            links = [link for chunk in chunks for link in chunk]
+
+        offset = first_chunk * chunk_size
+        return links[start - offset : end - offset], cursor
+
+    def advance(
+        self, age_group: str, cursor: LinkCursor, num_links: int
+    ) -> LinkCursor:
+        """
+        Claims links by moving the cursor past them. The cursor never
+        moves back, so a slower overlapping claim cannot undo a faster
+        one. Nothing is claimed if the age group has been rewritten
+        since the links were read, the new links start unclaimed.
+        Args:
+            age_group (str): age group e.g. 'age_16_20'
+            cursor (LinkCursor): cursor the links were read at
+            num_links (int): number of links to claim
+        Returns:
+            LinkCursor: the saved or current cursor
+        """
+
+        current = self.load_cursor(age_group)
+        if current["generation"] != cursor["generation"]:
+            print(
+                f"Not claiming {num_links} links of {age_group}, it was "
+                "rewritten after they were read"
+            )
+            return current
+        return self.save_cursor(
+            age_group=age_group,
+            cursor=LinkCursor(
+                **{
+                    **current,
+                    "offset": min(
+                        max(current["offset"], cursor["offset"] + num_links),
+                        current["total_links"],
+                    ),
+                }
+            ),
+        )
+
+
+# pylint: disable=too-many-instance-attributes
+class LinkWriter:
+    """
+    Streams links into a new generation of an age group's chunks.
+    Full chunks are uploaded in the background, at most
+    '2 * max_workers' of the store at a time, so only the chunks in
+    flight are held in memory. 'close' uploads the last chunk, then
+    the cursor, and deletes the generations before the previous one.
+    """
+
+    def __init__(
+        self,
+        store: LinkStore,
+        age_group: str,
+        chunk_size: int = CHUNK_SIZE,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ):
+        """
+        Args:
+            store (LinkStore): link store to write to
+            age_group (str): age group e.g. 'age_16_20'
+            chunk_size (int): number of links per chunk
+            executor (ThreadPoolExecutor, optional): executor to upload
+                chunks with, one is created if not given.
+        """
+
+        self.store = store
+        self.age_group = age_group
+        self.chunk_size = chunk_size
+        self._own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=store.max_workers
+        )
+        self.generation = f"{time.time_ns():020d}-{uuid4().hex[:8]}"
+        self.num_chunks = 0
+        self.total_links = 0
+        self._chunk: List[str] = []
+        self._in_flight: Set[Future] = set()
+
+    def _collect(self, futures) -> None:
+        for future in futures:
+            self._in_flight.discard(future)
+            future.result()
+
+    def _flush(self) -> None:
+        if len(self._in_flight) >= 2 * self.store.max_workers:
+            done, _ = wait(self._in_flight, return_when=FIRST_COMPLETED)
+            self._collect(done)
+        self._in_flight.add(
+            self.executor.submit(
+                self.store.put_chunk,
+                self.age_group,
+                self.num_chunks,
+                self._chunk,
+                self.generation,
+            )
+        )
+        self.num_chunks += 1
+        self._chunk = []
+
+    def write(self, links: Iterable[str]) -> None:
+        """
+        Args:
+            links (Iterable[str]): next links of the age group
+        """
+
+        for link in links:
+            self._chunk.append(link)
+            self.total_links += 1
+            if len(self._chunk) == self.chunk_size:
+                self._flush()
+
+    def close(self) -> LinkCursor:
+        """
+        Waits for every chunk to be uploaded, then writes the cursor
+        and deletes the generations no cursor can point into.
+        Returns:
+            LinkCursor: the new cursor
+        """
+
+        try:
+            if self._chunk:
+                self._flush()
+            self._collect(list(self._in_flight))
+        finally:
+            if self._own_executor:
+                self.executor.shutdown()
+
+        try:
+            previous = self.store.load_cursor(self.age_group)["generation"]
+        except self.store.s3_client.exceptions.NoSuchKey:
+            previous = None
+        cursor = self.store.save_cursor(
+            age_group=self.age_group,
+            cursor=LinkCursor(
+                version=LINK_STORE_VERSION,
+                chunk_size=self.chunk_size,
+                num_chunks=self.num_chunks,
+                total_links=self.total_links,
+                offset=0,
+                codec=self.store.codec,
+                generation=self.generation,
+                updated_at=0.0,
+            ),
+        )
+        keep = {self.generation}
+        if previous is not None:
+            keep.add(previous)
+        deleted = self.store.delete_generations(self.age_group, keep=keep)
+        if deleted:
+            print(f"Deleted {len(deleted)} old link chunk generations")
+        return cursor
@@ -0,0 +1,202 @@
+"""
+Module for listing bucket keys.
+
+The prefix is always pushed to S3 so listing cost scales with the
+matching subtree rather than the whole bucket. Large subtrees can be
+fanned out over their sub-prefixes (e.g. gender/age group), which are
+then listed concurrently on a thread pool. Keys are streamed back as
+each page arrives, at most 'PAGES_BUFFERED_PER_WORKER' pages per
+worker are buffered so a slow consumer holds the workers back.
+"""
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+import boto3
+
+from . import SHEIVA_SCRAPE_BUCKET
+
+_DONE = object()
+PAGES_BUFFERED_PER_WORKER = 2
+
+
+def list_sub_prefixes(
+    s3_client: boto3.client,
+    prefix: str,
+    bucket: str = SHEIVA_SCRAPE_BUCKET,
+) -> Tuple[List[str], List[str]]:
+    """
+    Lists the immediate sub-prefixes and keys of a prefix.
+    Args:
+        s3_client (boto3.client): s3 client
+        prefix (str): prefix to list, should end with '/'
+        bucket (str): name of the bucket
+    Returns:
+        Tuple[List[str], List[str]]: sub-prefixes and the keys that
+            sit directly under the prefix.
+    """
+
+    sub_prefixes: List[str] = []
+    keys: List[str] = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(
+        Bucket=bucket, Prefix=prefix, Delimiter="/"
+    ):
+        sub_prefixes.extend(
+            p["Prefix"] for p in page.get("CommonPrefixes", [])
+        )
+        keys.extend(f["Key"] for f in page.get("Contents", []))
+    return sub_prefixes, keys
+
+
+def _list_prefix_pages(
+    s3_client: boto3.client,
+    bucket: str,
+    prefix: str,
+    start_after: Optional[str],
+) -> Iterator[List[str]]:
+    """
+    Lists a prefix yielding the keys of each page.
+    """
+
+    paginator = s3_client.get_paginator("list_objects_v2")
+    kwargs = {"Bucket": bucket, "Prefix": prefix}
+    if start_after:
+        kwargs["StartAfter"] = start_after
+    for page in paginator.paginate(**kwargs):
+        yield [f["Key"] for f in page.get("Contents", [])]
+
+
+def _fan_out(
+    s3_client: boto3.client,
+    prefix: str,
+    depth: int,
+    bucket: str,
+) -> Tuple[List[str], List[str]]:
+    """
+    Expands a prefix 'depth' levels down.
+    Returns:
+        Tuple[List[str], List[str]]: prefixes to list and keys found
+            above them while expanding.
+    """
+
+    prefixes = [prefix]
+    keys: List[str] = []
+    for _ in range(depth):
+        next_prefixes = []
+        for current in prefixes:
+            sub_prefixes, direct_keys = list_sub_prefixes(
+                s3_client=s3_client, prefix=current, bucket=bucket
+            )
+            next_prefixes.extend(sub_prefixes)
+            keys.extend(direct_keys)
+        prefixes = next_prefixes
+    return prefixes, keys
+
+
+# pylint: disable=too-many-arguments,too-many-locals
+def list_keys(
+    s3_client: boto3.client,
+    prefix: str,
+    suffix: Optional[str] = None,
+    fan_out_depth: int = 0,
+    sub_prefixes: Optional[List[str]] = None,
+    start_after: Optional[str] = None,
+    max_workers: int = 8,
+    bucket: str = SHEIVA_SCRAPE_BUCKET,
+) -> Iterator[str]:
+    """
+    Streams the keys under a prefix.
+    Args:
+        s3_client (boto3.client): s3 client
+        prefix (str): prefix to list
+        suffix (Optional[str]): only yield keys ending with this
+        fan_out_depth (int): number of '/' levels below the prefix
+            to discover and list concurrently, 0 lists the prefix
+            with a single paginator.
+        sub_prefixes (Optional[List[str]]): known prefixes to list
+            concurrently instead of discovering them.
+        start_after (Optional[str]): only yield keys after this key
+        max_workers (int): number of prefixes listed concurrently
+        bucket (str): name of the bucket
+    Returns:
+        Iterator[str]: bucket keys, ordered within each sub-prefix.
+    """
+
+    def matches(key: str) -> bool:
+        return (suffix is None or key.endswith(suffix)) and (
+            start_after is None or key > start_after
+        )
+
+    if sub_prefixes is None and not fan_out_depth:
+        for keys in _list_prefix_pages(
+            s3_client=s3_client,
+            bucket=bucket,
+            prefix=prefix,
+            start_after=start_after,
+        ):
+            yield from filter(matches, keys)
+        return
+
+    if sub_prefixes is None:
+        sub_prefixes, direct_keys = _fan_out(
+            s3_client=s3_client,
+            prefix=prefix,
+            depth=fan_out_depth,
+            bucket=bucket,
+        )
+        yield from filter(matches, direct_keys)
+    if not sub_prefixes:
+        return
+
+    num_workers = min(max_workers, len(sub_prefixes))
+    pages: queue.Queue = queue.Queue(
+        maxsize=num_workers * PAGES_BUFFERED_PER_WORKER
+    )
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # Gives up once the consumer has stopped reading
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def list_sub_prefix(sub_prefix: str) -> None:
+        try:
+            for keys in _list_prefix_pages(
+                s3_client=s3_client,
+                bucket=bucket,
+                prefix=sub_prefix,
+                start_after=start_after,
+            ):
+                if not put(keys):
+                    return
+        # pylint: disable=broad-except
+        except Exception as e:
+            put(e)
+        finally:
+            put(_DONE)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for sub_prefix in sub_prefixes:
+            executor.submit(list_sub_prefix, sub_prefix)
+        try:
+            remaining = len(sub_prefixes)
+            while remaining:
+                page = pages.get()
+                if page is _DONE:
+                    remaining -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield from filter(matches, page)
+        finally:
+            # Lets the workers finish early if the caller stops reading
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
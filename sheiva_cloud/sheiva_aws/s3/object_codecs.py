@@ -0,0 +1,575 @@
+"""
+Module for encoding and decoding lists of JSON items stored in S3,
+e.g. a batch of scraped workouts or a chunk of workout links.
+
+A codec pairs a layout, a JSON array or JSON Lines, with a
+compression. The codec of an object is recorded twice: in the key's
+extension ('.json', '.json.gz', '.jsonl.gz', ...) and in the object's
+'ContentEncoding'. Readers detect it from either, so objects written
+before codecs existed, plain (possibly pretty-printed) '.json' arrays,
+are still read.
+
+zstd compression requires the optional 'zstandard' dependency.
+"""
+
+import gzip
+import io
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import boto3
+
+from . import SHEIVA_SCRAPE_BUCKET, streaming
+
+DEFAULT_CODEC = "jsonl-gzip"
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+_JSON_SEPARATORS = (",", ":")
+
+
+class Compression:
+    """
+    No compression, the base for the compressions below.
+    """
+
+    name = "identity"
+    extension = ""
+    content_encoding: Optional[str] = None
+
+    def compress(self, data: bytes) -> bytes:
+        """
+        Args:
+            data (bytes): data to compress
+        Returns:
+            bytes: compressed data
+        """
+
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        """
+        Args:
+            data (bytes): compressed data
+        Returns:
+            bytes: decompressed data
+        """
+
+        return data
+
+    def open(self, stream: Any) -> Any:
+        """
+        Args:
+            stream (Any): readable binary stream of compressed data
+        Returns:
+            Any: readable binary stream of the decompressed data
+        """
+
+        return stream
+
+    def open_writer(self, stream: Any) -> Any:
+        """
+        Args:
+            stream (Any): writable binary stream for compressed data
+        Returns:
+            Any: writable binary stream that compresses into 'stream'.
+                Closing it finishes the compressed data, 'stream'
+                itself is left open.
+        """
+
+        return _Unclosed(stream)
+
+
+class GzipCompression(Compression):
+    """
+    gzip compression, readable without extra dependencies.
+    """
+
+    name = "gzip"
+    extension = ".gz"
+    content_encoding = "gzip"
+
+    def compress(self, data: bytes) -> bytes:
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+    def decompress(self, data: bytes) -> bytes:
+        return gzip.decompress(data)
+
+    def open(self, stream: Any) -> Any:
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+
+    def open_writer(self, stream: Any) -> Any:
+        return gzip.GzipFile(
+            fileobj=stream, mode="wb", compresslevel=GZIP_LEVEL, mtime=0
+        )
+
+
+class ZstdCompression(Compression):
+    """
+    zstd compression, faster and smaller than gzip.
+    """
+
+    name = "zstd"
+    extension = ".zst"
+    content_encoding = "zstd"
+
+    @staticmethod
+    def _zstandard() -> Any:
+        # pylint: disable=import-outside-toplevel
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError(
+                "zstd compression requires the 'zstandard' package"
+            ) from e
+        return zstandard
+
+    def compress(self, data: bytes) -> bytes:
+        return (
+            self._zstandard().ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+        )
+
+    def decompress(self, data: bytes) -> bytes:
+        # Frames written by 'open_writer' do not record their size
+        decompressor = self._zstandard().ZstdDecompressor().decompressobj()
+        return decompressor.decompress(data)
+
+    def open(self, stream: Any) -> Any:
+        return self._zstandard().ZstdDecompressor().stream_reader(stream)
+
+    def open_writer(self, stream: Any) -> Any:
+        return (
+            self._zstandard()
+            .ZstdCompressor(level=ZSTD_LEVEL)
+            .stream_writer(stream, closefd=False)
+        )
+
+
+class Codec:
+    """
+    Encodes a list of items as a compact JSON array.
+    """
+
+    layout = "json"
+    extension = ".json"
+    content_type = "application/json"
+    # Written before and after the items by 'ItemWriter'
+    prefix = b"["
+    suffix = b"]"
+
+    def __init__(self, compression: Compression):
+        """
+        Args:
+            compression (Compression): compression of the encoded data
+        """
+
+        self.compression = compression
+
+    @property
+    def name(self) -> str:
+        """
+        Returns:
+            str: name of the codec e.g. 'json-gzip'
+        """
+
+        if self.compression.content_encoding is None:
+            return self.layout
+        return f"{self.layout}-{self.compression.name}"
+
+    @property
+    def key_extension(self) -> str:
+        """
+        Returns:
+            str: extension of keys written with the codec
+        """
+
+        return self.extension + self.compression.extension
+
+    def put_object_args(self) -> Dict[str, str]:
+        """
+        Returns:
+            Dict[str, str]: metadata arguments for 'put_object'
+        """
+
+        args = {"ContentType": self.content_type}
+        if self.compression.content_encoding is not None:
+            args["ContentEncoding"] = self.compression.content_encoding
+        return args
+
+    def serialise(self, items: Iterable[Any]) -> bytes:
+        """
+        Args:
+            items (Iterable[Any]): items to serialise
+        Returns:
+            bytes: uncompressed bytes
+        """
+
+        return json.dumps(list(items), separators=_JSON_SEPARATORS).encode(
+            "utf-8"
+        )
+
+    def serialise_item(self, item: Any, index: int) -> bytes:
+        """
+        Args:
+            item (Any): item to serialise
+            index (int): number of items written before it
+        Returns:
+            bytes: uncompressed bytes of the item, between 'prefix'
+                and 'suffix'
+        """
+
+        data = json.dumps(item, separators=_JSON_SEPARATORS).encode("utf-8")
+        return b"," + data if index else data
+
+    def encode(self, items: Iterable[Any]) -> bytes:
+        """
+        Args:
+            items (Iterable[Any]): items to encode
+        Returns:
+            bytes: encoded bytes
+        """
+
+        return self.compression.compress(self.serialise(items))
+
+    def iter_items(self, stream: Any) -> Iterator[Any]:
+        """
+        Decodes items one at a time from a stream.
+        Args:
+            stream (Any): readable binary stream e.g. an object body
+        Returns:
+            Iterator[Any]: the decoded items
+        """
+
+        return streaming.iter_json_array(self.compression.open(stream))
+
+    def decode(self, data: bytes) -> List[Any]:
+        """
+        Args:
+            data (bytes): encoded bytes
+        Returns:
+            List[Any]: the decoded items
+        """
+
+        return json.loads(self.compression.decompress(data))
+
+
+class JsonLinesCodec(Codec):
+    """
+    Encodes a list of items as JSON Lines, one item per line.
+    """
+
+    layout = "jsonl"
+    extension = ".jsonl"
+    content_type = "application/x-ndjson"
+    prefix = b""
+    suffix = b""
+
+    def serialise(self, items: Iterable[Any]) -> bytes:
+        return b"".join(
+            json.dumps(item, separators=_JSON_SEPARATORS).encode("utf-8")
+            + b"\n"
+            for item in items
+        )
+
+    def serialise_item(self, item: Any, index: int) -> bytes:
+        data = json.dumps(item, separators=_JSON_SEPARATORS).encode("utf-8")
+        return data + b"\n"
+
+    def iter_items(self, stream: Any) -> Iterator[Any]:
+        reader = io.BufferedReader(_Readable(self.compression.open(stream)))
+        for line in reader:
+            if line.strip():
+                yield json.loads(line)
+
+    def decode(self, data: bytes) -> List[Any]:
+        return [
+            json.loads(line)
+            for line in self.compression.decompress(data).splitlines()
+            if line.strip()
+        ]
+
+
+class _Readable(io.RawIOBase):
+    """
+    Adapts any stream with a 'read' method to 'io.RawIOBase' so it
+    can be line buffered.
+    """
+
+    def __init__(self, stream: Any):
+        super().__init__()
+        self.stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        data = self.stream.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+class _Unclosed:
+    """
+    Writes to a stream without ever closing it.
+    """
+
+    def __init__(self, stream: Any):
+        self.stream = stream
+
+    def write(self, data: bytes) -> int:
+        """
+        Args:
+            data (bytes): data to write
+        Returns:
+            int: number of bytes written
+        """
+
+        return self.stream.write(data)
+
+    def close(self) -> None:
+        """
+        Does nothing, the stream is closed by its owner.
+        """
+
+
+IDENTITY = Compression()
+COMPRESSIONS: Dict[str, Compression] = {
+    "gzip": GzipCompression(),
+    "zstd": ZstdCompression(),
+}
+CODECS = {
+    codec.name: codec
+    for layout in (Codec, JsonLinesCodec)
+    for codec in (
+        layout(IDENTITY),
+        layout(COMPRESSIONS["gzip"]),
+        layout(COMPRESSIONS["zstd"]),
+    )
+}
+
+
+def get_codec(name: str) -> Codec:
+    """
+    Args:
+        name (str): name of a codec, one of 'CODECS'
+    Returns:
+        Codec: the codec
+    """
+
+    if name not in CODECS:
+        raise ValueError(
+            f"Unsupported codec: '{name}', expected one of {list(CODECS)}"
+        )
+    return CODECS[name]
+
+
+def has_codec_extension(key: str) -> bool:
+    """
+    Args:
+        key (str): bucket key
+    Returns:
+        bool: True if the key ends with the extension of a codec
+    """
+
+    return key.endswith(
+        tuple(codec.key_extension for codec in CODECS.values())
+    )
+
+
+def detect_compression(
+    key: str, content_encoding: Optional[str] = None
+) -> Compression:
+    """
+    Detects the compression of an object from its key extension,
+    falling back to its 'ContentEncoding'.
+    Args:
+        key (str): bucket key
+        content_encoding (Optional[str]): 'ContentEncoding' of the object
+    Returns:
+        Compression: the compression
+    """
+
+    for compression in COMPRESSIONS.values():
+        if key.endswith(compression.extension):
+            return compression
+    if content_encoding is None:
+        return IDENTITY
+    return COMPRESSIONS.get(content_encoding, IDENTITY)
+
+
+def detect_codec(key: str, content_encoding: Optional[str] = None) -> Codec:
+    """
+    Detects the codec of an object from its key extension and
+    'ContentEncoding', see 'detect_compression'. Keys without a
+    '.jsonl' extension are read as JSON arrays.
+    Args:
+        key (str): bucket key
+        content_encoding (Optional[str]): 'ContentEncoding' of the object
+    Returns:
+        Codec: the codec
+    """
+
+    compression = detect_compression(key, content_encoding)
+    if compression.extension and key.endswith(compression.extension):
+        key = key[: -len(compression.extension)]
+    layout = "jsonl" if key.endswith(".jsonl") else "json"
+    if compression.content_encoding is None:
+        return CODECS[layout]
+    return CODECS[f"{layout}-{compression.name}"]
+
+
+def open_object(
+    s3_client: boto3.client, key: str, bucket: str = SHEIVA_SCRAPE_BUCKET
+) -> Any:
+    """
+    Opens an object for reading, detecting its compression. Useful
+    for objects that are not lists of JSON items e.g. csv files.
+    Args:
+        s3_client (boto3.client): s3 client
+        key (str): bucket key
+        bucket (str): name of the bucket
+    Returns:
+        Any: readable binary stream of the decompressed object
+    """
+
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    compression = detect_compression(key, response.get("ContentEncoding"))
+    return compression.open(response["Body"])
+
+
+def put_items(
+    s3_client: boto3.client,
+    key: str,
+    items: Iterable[Any],
+    codec: Codec,
+    bucket: str = SHEIVA_SCRAPE_BUCKET,
+) -> None:
+    """
+    Writes items to an object with a codec. The key should end with
+    the codec's 'key_extension'.
+    Args:
+        s3_client (boto3.client): s3 client
+        key (str): bucket key
+        items (Iterable[Any]): items to write
+        codec (Codec): codec to encode the items with
+        bucket (str): name of the bucket
+    """
+
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=codec.encode(items),
+        **codec.put_object_args(),
+    )
+
+
+class ItemWriter:
+    """
+    Streams items to an object with a codec, the incremental form of
+    'put_items'. The encoded data is uploaded through an
+    'S3UploadStream', so at most a part of it is held in memory
+    however many items are written. Nothing is written if the writer
+    is aborted.
+    """
+
+    def __init__(
+        self,
+        s3_client: boto3.client,
+        key: str,
+        codec: Codec,
+        bucket: str = SHEIVA_SCRAPE_BUCKET,
+    ):
+        """
+        Args:
+            s3_client (boto3.client): s3 client
+            key (str): bucket key, should end with the codec's
+                'key_extension'
+            codec (Codec): codec to encode the items with
+            bucket (str): name of the bucket
+        """
+
+        self.key = key
+        self.codec = codec
+        self.num_items = 0
+        # Uncompressed bytes written so far
+        self.bytes_written = 0
+        self._upload = streaming.S3UploadStream(
+            s3_client=s3_client,
+            bucket=bucket,
+            key=key,
+            extra_args=codec.put_object_args(),
+        )
+        self._writer = codec.compression.open_writer(self._upload)
+        self._writer.write(codec.prefix)
+
+    def __enter__(self) -> "ItemWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, item: Any) -> None:
+        """
+        Args:
+            item (Any): item to write
+        """
+
+        data = self.codec.serialise_item(item, self.num_items)
+        self._writer.write(data)
+        self.num_items += 1
+        self.bytes_written += len(data)
+
+    def close(self) -> None:
+        """
+        Finishes the encoded data and completes the upload.
+        """
+
+        self._writer.write(self.codec.suffix)
+        self._writer.close()
+        self._upload.close()
+
+    def abort(self) -> None:
+        """
+        Aborts the upload.
+        """
+
+        self._upload.abort()
+
+
+def iter_items(
+    s3_client: boto3.client, key: str, bucket: str = SHEIVA_SCRAPE_BUCKET
+) -> Iterator[Any]:
+    """
+    Streams the items of an object, detecting its codec.
+    Args:
+        s3_client (boto3.client): s3 client
+        key (str): bucket key
+        bucket (str): name of the bucket
+    Yields:
+        Any: the decoded items
+    """
+
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    codec = detect_codec(key, response.get("ContentEncoding"))
+    yield from codec.iter_items(response["Body"])
+
+
+def read_items(
+    s3_client: boto3.client, key: str, bucket: str = SHEIVA_SCRAPE_BUCKET
+) -> List[Any]:
+    """
+    Reads all the items of an object, detecting its codec.
+    Args:
+        s3_client (boto3.client): s3 client
+        key (str): bucket key
+        bucket (str): name of the bucket
+    Returns:
+        List[Any]: the decoded items
+    """
+
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    codec = detect_codec(key, response.get("ContentEncoding"))
+    return codec.decode(response["Body"].read())
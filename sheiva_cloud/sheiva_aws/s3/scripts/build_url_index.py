@@ -0,0 +1,85 @@
+"""
+Script to build the scraped url index from the scraped workouts, e.g.
+for the workouts scraped before the index existed or after changing
+its capacity. The urls are added to the shards of '--owner', which
+must not be a gender whose scraper trigger is running. For local use
+only.
+
+Usage:
+    python build_url_index.py [--owner bootstrap] [--max-workers 32]
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import boto3
+
+from sheiva_cloud.sheiva_aws import s3
+from sheiva_cloud.sheiva_aws.s3 import listing, object_codecs, url_index
+from sheiva_cloud.sheiva_aws.s3.validation import SCRAPED_WORKOUTS_DIR
+
+
+def get_urls(s3_client: boto3.client, key: str) -> List[str]:
+    """
+    Args:
+        s3_client (boto3.client): s3 client
+        key (str): key of a scraped file
+    Returns:
+        List[str]: urls of the file's workouts
+    """
+
+    return [
+        workout["url"]
+        for workout in object_codecs.iter_items(
+            s3_client=s3_client, key=key, bucket=s3.SHEIVA_SCRAPE_BUCKET
+        )
+        if workout.get("url")
+    ]
+
+
+def main(s3_client: boto3.client, owner: str, max_workers: int = 32):
+    """
+    Adds the url of every scraped workout to the index.
+    Args:
+        s3_client (boto3.client): s3 client
+        owner (str): owner of the shards to write
+        max_workers (int): number of files read concurrently
+    """
+
+    index = url_index.ScrapedUrlIndex(
+        s3_client=s3_client, max_workers=max_workers
+    )
+    keys = [
+        key
+        for key in listing.list_keys(
+            s3_client=s3_client,
+            prefix=f"{SCRAPED_WORKOUTS_DIR}/",
+            fan_out_depth=2,
+        )
+        if object_codecs.has_codec_extension(key)
+    ]
+    print(f"Indexing the workouts of {len(keys)} scraped files")
+    num_urls = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for urls in executor.map(lambda key: get_urls(s3_client, key), keys):
+            index.add(urls)
+            num_urls += len(urls)
+    index.save(owner=owner)
+    print(f"Indexed {num_urls} urls in layout {index.layout}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the scraped url index from scraped workouts."
+    )
+    parser.add_argument("--owner", default="bootstrap")
+    parser.add_argument("--max-workers", type=int, default=32)
+    args = parser.parse_args()
+
+    boto3_session = boto3.Session()
+    main(
+        s3_client=boto3_session.client("s3"),
+        owner=args.owner,
+        max_workers=args.max_workers,
+    )
@@ -0,0 +1,70 @@
+"""
+Script to migrate the '<age_group>.json' workout link files of a
+gender into the chunked workout link store used by the scraper
+trigger. For local use only.
+
+Usage:
+    python migrate_workout_links.py --gender male [--delete]
+"""
+
+import argparse
+
+import boto3
+
+from sheiva_cloud.sheiva_aws import s3
+from sheiva_cloud.sheiva_aws.s3 import link_store, listing, object_codecs
+
+
+def main(s3_client: boto3.client, gender: str, delete: bool = False):
+    """
+    Migrates every '<age_group>.json' workout link file of a gender.
+    Args:
+        s3_client (boto3.client): s3 client
+        gender (str): gender of the workout links
+        delete (bool): delete each link file once it is migrated
+    """
+
+    workout_link_store = link_store.LinkStore(
+        s3_client=s3_client, gender=gender
+    )
+    # Only the files directly under the gender dir, not the store itself
+    _, link_files = listing.list_sub_prefixes(
+        s3_client=s3_client, prefix=f"{workout_link_store.gender_dir}/"
+    )
+    for key in link_files:
+        if not object_codecs.has_codec_extension(key):
+            continue
+        age_group = key.split("/")[-1].split(".")[0]
+        print(f"Migrating {key} to age group: {age_group}")
+        links = object_codecs.read_items(
+            s3_client=s3_client, key=key, bucket=s3.SHEIVA_SCRAPE_BUCKET
+        )
+        cursor = workout_link_store.write_links(
+            age_group=age_group, links=links
+        )
+        print(
+            f"Wrote {cursor['total_links']} links in "
+            f"{cursor['num_chunks']} chunks for {age_group}"
+        )
+        if delete:
+            s3_client.delete_object(Bucket=s3.SHEIVA_SCRAPE_BUCKET, Key=key)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Migrate workout link files into the link store."
+    )
+    parser.add_argument("--gender", default="male")
+    parser.add_argument(
+        "--delete",
+        action="store_true",
+        help="Delete each '<age_group>.json' file once migrated",
+    )
+    args = parser.parse_args()
+
+    boto3_session = boto3.Session()
+    main(
+        s3_client=boto3_session.client("s3"),
+        gender=args.gender,
+        delete=args.delete,
+    )
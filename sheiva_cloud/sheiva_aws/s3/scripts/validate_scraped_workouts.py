@@ -1,108 +1,49 @@
 """
-A script used primarily for testing. It will poll the amount of scraped
-workouts in each age group and also test for uniqueness of the workouts
-via the link.
+Script to validate the scraped workouts of a gender. Checks the
+structure of every workout and the uniqueness of the workouts via
+their link, then writes a JSON report with counts per age group.
+For local use only.
+
+Usage:
+    python validate_scraped_workouts.py --gender male \
+        [--max-workers 32] [--report report.json]
 """
 
+import argparse
 import json
 import sys
-from collections import defaultdict
 
 import boto3
 
-from sheiva_cloud.sheiva_aws import s3
+from sheiva_cloud.sheiva_aws.s3 import validation
 
-scraped_workouts_dir = "highrise/workout-data/male"
-
-boto3_session = boto3.Session()
-
-s3_client = boto3_session.client("s3")
-
-paginator = s3_client.get_paginator("list_objects_v2")
-page_iterator = paginator.paginate(Bucket=s3.SHEIVA_SCRAPE_BUCKET)
-files = [
-    f["Key"]
-    for f in page_iterator.search(
-        "Contents[?starts_with(Key, "
-        f"'{scraped_workouts_dir}') && "
-        "ends_with(Key, '.json')]"
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Validate scraped workouts and report duplicates."
     )
-]
-
-# Gathering all workouts
-workouts_by_age_group = defaultdict(list)
-for file in files:
-    age_group = file.split("/")[1]
-    bucket = s3_client.get_object(Bucket=s3.SHEIVA_SCRAPE_BUCKET, Key=file)
-    print(f"Retrieved {file} from s3 bucket: {s3.SHEIVA_SCRAPE_BUCKET}")
-    workouts = json.loads(bucket["Body"].read())
-    workouts_by_age_group[age_group].extend(workouts)
+    parser.add_argument("--gender", default="male")
+    parser.add_argument("--max-workers", type=int, default=32)
+    parser.add_argument(
+        "--report", help="Path of the JSON report, defaults to stdout"
+    )
+    args = parser.parse_args()
 
-# Soft validate workouts
-all_workouts = [
-    workout
-    for workouts in workouts_by_age_group.values()
-    for workout in workouts
-]
+    boto3_session = boto3.Session()
+    report = validation.validate(
+        s3_client=boto3_session.client("s3"),
+        prefix=f"{validation.SCRAPED_WORKOUTS_DIR}/{args.gender}",
+        max_workers=args.max_workers,
+    )
 
-# pylint: disable=unreachable,no-else-continue,line-too-long
-for workout in all_workouts:
-    if len(workout["workout_components"]) == 0:
-        continue
-        print(f"Workout {workout['url']} has no workout components")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
     else:
-        for workout_component in workout["workout_components"]:
-            if len(workout_component["sets"]) == 0:
-                continue
-                print(
-                    f"Workout {workout['url']} has workout component {workout_component['name']} with no sets"
-                )
-            else:
-                for set_ in workout_component["sets"]:
-                    if len(set_["set_components"]) == 0:
-                        continue
-                        print(
-                            f"Workout {workout['url']} has set {set_['name']} with no exercises"
-                        )
-                    else:
-                        for set_component in set_["set_components"]:
-                            if (
-                                "exercise_name" not in set_component
-                                or not set_component["exercise_name"]
-                            ):
-                                print(
-                                    f"Workout {workout['url']} has set {set_['name']} with invalid exercise name"
-                                )
-
-
-urls = [workout["url"] for workout in all_workouts]
-if len(urls) == len(set(urls)):
-    print(f"No duplicates found in the {len(urls)} workouts")
-    print("Exiting...")
-    sys.exit(0)
-
-
-# Removing duplicates
-for age_group, workouts in workouts_by_age_group.items():
-    unique_links = []
-    unique_workouts = []
-    for workout in workouts:
-        workout_link = workout["url"]
-        if workout_link not in unique_links:
-            unique_links.append(workout_link)
-            unique_workouts.append(workout)
-        else:
-            print(f"Duplicate workout link found: {workout_link}")
-
-    workouts_by_age_group[age_group] = unique_workouts
-
-# Making sure there are no duplicates across all age groups
-urls = [
-    workout["url"]
-    for workouts in workouts_by_age_group.values()
-    for workout in workouts
-]
-assert len(urls) == len(set(urls))
-
-# Saving them back to s3
-# As of writing this there were no duplicates
+        json.dump(report, sys.stdout, indent=4)
+        print()
+    print(
+        f"Validated {report['workouts']} workouts in {report['files']} "
+        f"files: {report['duplicates']} duplicates, issues: "
+        f"{report['issues']}, {len(report['failed_files'])} failed files",
+        file=sys.stderr,
+    )
@@ -3,135 +3,139 @@
 
 """
 Script to bucket the full male workout link csv into
-age buckets for the Kuda workout scraper. For local
-use only.
+age buckets for the Kuda workout scraper. The csv is
+streamed in chunks and bucketed with vectorised pandas
+operations. Progress is read from the cursors of the
+link store. For local use only.
 """
 
-import json
-from typing import Dict
+import csv
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator
 
 import boto3
 import pandas as pd
 
 from sheiva_cloud.sheiva_aws import s3
+from sheiva_cloud.sheiva_aws.s3 import link_store, listing, object_codecs
 
 GENDER = "male"
 
 workout_link_dir = f"highrise/user-data/user-workout-links/{GENDER}"
+CSV_CHUNK_SIZE = 1_000_000
+AGE_GROUPS = [f"age_{x - 4}_{x}" for x in range(5, 101, 5)]
+UNKNOWN_AGE_GROUP = "age_unknown"
 
-# As of 13/09/2023 Male workout link counts
-original_bucket_numbers = {
-    "age_16_20": 235803,
-    "age_21_25": 1215559,
-    "age_26_30": 2193858,
-    "age_31_35": 2197241,
-    "age_36_40": 2208600,
-    "age_41_45": 1220973,
-    "age_46_50": 120,
-    "age_51_55": 112032,
-    "age_56_60": 153941,
-    "age_61_65": 44694,
-    "age_66_70": 14560,
-    "age_71_75": 2225,
-    "age_76_80": 150,
-    "age_81_85": 51,
-    "age_86_90": 322,
-    "age_91_95": 229,
-    "age_96_100": 1016,
-    "age_unknown": 361885,
-}
-
-
-def get_all_workout_links(s3_client: boto3.client) -> pd.DataFrame:
+
+def iter_workout_links(
+    s3_client: boto3.client, chunk_size: int = CSV_CHUNK_SIZE
+) -> Iterator[pd.DataFrame]:
     """
-    Retrieves all workout links from s3.
+    Streams the Age and Links columns of the pipe delimited workout
+    link csv from s3, 'chunk_size' rows at a time. The csv may be
+    compressed e.g. 'all_workout_links.csv.gz'.
     """
 
-    res = s3_client.get_object(
-        Bucket=s3.SHEIVA_SCRAPE_BUCKET,
-        Key=f"{workout_link_dir}/all_workout_links.csv",
+    key = next(
+        listing.list_keys(
+            s3_client=s3_client,
+            prefix=f"{workout_link_dir}/all_workout_links.csv",
+        )
     )
-    print(
-        "Retrieved all workout links from s3 bucket: "
-        f"{workout_link_dir}/all_workout_links.csv"
+    print(f"Streaming all workout links from s3 bucket: {key}")
+    yield from pd.read_csv(
+        object_codecs.open_object(
+            s3_client=s3_client, key=key, bucket=s3.SHEIVA_SCRAPE_BUCKET
+        ),
+        sep="|",
+        usecols=["Age", "Links"],
+        dtype={"Age": str, "Links": str},
+        keep_default_na=False,
+        quoting=csv.QUOTE_NONE,
+        chunksize=chunk_size,
     )
-    csv_data = res["Body"].read().decode("utf-8")
-    columns = csv_data.split("\n")[0].split("|")
-    data = csv_data.split("\n")[1:-1]
-    return pd.DataFrame(columns=columns, data=[d.split("|") for d in data])
+
+
+def get_age_groups(ages: pd.Series) -> pd.Series:
+    """
+    Assigns the age group of 5 years, inclusive of the bounds, of each
+    age in one vectorised pass. Ages that are not numbers e.g. '--'
+    are 'age_unknown', numbers outside 1 to 100 have no age group.
+    """
+
+    numeric_ages = pd.to_numeric(ages, errors="coerce")
+    age_groups = pd.cut(
+        numeric_ages, bins=range(0, 101, 5), labels=AGE_GROUPS
+    ).cat.add_categories([UNKNOWN_AGE_GROUP])
+    age_groups[numeric_ages.isna()] = UNKNOWN_AGE_GROUP
+    return age_groups
 
 
 def bucket_data(s3_client: boto3.client) -> Dict:
     """
-    Bucket the workout links into age groups of 5 years.
-    Note: between means inclusive of the bounds.
+    Bucket the workout links into age groups of 5 years in a single
+    pass over the csv. The links of each age group are streamed into
+    its link store chunks, uploaded concurrently, so only one csv
+    chunk and the chunks being uploaded are held in memory.
     """
 
-    bucket_numbers_dict = {}
-    pdf = get_all_workout_links(s3_client=s3_client)
-    pdf.Age = pdf.Age.apply(lambda x: int(x) if x not in ["--", ""] else -1)
-    for x in range(5, 101, 5):
-        group = f"age_{x - 4}_{x}"
-        print(f"Bucketing group: {group}")
-        links = list(pdf[pdf.Age.between(x - 4, x)].Links)
-        if links:
-            bucket_numbers_dict[f"{group}"] = len(links)
-            s3_client.put_object(
-                Bucket=s3.SHEIVA_SCRAPE_BUCKET,
-                Key=f"{workout_link_dir}/{group}.json",
-                Body=json.dumps(links, indent=4),
-            )
-    print("Bucketing group: age_unknown")
-    links = list(pdf[pdf.Age == -1].Links)
-    s3_client.put_object(
-        Bucket=s3.SHEIVA_SCRAPE_BUCKET,
-        Key=f"{workout_link_dir}/age_unknown.json",
-        Body=json.dumps(links, indent=4),
+    workout_link_store = link_store.LinkStore(
+        s3_client=s3_client, gender=GENDER
     )
-    bucket_numbers_dict["age_unknown"] = len(links)
-    return bucket_numbers_dict
-
-
-def get_all_workout_link_buckets(s3_client: boto3.client):
-    print("Getting workout link bucket dirs")
-    paginator = s3_client.get_paginator("list_objects_v2")
-    page_iterator = paginator.paginate(Bucket=s3.SHEIVA_SCRAPE_BUCKET)
-    return [
-        f["Key"]
-        for f in page_iterator.search(
-            "Contents[?starts_with(Key, 'highrise/user-data/user-workout-links"
-            f"/{GENDER}/') && ends_with(Key, '.json')]"
-        )
-    ]
+    with ThreadPoolExecutor(
+        max_workers=workout_link_store.max_workers
+    ) as executor:
+        writers = {
+            UNKNOWN_AGE_GROUP: workout_link_store.open_writer(
+                age_group=UNKNOWN_AGE_GROUP, executor=executor
+            )
+        }
+        for pdf in iter_workout_links(s3_client=s3_client):
+            for group, links in pdf.Links.groupby(
+                get_age_groups(pdf.Age), observed=True
+            ):
+                if group not in writers:
+                    print(f"Bucketing group: {group}")
+                    writers[group] = workout_link_store.open_writer(
+                        age_group=group, executor=executor
+                    )
+                writers[group].write(links)
+        return {
+            group: writer.close()["total_links"]
+            for group, writer in writers.items()
+        }
 
 
-if __name__ == "__main__":
-    boto3_session = boto3.Session()
-    s3_client = boto3_session.client("s3")
+def get_progress(s3_client: boto3.client) -> Dict:
+    """
+    Gets the processed and remaining links of each age group from the
+    cursors of the link store.
+    """
 
-    workout_link_keys = get_all_workout_link_buckets(s3_client=s3_client)
+    stats = link_store.LinkStore(
+        s3_client=s3_client, gender=GENDER
+    ).load_stats()
+    return {
+        age_group: {
+            "processed": age_group_stats["claimed"],
+            "left": age_group_stats["total_links"]
+            - age_group_stats["claimed"],
+            "total": age_group_stats["total_links"],
+        }
+        for age_group, age_group_stats in sorted(stats["age_groups"].items())
+    }
 
-    checked_buckets = {}
-    for key in workout_link_keys:
-        print("Checking bucket: ", key)
-        res = s3_client.get_object(Bucket=s3.SHEIVA_SCRAPE_BUCKET, Key=key)
-        obj = json.loads(res["Body"].read())
 
-        bucket = key.split("/")[-1].split(".")[0]
-        orginal_number = original_bucket_numbers[bucket]
-        checked_buckets[bucket] = {
-            "processed": orginal_number - len(obj),
-            "left": len(obj),
-            "bucket": bucket,
-        }
+if __name__ == "__main__":
+    boto3_session = boto3.Session()
+    s3_client = boto3_session.client("s3")
 
-    for bucket in original_bucket_numbers:
-        if bucket not in checked_buckets:
-            checked_buckets[bucket] = {
-                "processed": original_bucket_numbers[bucket],
-                "bucket": bucket,
-                "left": 0,
-            }
+    checked_buckets = get_progress(s3_client=s3_client)
+    for bucket, progress in checked_buckets.items():
+        print(
+            f"{bucket}: processed {progress['processed']} of "
+            f"{progress['total']}, left {progress['left']}"
+        )
 
     print(
         "Total processed: ",
@@ -0,0 +1,243 @@
+"""
+Module for streaming objects in and out of S3 with bounded memory.
+
+'iter_json_array' incrementally decodes the items of a JSON array
+from a readable stream such as a 'get_object' body. 'S3UploadStream'
+is a writable file object that uploads what is written to it as a
+multipart upload, or a single 'put_object' for small objects.
+"""
+
+import codecs
+import json
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+import boto3
+
+# Smallest part size S3 accepts for every part but the last
+MIN_PART_SIZE = 5 * 1024 * 1024
+READ_CHUNK_SIZE = 1024 * 1024
+
+_WHITESPACE = " \t\n\r"
+_NUMBER_CHARS = "0123456789+-.eE"
+
+
+# pylint: disable=too-many-branches
+def iter_json_array(
+    stream: Any, chunk_size: int = READ_CHUNK_SIZE
+) -> Iterator[Any]:
+    """
+    Yields the items of a JSON array one at a time. Only the
+    undecoded remainder of the last read chunk is held in memory.
+    Args:
+        stream (Any): readable binary stream with a 'read' method
+        chunk_size (int): number of bytes read at a time
+    Yields:
+        Any: the decoded items of the array
+    Raises:
+        ValueError: if the stream is not a single JSON array, e.g. a
+            missing or repeated ',' between items or a missing ']'
+    """
+
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    # What comes next: "[", an item or "]" right after "[", an item
+    # after ",", "," or "]" after an item and nothing after "]"
+    expected = "["
+    eof = False
+    while not eof:
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer += text_decoder.decode(chunk or b"", final=eof)
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                pos += 1
+            if pos == len(buffer):
+                break
+            char = buffer[pos]
+            if expected == "[":
+                if char != "[":
+                    raise ValueError("Expected a JSON array")
+                expected = "item or ]"
+                pos += 1
+                continue
+            if expected == "end":
+                raise ValueError(f"Unexpected data after JSON array: {char}")
+            if char == "]" and expected != "item":
+                expected = "end"
+                pos += 1
+                continue
+            if expected == ", or ]":
+                if char != ",":
+                    raise ValueError(f"Expected ',' or ']', got {char}")
+                expected = "item"
+                pos += 1
+                continue
+            if char in ",]":
+                raise ValueError(f"Expected an item, got {char}")
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                break
+            # A number at the end of the buffer may be cut short, even
+            # before its '.' or exponent
+            if not eof and not buffer[end:].strip(_NUMBER_CHARS):
+                break
+            yield item
+            expected = ", or ]"
+            pos = end
+        buffer = buffer[pos:]
+    if expected != "end":
+        raise ValueError("Unexpected end of JSON array")
+
+
+# pylint: disable=too-many-instance-attributes
+class S3UploadStream:
+    """
+    Writable file object that streams to an S3 object. Data is
+    buffered until 'part_size' bytes are available and then sent as
+    a part of a multipart upload, which is only started once the
+    object outgrows a single part. Accepts both str and bytes.
+    """
+
+    def __init__(
+        self,
+        s3_client: boto3.client,
+        bucket: str,
+        key: str,
+        part_size: int = MIN_PART_SIZE,
+        extra_args: Optional[Dict] = None,
+    ):
+        """
+        Args:
+            s3_client (boto3.client): s3 client
+            bucket (str): name of the bucket
+            key (str): bucket key of the object
+            part_size (int): size of each uploaded part in bytes
+            extra_args (Optional[Dict]): extra arguments for the
+                upload e.g. 'ContentType'
+        """
+
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.extra_args = extra_args or {}
+        self.bytes_written = 0
+        self.closed = False
+        self._buffer = bytearray()
+        self._upload_id: Optional[str] = None
+        self._parts: List[Dict] = []
+
+    def __enter__(self) -> "S3UploadStream":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def writable(self) -> bool:
+        """
+        Returns:
+            bool: always True
+        """
+
+        return True
+
+    def write(self, data: Union[str, bytes]) -> int:
+        """
+        Writes data to the object.
+        Args:
+            data (Union[str, bytes]): data to write, str is utf-8 encoded
+        Returns:
+            int: number of characters or bytes written
+        """
+
+        if self.closed:
+            raise ValueError(f"Upload to '{self.key}' is closed")
+        encoded = data.encode("utf-8") if isinstance(data, str) else data
+        self._buffer.extend(encoded)
+        self.bytes_written += len(encoded)
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[: self.part_size]))
+            del self._buffer[: self.part_size]
+        return len(data)
+
+    def tell(self) -> int:
+        """
+        Returns:
+            int: number of bytes written so far
+        """
+
+        return self.bytes_written
+
+    def flush(self) -> None:
+        """
+        No-op, parts are only uploaded once they are full.
+        """
+
+    def _upload_part(self, body: bytes) -> None:
+        if self._upload_id is None:
+            self._upload_id = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, **self.extra_args
+            )["UploadId"]
+        part_number = len(self._parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=body,
+        )
+        self._parts.append(
+            {"ETag": response["ETag"], "PartNumber": part_number}
+        )
+
+    def close(self) -> None:
+        """
+        Uploads the remaining data and completes the upload.
+        """
+
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self._upload_id is None:
+                self.s3_client.put_object(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    Body=bytes(self._buffer),
+                    **self.extra_args,
+                )
+                return
+            if self._buffer:
+                self._upload_part(bytes(self._buffer))
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self._upload_id,
+                MultipartUpload={"Parts": self._parts},
+            )
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self._buffer = bytearray()
+
+    def abort(self) -> None:
+        """
+        Aborts the upload, nothing is written to the object.
+        """
+
+        self.closed = True
+        self._buffer = bytearray()
+        if self._upload_id is not None:
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self._upload_id
+            )
+            self._upload_id = None
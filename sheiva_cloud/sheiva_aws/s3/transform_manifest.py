@@ -0,0 +1,263 @@
+"""
+Module for tracking which scraped workout files have been transformed.
+
+Rather than listing the whole scrape bucket twice on every trigger,
+the state is kept in a gzipped JSON manifest. The scraper and the
+transformer each append a zero byte journal entry when they write a
+scraped file or finish transforming one. Journal keys start with a
+zero padded nanosecond timestamp so they list in write order.
+
+Only the transformer trigger writes the manifest. Once a manifest
+holding them is saved, 'prune_journal' deletes the journal entries
+older than the settle margin, so the journal only holds the entries
+of the last few runs and is listed in full by every 'sync'. Entries
+must not be expired by a lifecycle rule instead: an entry that is
+deleted before it is folded in silently drops its file from
+'candidates'.
+"""
+
+import gzip
+import json
+import time
+from typing import Dict, Iterable, List, Optional, Set
+from uuid import uuid4
+
+import boto3
+
+from . import SHEIVA_SCRAPE_BUCKET, listing
+
+INDEX_DIR = "highrise/index"
+MANIFEST_KEY = f"{INDEX_DIR}/transform-manifest.json.gz"
+JOURNAL_DIR = f"{INDEX_DIR}/journal"
+SCRAPED_JOURNAL = "scraped"
+TRANSFORMED_JOURNAL = "transformed"
+MANIFEST_VERSION = 1
+
+# Only journal entries older than this are pruned, so a trigger run
+# that overlaps the one saving the manifest still lists them.
+JOURNAL_SETTLE_SECONDS = 15 * 60
+
+
+def get_file_name(key: str) -> str:
+    """
+    Gets the file name without extension of a bucket key. Transformed
+    files share the file name of their scraped source file.
+    Args:
+        key (str): bucket key
+    Returns:
+        str: file name
+    """
+
+    return key.split("/")[-1].split(".")[0]
+
+
+def _journal_prefix(journal: str) -> str:
+    return f"{JOURNAL_DIR}/{journal}/"
+
+
+def _journal_timestamp(seconds_ago: int = 0) -> str:
+    return f"{time.time_ns() - seconds_ago * 10**9:020d}"
+
+
+def record_journal_entry(
+    s3_client: boto3.client, journal: str, key: str
+) -> None:
+    """
+    Appends a zero byte journal entry for a bucket key.
+    Args:
+        s3_client (boto3.client): s3 client
+        journal (str): 'SCRAPED_JOURNAL' or 'TRANSFORMED_JOURNAL'
+        key (str): bucket key of the scraped file
+    """
+
+    s3_client.put_object(
+        Bucket=SHEIVA_SCRAPE_BUCKET,
+        Key=(
+            f"{_journal_prefix(journal)}{_journal_timestamp()}-"
+            f"{uuid4().hex[:8]}/{key}"
+        ),
+        Body=b"",
+    )
+
+
+def record_scraped_file(s3_client: boto3.client, key: str) -> None:
+    """
+    Records that a scraped file has been written.
+    Args:
+        s3_client (boto3.client): s3 client
+        key (str): bucket key of the scraped file
+    """
+
+    record_journal_entry(s3_client=s3_client, journal=SCRAPED_JOURNAL, key=key)
+
+
+def record_transformed_file(s3_client: boto3.client, key: str) -> None:
+    """
+    Records that a scraped file has been transformed.
+    Args:
+        s3_client (boto3.client): s3 client
+        key (str): bucket key of the scraped file
+    """
+
+    record_journal_entry(
+        s3_client=s3_client, journal=TRANSFORMED_JOURNAL, key=key
+    )
+
+
+class TransformManifest:
+    """
+    Set of scraped files and the subset of them that
+    have been transformed.
+    """
+
+    def __init__(
+        self,
+        scraped: Set[str],
+        transformed: Set[str],
+    ):
+        """
+        Args:
+            scraped (Set[str]): bucket keys of all scraped files
+            transformed (Set[str]): bucket keys of transformed
+                scraped files
+        """
+
+        self.scraped = scraped
+        self.transformed = transformed
+        # Settled journal entries folded in by 'sync', per journal
+        self.folded_entries: Dict[str, List[str]] = {}
+
+    @classmethod
+    def from_listings(
+        cls, scraped_files: Iterable[str], transformed_files: Iterable[str]
+    ) -> "TransformManifest":
+        """
+        Bootstraps a manifest from full listings of the bucket.
+        Args:
+            scraped_files (Iterable[str]): bucket keys of scraped files
+            transformed_files (Iterable[str]): bucket keys of one of the
+                transformed components, named after their source file
+        Returns:
+            TransformManifest: the manifest
+        """
+
+        transformed_file_names = {
+            get_file_name(key) for key in transformed_files
+        }
+        scraped = set(scraped_files)
+        return cls(
+            scraped=scraped,
+            transformed={
+                key
+                for key in scraped
+                if get_file_name(key) in transformed_file_names
+            },
+        )
+
+    @classmethod
+    def load(cls, s3_client: boto3.client) -> Optional["TransformManifest"]:
+        """
+        Loads the manifest from s3.
+        Args:
+            s3_client (boto3.client): s3 client
+        Returns:
+            Optional[TransformManifest]: the manifest or None if it
+                does not exist yet.
+        """
+
+        try:
+            response = s3_client.get_object(
+                Bucket=SHEIVA_SCRAPE_BUCKET, Key=MANIFEST_KEY
+            )
+        except s3_client.exceptions.NoSuchKey:
+            return None
+        manifest = json.loads(gzip.decompress(response["Body"].read()))
+        if manifest["version"] != MANIFEST_VERSION:
+            raise ValueError(
+                f"Unsupported manifest version: {manifest['version']}"
+            )
+        return cls(
+            scraped=set(manifest["scraped"]),
+            transformed=set(manifest["transformed"]),
+        )
+
+    def save(self, s3_client: boto3.client) -> None:
+        """
+        Saves the manifest to s3.
+        Args:
+            s3_client (boto3.client): s3 client
+        """
+
+        body = json.dumps(
+            {
+                "version": MANIFEST_VERSION,
+                "scraped": sorted(self.scraped),
+                "transformed": sorted(self.transformed),
+            },
+            separators=(",", ":"),
+        )
+        s3_client.put_object(
+            Bucket=SHEIVA_SCRAPE_BUCKET,
+            Key=MANIFEST_KEY,
+            Body=gzip.compress(body.encode("utf-8")),
+            ContentType="application/json",
+            ContentEncoding="gzip",
+        )
+
+    def sync(self, s3_client: boto3.client) -> None:
+        """
+        Folds every journal entry into the manifest. The journal is
+        listed in full, it only holds the entries not yet pruned.
+        Args:
+            s3_client (boto3.client): s3 client
+        """
+
+        for journal, keys in (
+            (SCRAPED_JOURNAL, self.scraped),
+            (TRANSFORMED_JOURNAL, self.transformed),
+        ):
+            prefix = _journal_prefix(journal)
+            settled = f"{prefix}{_journal_timestamp(JOURNAL_SETTLE_SECONDS)}"
+            folded = []
+            for entry_key in listing.list_keys(
+                s3_client=s3_client, prefix=prefix
+            ):
+                keys.add(entry_key[len(prefix) :].split("/", 1)[1])
+                if entry_key <= settled:
+                    folded.append(entry_key)
+            self.folded_entries[journal] = folded
+
+    def prune_journal(self, s3_client: boto3.client) -> int:
+        """
+        Deletes the settled journal entries folded in by the last
+        'sync'. Only call it once the manifest has been saved.
+        Args:
+            s3_client (boto3.client): s3 client
+        Returns:
+            int: number of entries deleted
+        """
+
+        entry_keys = [
+            key for keys in self.folded_entries.values() for key in keys
+        ]
+        for i in range(0, len(entry_keys), 1000):
+            s3_client.delete_objects(
+                Bucket=SHEIVA_SCRAPE_BUCKET,
+                Delete={
+                    "Objects": [
+                        {"Key": key} for key in entry_keys[i : i + 1000]
+                    ],
+                    "Quiet": True,
+                },
+            )
+        self.folded_entries = {}
+        return len(entry_keys)
+
+    def candidates(self) -> List[str]:
+        """
+        Gets the scraped files that have not been transformed.
+        Returns:
+            List[str]: bucket keys of files to be transformed
+        """
+
+        return sorted(self.scraped - self.transformed)
@@ -0,0 +1,549 @@
+"""
+Module for the index of workout urls that have already been scraped.
+
+The index is a Bloom filter split into 'num_shards' shard objects, so
+a url is never reported as unscraped once it has been added, while a
+small fraction ('false_positive_rate') of new urls are reported as
+scraped and skipped.
+
+Scrapers never rewrite the filter. Each invocation appends an
+immutable delta object with the digests of the urls it scraped.
+Compaction folds the deltas into the shards and deletes them. Shards
+are owned by whoever compacts them, e.g. one scraper trigger per
+gender, so concurrent compactions never overwrite each other's
+shards. Lookups OR the shards of every owner and check any deltas not
+yet compacted:
+
+    {URL_INDEX_DIR}/deltas/<timestamp>-<uuid>.bin
+    {URL_INDEX_DIR}/<layout>/<owner>/<shard>.bin
+    {URL_INDEX_DIR}/<layout>/<owner>/generation.json
+
+The layout directory encodes the filter parameters, changing them
+starts an empty index which can be rebuilt with
+'scripts/build_url_index.py'.
+
+Every save of an owner's shards is a new generation, recorded with
+the keys of the deltas it folded in 'generation.json', and only the
+shards whose bits changed are written. Loaded shards and deltas are
+cached per process. A process that has already seen the deltas of the
+newer generations ORs their digests into its cached shards, so warm
+scrapers only download the shards again when they missed a delta.
+"""
+
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set, Tuple, TypedDict
+from uuid import uuid4
+
+import boto3
+
+from . import SHEIVA_SCRAPE_BUCKET
+
+URL_INDEX_DIR = "highrise/index/scraped-urls"
+DELTA_DIR = f"{URL_INDEX_DIR}/deltas"
+CAPACITY = int(os.getenv("URL_INDEX_CAPACITY", "15000000"))
+FALSE_POSITIVE_RATE = float(
+    os.getenv("URL_INDEX_FALSE_POSITIVE_RATE", "0.001")
+)
+NUM_SHARDS = 16
+DIGEST_SIZE = 16
+GENERATION_FILE_NAME = "generation.json"
+# Generations whose folded deltas are kept in 'generation.json'
+GENERATION_HISTORY = 64
+
+
+class Generation(TypedDict):
+    """
+    Structure of the 'generation.json' of an owner.
+    """
+
+    generation: int
+    # Keys of the deltas folded by each recent generation
+    folded: Dict[str, List[str]]
+
+
+# Process caches: the digests of each delta by key, the generation of
+# each owner by ETag, and the generation and loaded shards of each
+# owner directory.
+_deltas: Dict[str, Set[bytes]] = {}
+_generations: Dict[str, Tuple[str, Generation]] = {}
+_shards: Dict[str, Tuple[int, Dict[int, bytearray]]] = {}
+_cache_lock = threading.Lock()
+
+
+def url_digest(url: str) -> bytes:
+    """
+    Args:
+        url (str): workout url
+    Returns:
+        bytes: 16 byte digest of the url
+    """
+
+    return hashlib.blake2b(
+        url.strip().encode("utf-8"), digest_size=DIGEST_SIZE
+    ).digest()
+
+
+def _set_bits(shard: bytearray, positions: List[int]) -> None:
+    for p in positions:
+        shard[p >> 3] |= 1 << (p & 7)
+
+
+# pylint: disable=too-many-instance-attributes
+class ScrapedUrlIndex:
+    """
+    Sharded Bloom filter of the scraped workout urls.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        s3_client: boto3.client,
+        capacity: int = CAPACITY,
+        false_positive_rate: float = FALSE_POSITIVE_RATE,
+        num_shards: int = NUM_SHARDS,
+        max_workers: int = 16,
+    ):
+        """
+        Args:
+            s3_client (boto3.client): s3 client
+            capacity (int): number of urls the filter is sized for
+            false_positive_rate (float): rate of unscraped urls
+                reported as scraped at capacity
+            num_shards (int): number of shard objects
+            max_workers (int): number of concurrent s3 requests
+        """
+
+        self.s3_client = s3_client
+        self.num_shards = num_shards
+        self.max_workers = max_workers
+        num_bits = -capacity * math.log(false_positive_rate) / math.log(2) ** 2
+        # Rounded up to whole bytes per shard
+        self.shard_bytes = math.ceil(num_bits / num_shards / 8)
+        self.shard_bits = self.shard_bytes * 8
+        self.num_hashes = max(1, round(math.log(2) * num_bits / capacity))
+        self.layout = f"v1-{num_shards}x{self.shard_bits}-k{self.num_hashes}"
+        self.layout_dir = f"{URL_INDEX_DIR}/{self.layout}"
+        # Shards being built by 'add', by shard index
+        self._pending: Dict[int, bytearray] = {}
+
+    def positions(self, digest: bytes) -> Tuple[int, List[int]]:
+        """
+        Args:
+            digest (bytes): digest of a url, see 'url_digest'
+        Returns:
+            Tuple[int, List[int]]: shard index and bit positions
+        """
+
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        shard = h1 % self.num_shards
+        h1 //= self.num_shards
+        return shard, [
+            (h1 + i * h2) % self.shard_bits for i in range(self.num_hashes)
+        ]
+
+    def shard_key(self, owner: str, shard: int) -> str:
+        """
+        Args:
+            owner (str): owner of the shard e.g. 'male'
+            shard (int): index of the shard
+        Returns:
+            str: bucket key of the shard
+        """
+
+        return f"{self.layout_dir}/{owner}/{shard:04d}.bin"
+
+    def _list(self, prefix: str) -> Dict[str, str]:
+        """
+        Lists keys under a prefix with their ETags.
+        """
+
+        objects = {}
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(
+            Bucket=SHEIVA_SCRAPE_BUCKET, Prefix=prefix
+        ):
+            for obj in page.get("Contents", []):
+                objects[obj["Key"]] = obj.get("ETag", "")
+        return objects
+
+    def generation_key(self, owner: str) -> str:
+        """
+        Args:
+            owner (str): owner of the shards e.g. 'male'
+        Returns:
+            str: bucket key of the owner's generation
+        """
+
+        return f"{self.layout_dir}/{owner}/{GENERATION_FILE_NAME}"
+
+    def _get(self, key: str) -> bytes:
+        response = self.s3_client.get_object(
+            Bucket=SHEIVA_SCRAPE_BUCKET, Key=key
+        )
+        return response["Body"].read()
+
+    def _load_generation(self, owner: str, etag: str) -> Generation:
+        """
+        Gets the generation of an owner, from the process cache or s3
+        if its ETag changed. Shards saved before generations were
+        recorded are generation 0.
+        """
+
+        if not etag:
+            return Generation(generation=0, folded={})
+        key = self.generation_key(owner)
+        with _cache_lock:
+            cached = _generations.get(key)
+        if cached is not None and cached[0] == etag:
+            return cached[1]
+        generation: Generation = json.loads(self._get(key))
+        with _cache_lock:
+            _generations[key] = (etag, generation)
+        return generation
+
+    def _apply_deltas(
+        self,
+        shards: Dict[int, bytearray],
+        folded: List[Optional[List[str]]],
+    ) -> None:
+        """
+        Sets the bits of the digests of loaded deltas in cached shards.
+        Args:
+            shards (Dict[int, bytearray]): cached shards by index
+            folded (List[Optional[List[str]]]): keys of the deltas
+                folded by each generation
+        """
+
+        for keys in folded:
+            for key in keys or []:
+                for digest in _deltas[key]:
+                    shard, bits = self.positions(digest)
+                    if shard in shards:
+                        _set_bits(shards[shard], bits)
+
+    def _sync_owner(
+        self, owner: str, etag: str
+    ) -> Tuple[int, Dict[int, bytearray]]:
+        """
+        Brings the cached shards of an owner up to its generation by
+        ORing in the digests of the deltas folded since. Drops them
+        if one of those deltas was never loaded by this process.
+        Returns:
+            Tuple[int, Dict[int, bytearray]]: generation of the owner
+                and its cached shards by index
+        """
+
+        generation = self._load_generation(owner=owner, etag=etag)
+        number = generation["generation"]
+        owner_dir = f"{self.layout_dir}/{owner}"
+        with _cache_lock:
+            cached_number, shards = _shards.get(owner_dir, (number, {}))
+            if cached_number < number:
+                folded = [
+                    generation["folded"].get(str(n))
+                    for n in range(cached_number + 1, number + 1)
+                ]
+                if shards and all(
+                    keys is not None and all(key in _deltas for key in keys)
+                    for keys in folded
+                ):
+                    self._apply_deltas(shards, folded)
+                else:
+                    shards = {}
+            elif cached_number > number:
+                # The owner's shards were deleted and rebuilt
+                shards = {}
+            _shards[owner_dir] = (number, shards)
+        return number, shards
+
+    def _list_owners(
+        self,
+    ) -> Tuple[Dict[str, Dict[int, str]], Dict[str, str]]:
+        """
+        Lists the shards and generations of every owner.
+        Returns:
+            Tuple[Dict[str, Dict[int, str]], Dict[str, str]]: keys of
+                each owner's shards by index and the etag of each
+                owner's generation
+        """
+
+        shard_keys: Dict[str, Dict[int, str]] = {}
+        generation_etags: Dict[str, str] = {}
+        for key, etag in self._list(f"{self.layout_dir}/").items():
+            owner, file_name = key[len(self.layout_dir) + 1 :].split("/", 1)
+            if file_name == GENERATION_FILE_NAME:
+                generation_etags[owner] = etag
+            else:
+                shard_keys.setdefault(owner, {})[
+                    int(file_name.split(".")[0])
+                ] = key
+        return shard_keys, generation_etags
+
+    def _load_shards(self, shards: Set[int]) -> Dict[int, List[bytearray]]:
+        """
+        Loads the shards of every owner.
+        Args:
+            shards (Set[int]): indexes of the shards to load
+        Returns:
+            Dict[int, List[bytearray]]: shards of each owner by index
+        """
+
+        shard_keys, generation_etags = self._list_owners()
+        loaded: Dict[int, List[bytearray]] = {shard: [] for shard in shards}
+        missing: List[Tuple[str, int, int, str]] = []
+        for owner, keys in shard_keys.items():
+            number, owner_shards = self._sync_owner(
+                owner=owner, etag=generation_etags.get(owner, "")
+            )
+            for shard in shards & set(keys):
+                if shard in owner_shards:
+                    loaded[shard].append(owner_shards[shard])
+                else:
+                    missing.append((owner, number, shard, keys[shard]))
+        if not missing:
+            return loaded
+
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_workers, len(missing))
+        ) as executor:
+            values = executor.map(
+                lambda item: bytearray(self._get(item[3])), missing
+            )
+            for (owner, number, shard, _), value in zip(missing, values):
+                loaded[shard].append(value)
+                with _cache_lock:
+                    cached = _shards.get(f"{self.layout_dir}/{owner}")
+                    # A shard is at least as new as the generation read
+                    # before it, later generations only add bits
+                    if cached is not None and cached[0] == number:
+                        cached[1][shard] = value
+        return loaded
+
+    def _load_deltas(self) -> Tuple[List[str], Set[bytes]]:
+        """
+        Loads the deltas that have not been compacted. The digests of
+        compacted deltas stay cached until the next call, for the
+        generations that folded them.
+        Returns:
+            Tuple[List[str], Set[bytes]]: keys of the deltas and the
+                digests in them.
+        """
+
+        def load(key: str) -> Set[bytes]:
+            body = self._get(key)
+            return {
+                body[i : i + DIGEST_SIZE]
+                for i in range(0, len(body), DIGEST_SIZE)
+            }
+
+        keys = list(self._list(f"{DELTA_DIR}/"))
+        with _cache_lock:
+            new_keys = [key for key in keys if key not in _deltas]
+        if new_keys:
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_workers, len(new_keys))
+            ) as executor:
+                for key, delta in zip(new_keys, executor.map(load, new_keys)):
+                    with _cache_lock:
+                        _deltas[key] = delta
+        digests: Set[bytes] = set()
+        with _cache_lock:
+            for key in keys:
+                digests |= _deltas[key]
+        return keys, digests
+
+    @staticmethod
+    def _is_set(shard: bytearray, positions: List[int]) -> bool:
+        return all(shard[p >> 3] & (1 << (p & 7)) for p in positions)
+
+    @staticmethod
+    def _forget_deltas(keep: Iterable[str]) -> None:
+        """
+        Drops the cached digests of the deltas not in 'keep'.
+        """
+
+        with _cache_lock:
+            for key in set(_deltas).difference(keep):
+                del _deltas[key]
+
+    def contains(self, urls: Iterable[str]) -> List[bool]:
+        """
+        Checks which urls have been scraped.
+        Args:
+            urls (Iterable[str]): workout urls
+        Returns:
+            List[bool]: True for each url that has been scraped, or
+                is a false positive.
+        """
+
+        digests = [url_digest(url) for url in urls]
+        positions = [self.positions(digest) for digest in digests]
+        # Deltas first, a delta compacted after they are listed is in
+        # the generation read by '_load_shards'
+        delta_keys, delta_digests = self._load_deltas()
+        shards = self._load_shards({shard for shard, _ in positions})
+        self._forget_deltas(keep=delta_keys)
+        return [
+            digest in delta_digests
+            or any(
+                self._is_set(owner_shard, bits)
+                for owner_shard in shards[shard]
+            )
+            for digest, (shard, bits) in zip(digests, positions)
+        ]
+
+    def filter_unscraped(self, urls: List[str]) -> List[str]:
+        """
+        Gets the urls that have not been scraped, dropping repeats.
+        Args:
+            urls (List[str]): workout urls
+        Returns:
+            List[str]: the unscraped urls in their original order
+        """
+
+        seen = set()
+        unscraped = []
+        for url, scraped in zip(urls, self.contains(urls)):
+            if not scraped and url not in seen:
+                seen.add(url)
+                unscraped.append(url)
+        return unscraped
+
+    def record(self, urls: Iterable[str]) -> Optional[str]:
+        """
+        Records scraped urls as a delta object.
+        Args:
+            urls (Iterable[str]): scraped workout urls
+        Returns:
+            Optional[str]: key of the delta, None if there were no urls
+        """
+
+        body = b"".join(sorted({url_digest(url) for url in urls}))
+        if not body:
+            return None
+        key = f"{DELTA_DIR}/{time.time_ns():020d}-{uuid4()}.bin"
+        self.s3_client.put_object(
+            Bucket=SHEIVA_SCRAPE_BUCKET,
+            Key=key,
+            Body=body,
+            ContentType="application/octet-stream",
+        )
+        return key
+
+    def add(self, urls: Iterable[str]) -> None:
+        """
+        Adds urls to the shards being built in memory, see 'save'.
+        Args:
+            urls (Iterable[str]): workout urls
+        """
+
+        for url in urls:
+            self._add_digest(url_digest(url))
+
+    def _add_digest(self, digest: bytes) -> None:
+        shard, bits = self.positions(digest)
+        if shard not in self._pending:
+            self._pending[shard] = bytearray(self.shard_bytes)
+        _set_bits(self._pending[shard], bits)
+
+    def save(self, owner: str, folded: Iterable[str] = ()) -> int:
+        """
+        ORs the shards built by 'add' into the owner's shards, writing
+        only the shards whose bits changed, and records a new
+        generation. Only one process should write an owner's shards at
+        a time.
+        Args:
+            owner (str): owner of the shards e.g. 'male'
+            folded (Iterable[str]): keys of the deltas whose digests
+                were added, empty if the urls came from elsewhere.
+        Returns:
+            int: the new generation of the owner
+        """
+
+        def save_shard(shard: int) -> None:
+            key = self.shard_key(owner, shard)
+            pending = self._pending[shard]
+            try:
+                stored = self._get(key)
+                merged = (
+                    int.from_bytes(stored, "little")
+                    | int.from_bytes(pending, "little")
+                ).to_bytes(self.shard_bytes, "little")
+                if merged == stored:
+                    return
+            except self.s3_client.exceptions.NoSuchKey:
+                merged = bytes(pending)
+            self.s3_client.put_object(
+                Bucket=SHEIVA_SCRAPE_BUCKET,
+                Key=key,
+                Body=merged,
+                ContentType="application/octet-stream",
+            )
+
+        if self._pending:
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_workers, len(self._pending))
+            ) as executor:
+                list(executor.map(save_shard, list(self._pending)))
+        self._pending = {}
+
+        # Written after the shards, a process that reads it finds them
+        # at least as new
+        key = self.generation_key(owner)
+        try:
+            generation: Generation = json.loads(self._get(key))
+        except self.s3_client.exceptions.NoSuchKey:
+            generation = Generation(generation=0, folded={})
+        number = generation["generation"] + 1
+        generation = Generation(
+            generation=number,
+            folded={
+                n: keys
+                for n, keys in generation["folded"].items()
+                if int(n) > number - GENERATION_HISTORY
+            },
+        )
+        generation["folded"][str(number)] = sorted(folded)
+        self.s3_client.put_object(
+            Bucket=SHEIVA_SCRAPE_BUCKET,
+            Key=key,
+            Body=json.dumps(generation, separators=(",", ":")).encode(),
+            ContentType="application/json",
+        )
+        return number
+
+    def compact(self, owner: str) -> int:
+        """
+        Folds every delta into the owner's shards and deletes the
+        deltas once the generation that folded them is saved. A delta
+        folded by two owners is harmless.
+        Args:
+            owner (str): owner of the shards e.g. 'male'
+        Returns:
+            int: number of deltas compacted
+        """
+
+        delta_keys, digests = self._load_deltas()
+        if not delta_keys:
+            return 0
+        for digest in digests:
+            self._add_digest(digest)
+        self.save(owner=owner, folded=delta_keys)
+        for i in range(0, len(delta_keys), 1000):
+            self.s3_client.delete_objects(
+                Bucket=SHEIVA_SCRAPE_BUCKET,
+                Delete={
+                    "Objects": [
+                        {"Key": key} for key in delta_keys[i : i + 1000]
+                    ],
+                    "Quiet": True,
+                },
+            )
+        return len(delta_keys)
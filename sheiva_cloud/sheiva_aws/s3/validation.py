@@ -0,0 +1,328 @@
+"""
+Module for validating scraped workouts.
+
+Scraped files are fetched concurrently and streamed, one workout at a
+time, through structural checks of the workout tree (workout
+components, sets, set components and exercise names). Workouts are
+deduplicated on a hash of their url so only a few bytes per workout
+are held in memory. The result is a JSON serialisable report with
+counts per age group.
+"""
+
+import hashlib
+from collections import Counter
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, TypedDict
+
+import boto3
+
+from . import SHEIVA_SCRAPE_BUCKET, listing, object_codecs
+
+SCRAPED_WORKOUTS_DIR = "highrise/workout-data"
+NO_WORKOUT_COMPONENTS = "no_workout_components"
+NO_SETS = "no_sets"
+NO_SET_COMPONENTS = "no_set_components"
+INVALID_EXERCISE_NAME = "invalid_exercise_name"
+# Number of example issues and duplicates kept in the report
+MAX_SAMPLES = 100
+
+
+class WorkoutIssue(TypedDict):
+    """
+    Structure of a structural issue of a workout.
+    url: url of the workout
+    issue: type of the issue e.g. 'no_sets'
+    detail: where in the workout tree the issue is
+    """
+
+    url: str
+    issue: str
+    detail: str
+
+
+class AgeGroupReport(TypedDict):
+    """
+    Structure of the validation counts of an age group.
+    """
+
+    files: int
+    workouts: int
+    duplicates: int
+    issues: Dict[str, int]
+
+
+class ValidationReport(TypedDict):
+    """
+    Structure of a validation report.
+    prefix: prefix of the validated files
+    files: number of files validated
+    failed_files: files that could not be read and why
+    workouts: number of workouts
+    unique_workouts: number of distinct workout urls
+    duplicates: number of workouts whose url was already seen
+    cross_age_group_duplicates: duplicates first seen in another
+        age group
+    issues: number of issues by type
+    age_groups: counts by age group
+    issue_samples: the first 'MAX_SAMPLES' issues
+    duplicate_samples: the first 'MAX_SAMPLES' duplicate urls
+    """
+
+    prefix: str
+    files: int
+    failed_files: List[Dict[str, str]]
+    workouts: int
+    unique_workouts: int
+    duplicates: int
+    cross_age_group_duplicates: int
+    issues: Dict[str, int]
+    age_groups: Dict[str, AgeGroupReport]
+    issue_samples: List[WorkoutIssue]
+    duplicate_samples: List[str]
+
+
+def validate_workout(workout: Dict) -> Iterator[WorkoutIssue]:
+    """
+    Checks the structure of a scraped workout.
+    Args:
+        workout (Dict): scraped workout
+    Yields:
+        WorkoutIssue: the issues of the workout
+    """
+
+    url = workout.get("url", "")
+    workout_components = workout.get("workout_components") or []
+    if not workout_components:
+        yield WorkoutIssue(url=url, issue=NO_WORKOUT_COMPONENTS, detail="")
+    for workout_component in workout_components:
+        component_name = workout_component.get("name", "")
+        sets = workout_component.get("sets") or []
+        if not sets:
+            yield WorkoutIssue(url=url, issue=NO_SETS, detail=component_name)
+        for set_ in sets:
+            set_components = set_.get("set_components") or []
+            if not set_components:
+                yield WorkoutIssue(
+                    url=url,
+                    issue=NO_SET_COMPONENTS,
+                    detail=f"{component_name}/{set_.get('name', '')}",
+                )
+            for set_component in set_components:
+                if not set_component.get("exercise_name"):
+                    yield WorkoutIssue(
+                        url=url,
+                        issue=INVALID_EXERCISE_NAME,
+                        detail=f"{component_name}/{set_.get('name', '')}",
+                    )
+
+
+def url_hash(url: str) -> bytes:
+    """
+    Args:
+        url (str): workout url
+    Returns:
+        bytes: 8 byte hash of the url, collisions are negligible
+            below billions of urls.
+    """
+
+    return hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest()
+
+
+def get_age_group(key: str) -> str:
+    """
+    Args:
+        key (str): key of a scraped file
+            e.g. 'highrise/workout-data/male/age_16_20/<uuid>.json'
+    Returns:
+        str: age group of the file e.g. 'age_16_20'
+    """
+
+    return key.split("/")[-2]
+
+
+def scan_file(
+    s3_client: boto3.client, key: str
+) -> Tuple[List[str], List[WorkoutIssue]]:
+    """
+    Streams a scraped file through the structural checks.
+    Args:
+        s3_client (boto3.client): s3 client
+        key (str): key of the scraped file
+    Returns:
+        Tuple[List[str], List[WorkoutIssue]]: url of each workout, in
+            file order, and the issues found.
+    """
+
+    urls = []
+    issues: List[WorkoutIssue] = []
+    for workout in object_codecs.iter_items(
+        s3_client=s3_client, key=key, bucket=SHEIVA_SCRAPE_BUCKET
+    ):
+        urls.append(workout.get("url", ""))
+        issues.extend(validate_workout(workout))
+    return urls, issues
+
+
+class Validator:
+    """
+    Accumulates the results of scanned files into a report.
+    """
+
+    def __init__(self, prefix: str):
+        """
+        Args:
+            prefix (str): prefix of the validated files
+        """
+
+        self.report = ValidationReport(
+            prefix=prefix,
+            files=0,
+            failed_files=[],
+            workouts=0,
+            unique_workouts=0,
+            duplicates=0,
+            cross_age_group_duplicates=0,
+            issues={},
+            age_groups={},
+            issue_samples=[],
+            duplicate_samples=[],
+        )
+        self.issue_counts: Counter = Counter()
+        # Url hash to the index of the age group it was first seen in
+        self.seen: Dict[bytes, int] = {}
+        self.age_group_ids: Dict[str, int] = {}
+
+    def add_file(
+        self, key: str, urls: List[str], issues: List[WorkoutIssue]
+    ) -> None:
+        """
+        Adds the results of a scanned file to the report.
+        Args:
+            key (str): key of the scraped file
+            urls (List[str]): urls of the file's workouts
+            issues (List[WorkoutIssue]): issues of the file
+        """
+
+        age_group = get_age_group(key)
+        age_group_id = self.age_group_ids.setdefault(
+            age_group, len(self.age_group_ids)
+        )
+        age_group_report = self.report["age_groups"].setdefault(
+            age_group,
+            AgeGroupReport(files=0, workouts=0, duplicates=0, issues={}),
+        )
+        age_group_report["files"] += 1
+        age_group_report["workouts"] += len(urls)
+        self.report["files"] += 1
+        self.report["workouts"] += len(urls)
+
+        for url in urls:
+            hash_ = url_hash(url)
+            first_seen = self.seen.get(hash_)
+            if first_seen is None:
+                self.seen[hash_] = age_group_id
+                continue
+            self.report["duplicates"] += 1
+            age_group_report["duplicates"] += 1
+            if first_seen != age_group_id:
+                self.report["cross_age_group_duplicates"] += 1
+            if len(self.report["duplicate_samples"]) < MAX_SAMPLES:
+                self.report["duplicate_samples"].append(url)
+        for issue in issues:
+            self.issue_counts[issue["issue"]] += 1
+            age_group_report["issues"][issue["issue"]] = (
+                age_group_report["issues"].get(issue["issue"], 0) + 1
+            )
+            if len(self.report["issue_samples"]) < MAX_SAMPLES:
+                self.report["issue_samples"].append(issue)
+
+    def add_failure(self, key: str, error: Exception) -> None:
+        """
+        Records a file that could not be scanned.
+        Args:
+            key (str): key of the scraped file
+            error (Exception): the error
+        """
+
+        self.report["failed_files"].append({"key": key, "error": repr(error)})
+
+    def finish(self) -> ValidationReport:
+        """
+        Returns:
+            ValidationReport: the report
+        """
+
+        self.report["unique_workouts"] = len(self.seen)
+        self.report["issues"] = dict(self.issue_counts)
+        return self.report
+
+
+def list_scraped_files(s3_client: boto3.client, prefix: str) -> Iterator[str]:
+    """
+    Streams the keys of the scraped files under a prefix, fanning out
+    over its age group sub-prefixes.
+    Args:
+        s3_client (boto3.client): s3 client
+        prefix (str): prefix of a gender e.g. 'highrise/workout-data/male'
+    Yields:
+        str: keys of the scraped files
+    """
+
+    for key in listing.list_keys(
+        s3_client=s3_client, prefix=f"{prefix}/", fan_out_depth=1
+    ):
+        if object_codecs.has_codec_extension(key):
+            yield key
+
+
+def validate(
+    s3_client: boto3.client,
+    prefix: str,
+    keys: Optional[Iterable[str]] = None,
+    max_workers: int = 32,
+) -> ValidationReport:
+    """
+    Validates the scraped files under a prefix. Files are scanned
+    concurrently, at most '2 * max_workers' at a time so memory does
+    not grow with the number of files.
+    Args:
+        s3_client (boto3.client): s3 client
+        prefix (str): prefix of a gender e.g. 'highrise/workout-data/male'
+        keys (Iterable[str]): keys to validate, defaults to every
+            scraped file under the prefix.
+        max_workers (int): number of files scanned concurrently
+    Returns:
+        ValidationReport: the report
+    """
+
+    if keys is None:
+        keys = list_scraped_files(s3_client=s3_client, prefix=prefix)
+    validator = Validator(prefix=prefix)
+
+    def collect(done) -> None:
+        for future in done:
+            key = in_flight.pop(future)
+            try:
+                urls, issues = future.result()
+            # pylint: disable=broad-except
+            except Exception as e:
+                print(f"Error validating {key}: {repr(e)}")
+                validator.add_failure(key=key, error=e)
+                continue
+            validator.add_file(key=key, urls=urls, issues=issues)
+
+    in_flight: Dict[Future, str] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for key in keys:
+            if len(in_flight) >= 2 * max_workers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight[executor.submit(scan_file, s3_client, key)] = key
+        collect(list(in_flight))
+
+    return validator.finish()
@@ -1,11 +1,17 @@
-from . import message_parsers
-from . import utils
+from . import claim_check, message_parsers, utils
+from .claim_check import MAX_MESSAGE_BYTES, message_size
 from .classes import (
+    BatchItemFailuresResponse,
     FileTransformerMessage,
     ParsedSqsMessage,
     ReceivedSqsMessage,
+    RedriveStats,
+    ScrapeResponse,
     ScraperMessage,
+    SqsBatchFailure,
+    SqsBatchResult,
     SqsEvent,
+    SqsMessage,
     SqsResponse,
 )
 from .clients import StandardClient as StandardSqsClient
@@ -0,0 +1,135 @@
+"""
+Claim-check for SQS messages larger than 'MAX_MESSAGE_BYTES'.
+
+The body and attributes of an oversized message are put in S3 under
+'CLAIM_CHECK_PREFIX' and the message sent in its place carries only
+their S3 uri, as its body and its 'claim_check' attribute. Parsers
+call 'resolve' to get the original record back, so consumers do not
+know the difference.
+
+Payloads are not deleted when their message is processed, a redriven
+or retried message still needs them. The bucket should expire
+'CLAIM_CHECK_PREFIX' with a lifecycle rule longer than the retention
+period of the queues.
+"""
+
+import json
+import os
+from typing import Dict
+from uuid import uuid4
+
+import boto3
+
+from sheiva_cloud.sheiva_aws import s3
+
+from .classes import ReceivedSqsMessage, SqsMessage
+
+# Largest message SQS accepts, body and attributes included. A batch
+# request is limited to the same size in total.
+MAX_MESSAGE_BYTES = 256 * 1024
+CLAIM_CHECK_ATTRIBUTE = "claim_check"
+# Empty disables the claim-check
+CLAIM_CHECK_BUCKET = os.getenv("CLAIM_CHECK_BUCKET", s3.SHEIVA_SCRAPE_BUCKET)
+CLAIM_CHECK_PREFIX = "sqs-payloads"
+
+
+class ClaimCheckError(Exception):
+    """
+    Raised when the payload of a claim-checked message is missing.
+    """
+
+
+def message_size(message: SqsMessage) -> int:
+    """
+    Size of a message as SQS counts it towards 'MAX_MESSAGE_BYTES',
+    its body and the name, type and value of each attribute.
+    Args:
+        message (SqsMessage): message to send
+    Returns:
+        int: size in bytes
+    """
+
+    size = len(message["message_body"].encode("utf-8"))
+    for name, attribute in (message.get("message_attributes") or {}).items():
+        size += len(name.encode("utf-8"))
+        for key in ("DataType", "StringValue"):
+            size += len(attribute.get(key, "").encode("utf-8"))
+        size += len(attribute.get("BinaryValue", b""))
+    return size
+
+
+def offload(
+    message: SqsMessage,
+    s3_client: boto3.client,
+    bucket: str = CLAIM_CHECK_BUCKET,
+) -> SqsMessage:
+    """
+    Puts the body and attributes of a message in S3.
+    Args:
+        message (SqsMessage): message to offload, only string
+            attributes are supported
+        s3_client (boto3.client): s3 client
+        bucket (str): bucket the payload is put in
+    Returns:
+        SqsMessage: the message to send instead
+    """
+
+    key = f"{CLAIM_CHECK_PREFIX}/{uuid4().hex}.json"
+    payload = {
+        "body": message["message_body"],
+        "messageAttributes": {
+            name: {
+                "dataType": attribute["DataType"],
+                "stringValue": attribute["StringValue"],
+            }
+            for name, attribute in (
+                message.get("message_attributes") or {}
+            ).items()
+        },
+    }
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(payload, separators=(",", ":")).encode("utf-8"),
+    )
+    uri = f"s3://{bucket}/{key}"
+    return {
+        "message_body": uri,
+        "message_attributes": {
+            CLAIM_CHECK_ATTRIBUTE: {"DataType": "String", "StringValue": uri}
+        },
+    }
+
+
+def resolve(
+    message: ReceivedSqsMessage, s3_client: boto3.client
+) -> ReceivedSqsMessage:
+    """
+    Gets the original body and attributes of a claim-checked message.
+    Args:
+        message (ReceivedSqsMessage): message from the SQS queue
+        s3_client (boto3.client): s3 client
+    Returns:
+        ReceivedSqsMessage: the original message, or 'message' if it
+            was not claim-checked
+    Raises:
+        ClaimCheckError: if the payload does not exist
+    """
+
+    attributes: Dict = message.get("messageAttributes") or {}
+    if CLAIM_CHECK_ATTRIBUTE not in attributes:
+        return message
+    uri = attributes[CLAIM_CHECK_ATTRIBUTE]["stringValue"]
+    bucket, _, key = uri[len("s3://") :].partition("/")
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+    except s3_client.exceptions.NoSuchKey as e:
+        raise ClaimCheckError(f"Missing claim-check payload {uri}") from e
+    payload = json.loads(response["Body"].read())
+    return ReceivedSqsMessage(
+        {
+            **message,
+            "body": payload["body"],
+            "messageAttributes": payload["messageAttributes"],
+        }
+    )
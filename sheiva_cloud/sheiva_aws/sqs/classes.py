@@ -7,6 +7,7 @@ class ReceivedSqsMessage(TypedDict):
     as received from an SQS event.
     """
 
+    messageId: str
     receiptHandle: str
     body: str
     messageAttributes: Dict
@@ -36,6 +37,7 @@ class ParsedSqsMessage(TypedDict):
     Message.
     """
 
+    messageId: str
     receiptHandle: str
 
 
@@ -53,10 +55,45 @@ class SqsResponse(TypedDict):
     messages_to_dlq: List[SqsMessage]
 
 
+class ScrapeResponse(SqsResponse):
+    """
+    SqsResponse of a scrape message.
+    scraped_urls: urls that were scraped, including workouts
+        that turned out to be inaccessible.
+    messages_to_requeue: messages of the urls left unscraped at
+        the deadline, to be sent back to the source queue
+    """
+
+    scraped_urls: List[str]
+    messages_to_requeue: List[SqsMessage]
+
+
+class BatchItemFailure(TypedDict):
+    """
+    Structure of a single failed record reported back
+    to Lambda.
+    itemIdentifier: messageId of the failed record
+    """
+
+    itemIdentifier: str
+
+
+class BatchItemFailuresResponse(TypedDict):
+    """
+    Response structure for Lambda partial batch failure
+    reporting. Records not listed are deleted from the source
+    queue by Lambda, listed records are made visible again.
+    Requires 'ReportBatchItemFailures' on the event source mapping.
+    """
+
+    batchItemFailures: List[BatchItemFailure]
+
+
 class ScraperMessage(ParsedSqsMessage):
     """
     Sqs Message structure for scraping urls.
     urls: list of urls to scrape
+    messageId: id of the message
     receiptHandle: receipt handle of the message
     bucket_key: key of the s3 bucket
     """
@@ -65,6 +102,50 @@ class ScraperMessage(ParsedSqsMessage):
     bucket_key: str
 
 
+class SqsBatchFailure(TypedDict):
+    """
+    Structure of a failed entry from an SQS batch request.
+    id: id of the entry, its index in the submitted list
+    code: error code returned by SQS
+    message: error message returned by SQS
+    sender_fault: whether the failure was caused by the request
+    """
+
+    id: str
+    code: str
+    message: str
+    sender_fault: bool
+
+
+class SqsBatchResult(TypedDict):
+    """
+    Structure of the result of an SQS batch request.
+    successful: ids of the entries that succeeded
+    failed: entries that still failed after retrying
+    """
+
+    successful: List[str]
+    failed: List[SqsBatchFailure]
+
+
+class RedriveStats(TypedDict):
+    """
+    Structure of the counts of a dead-letter queue redrive.
+    received: messages received from the dead-letter queue
+    sent: messages sent to the target queue
+    deleted: messages deleted from the dead-letter queue
+    skipped: messages already sent by a previous run, only deleted
+    failed: messages that could not be sent or deleted, they are
+        received again once their visibility timeout expires
+    """
+
+    received: int
+    sent: int
+    deleted: int
+    skipped: int
+    failed: int
+
+
 class FileTransformerMessage(ParsedSqsMessage):
     """
     Sqs Message structure for a file transformer.
@@ -76,4 +157,5 @@ class FileTransformerMessage(ParsedSqsMessage):
     s3_input_file: str
     s3_output_bucket_key: str
 
+
 ParsedSqsMessageType = TypeVar("ParsedSqsMessageType", bound=ParsedSqsMessage)
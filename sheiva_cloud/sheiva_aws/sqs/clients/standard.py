@@ -11,10 +11,41 @@ queues and 10 only for FIFO queues. You also don't need to worry
 about message deduplication.
 """
 
-from typing import Dict, Optional
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
 
 import boto3
 
+from .. import claim_check
+from ..classes import SqsBatchFailure, SqsBatchResult, SqsMessage
+
+# Maximum number of entries SQS accepts in a single batch request
+MAX_BATCH_SIZE = 10
+
+
+def _chunk_entries(entries: List[Dict]) -> List[List[Dict]]:
+    """
+    Splits batch request entries into chunks of at most
+    'MAX_BATCH_SIZE' entries and 'claim_check.MAX_MESSAGE_BYTES' of
+    entry 'Size'.
+    """
+
+    chunks: List[List[Dict]] = []
+    chunk_size = 0
+    for entry in entries:
+        size = entry.get("Size", 0)
+        if (
+            not chunks
+            or len(chunks[-1]) == MAX_BATCH_SIZE
+            or chunk_size + size > claim_check.MAX_MESSAGE_BYTES
+        ):
+            chunks.append([])
+            chunk_size = 0
+        chunks[-1].append(entry)
+        chunk_size += size
+    return chunks
+
 
 class StandardClient:
     """
@@ -26,9 +57,25 @@ class StandardClient:
         self,
         queue_url: str,
         sqs_client: boto3.client,
+        s3_client: Optional[boto3.client] = None,
+        claim_check_bucket: Optional[str] = claim_check.CLAIM_CHECK_BUCKET,
     ):
+        """
+        Args:
+            queue_url (str): url of the queue
+            sqs_client (boto3.client): sqs client
+            s3_client (Optional[boto3.client]): s3 client the payloads
+                of messages over 'claim_check.MAX_MESSAGE_BYTES' are
+                put with by 'send_messages'. If None they fail
+                instead.
+            claim_check_bucket (Optional[str]): bucket the payloads
+                are put in. If None they fail instead.
+        """
+
         self.sqs_client = sqs_client
         self.queue_url = queue_url
+        self.s3_client = s3_client
+        self.claim_check_bucket = claim_check_bucket
 
     def send_message(
         self,
@@ -51,22 +98,273 @@ class StandardClient:
         )
         return response
 
+    def send_messages(
+        self,
+        messages: List[SqsMessage],
+        max_workers: int = 10,
+        max_retries: int = 3,
+    ) -> SqsBatchResult:
+        """
+        Send messages to the queue using 'SendMessageBatch'. Messages
+        are chunked into batches of at most 10 messages and
+        'claim_check.MAX_MESSAGE_BYTES' which are sent concurrently.
+        Messages larger than that are claim-checked, see
+        'claim_check.offload'. Entries that fail without it being the
+        sender's fault are retried.
+        Args:
+            messages (List[SqsMessage]): The messages to send.
+            max_workers (int): The maximum number of batches in flight.
+            max_retries (int): The number of times to retry failed
+                entries.
+        Returns:
+            SqsBatchResult: The per-entry results. Entry ids are the
+                index of the message in 'messages'.
+        """
+
+        entries = []
+        too_large: List[SqsBatchFailure] = []
+        for index, message in enumerate(messages):
+            size = claim_check.message_size(message)
+            if size > claim_check.MAX_MESSAGE_BYTES:
+                try:
+                    message = self._offload(message, size)
+                # pylint: disable=broad-except
+                except Exception as e:
+                    too_large.append(
+                        SqsBatchFailure(
+                            id=str(index),
+                            code=type(e).__name__,
+                            message=repr(e),
+                            sender_fault=not self._can_offload(),
+                        )
+                    )
+                    continue
+                size = claim_check.message_size(message)
+            entries.append(
+                {
+                    "Id": str(index),
+                    "MessageBody": message["message_body"],
+                    "MessageAttributes": message.get("message_attributes")
+                    or {},
+                    "Size": size,
+                }
+            )
+        result = self._process_batches(
+            batch_function=self.sqs_client.send_message_batch,
+            entries=entries,
+            max_workers=max_workers,
+            max_retries=max_retries,
+        )
+        if too_large:
+            result["failed"] = sorted(
+                result["failed"] + too_large, key=lambda f: int(f["id"])
+            )
+        return result
+
+    def _can_offload(self) -> bool:
+        return self.s3_client is not None and bool(self.claim_check_bucket)
+
+    def _offload(self, message: SqsMessage, size: int) -> SqsMessage:
+        """
+        Claim-checks a message too large to send.
+        Args:
+            message (SqsMessage): the message
+            size (int): its size
+        Returns:
+            SqsMessage: the message to send instead
+        """
+
+        if self.s3_client is None or not self.claim_check_bucket:
+            raise ValueError(
+                f"Message of {size} bytes is larger than "
+                f"{claim_check.MAX_MESSAGE_BYTES} bytes"
+            )
+        print(f"Claim-checking a message of {size} bytes")
+        return claim_check.offload(
+            message, s3_client=self.s3_client, bucket=self.claim_check_bucket
+        )
+
+    def delete_messages(
+        self,
+        receipt_handles: List[str],
+        max_workers: int = 10,
+        max_retries: int = 3,
+    ) -> SqsBatchResult:
+        """
+        Delete messages from the queue using 'DeleteMessageBatch'.
+        Receipt handles are chunked into batches of 10 which are
+        deleted concurrently. Entries that fail without it being
+        the sender's fault are retried.
+        Args:
+            receipt_handles (List[str]): The receipt handles of the
+                messages to delete.
+            max_workers (int): The maximum number of batches in flight.
+            max_retries (int): The number of times to retry failed
+                entries.
+        Returns:
+            SqsBatchResult: The per-entry results. Entry ids are the
+                index of the receipt handle in 'receipt_handles'.
+        """
+
+        entries = [
+            {"Id": str(index), "ReceiptHandle": receipt_handle}
+            for index, receipt_handle in enumerate(receipt_handles)
+        ]
+        return self._process_batches(
+            batch_function=self.sqs_client.delete_message_batch,
+            entries=entries,
+            max_workers=max_workers,
+            max_retries=max_retries,
+        )
+
+    def _process_batches(
+        self,
+        batch_function: Callable,
+        entries: List[Dict],
+        max_workers: int,
+        max_retries: int,
+    ) -> SqsBatchResult:
+        """
+        Runs a batch SQS function over entries in chunks of
+        'MAX_BATCH_SIZE', retrying entries that failed with
+        'SenderFault' set to False. Entries with a 'Size' are also
+        chunked so that each chunk is at most
+        'claim_check.MAX_MESSAGE_BYTES', the key is not sent.
+        Args:
+            batch_function (Callable): boto3 batch method to call.
+            entries (List[Dict]): The batch request entries.
+            max_workers (int): The maximum number of batches in flight.
+            max_retries (int): The number of times to retry failed
+                entries.
+        Returns:
+            SqsBatchResult: The per-entry results.
+        """
+
+        successful: List[str] = []
+        failed: Dict[str, SqsBatchFailure] = {}
+        pending = entries
+        for attempt in range(max_retries + 1):
+            if not pending:
+                break
+            if attempt:
+                time.sleep(0.1 * 2**attempt)
+            responses = self._call_batches(
+                batch_function=batch_function,
+                chunks=_chunk_entries(pending),
+                max_workers=max_workers,
+            )
+            entries_by_id = {entry["Id"]: entry for entry in pending}
+            pending = []
+            for response in responses:
+                for success in response.get("Successful", []):
+                    successful.append(success["Id"])
+                    failed.pop(success["Id"], None)
+                for failure in response.get("Failed", []):
+                    failed[failure["Id"]] = SqsBatchFailure(
+                        id=failure["Id"],
+                        code=failure.get("Code", ""),
+                        message=failure.get("Message", ""),
+                        sender_fault=failure.get("SenderFault", False),
+                    )
+                    if not failure.get("SenderFault", False):
+                        pending.append(entries_by_id[failure["Id"]])
+
+        return SqsBatchResult(
+            successful=sorted(successful, key=int),
+            failed=sorted(failed.values(), key=lambda f: int(f["id"])),
+        )
+
+    def _call_batches(
+        self,
+        batch_function: Callable,
+        chunks: List[List[Dict]],
+        max_workers: int,
+    ) -> List[Dict]:
+        """
+        Calls a batch SQS function for each chunk of entries
+        concurrently, see '_call_batch'.
+        Args:
+            batch_function (Callable): boto3 batch method to call.
+            chunks (List[List[Dict]]): chunks of entries.
+            max_workers (int): The maximum number of batches in flight.
+        Returns:
+            List[Dict]: The response for each chunk.
+        """
+
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(max_workers, len(chunks)))
+        ) as executor:
+            return list(
+                executor.map(
+                    lambda chunk: self._call_batch(batch_function, chunk),
+                    chunks,
+                )
+            )
+
+    def _call_batch(self, batch_function: Callable, chunk: List[Dict]) -> Dict:
+        """
+        Calls a batch SQS function for a single chunk of entries. If
+        the call itself fails every entry in the chunk is reported as
+        failed so it can be retried.
+        Args:
+            batch_function (Callable): boto3 batch method to call.
+            chunk (List[Dict]): at most 'MAX_BATCH_SIZE' entries.
+        Returns:
+            Dict: The response from the SQS batch method.
+        """
+
+        try:
+            return batch_function(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {k: v for k, v in entry.items() if k != "Size"}
+                    for entry in chunk
+                ],
+            )
+        # pylint: disable=broad-except
+        except Exception as e:
+            print(f"Error calling {batch_function.__name__}: {repr(e)}")
+            return {
+                "Failed": [
+                    {
+                        "Id": entry["Id"],
+                        "Code": type(e).__name__,
+                        "Message": repr(e),
+                        "SenderFault": False,
+                    }
+                    for entry in chunk
+                ]
+            }
+
     def receive_message(
-        self, max_number_of_messages: Optional[int] = 1
+        self,
+        max_number_of_messages: Optional[int] = 1,
+        wait_time_seconds: Optional[int] = None,
+        visibility_timeout: Optional[int] = None,
     ) -> Dict:
         """
         Receive messages from the queue.
         Args:
             max_number_of_messages (int): The maximum number
                 of messages to return. The default is 1.
+            wait_time_seconds (int): If set, long polls for up to
+                this many seconds (max 20) until a message arrives.
+            visibility_timeout (int): If set, overrides the queue's
+                visibility timeout for the received messages.
         Returns:
             dict: The response from the SQS receive_message method.
         """
 
+        kwargs = {}
+        if wait_time_seconds is not None:
+            kwargs["WaitTimeSeconds"] = wait_time_seconds
+        if visibility_timeout is not None:
+            kwargs["VisibilityTimeout"] = visibility_timeout
         response = self.sqs_client.receive_message(
             QueueUrl=self.queue_url,
             MaxNumberOfMessages=max_number_of_messages,
             MessageAttributeNames=["All"],
+            **kwargs,
         )
         return response
 
@@ -1,60 +1,263 @@
 """
 Module for custom SQS utilities.
+
+Scraper message bodies are encoded by 'encode_urls'. Highrise urls
+share long prefixes, so version 1 stores each distinct prefix, up to
+the last '/', once and every url as the index of its prefix and the
+id after it:
+
+    {"v": 1, "p": ["https://.../workouts/"], "u": ["a1", "b2"]}
+
+'i' holds the prefix index of each url when there is more than one
+prefix. Compressed bodies are the zlib compressed version 1 body,
+base64 encoded behind 'COMPRESSED_MARKER'. Bodies that are a plain
+JSON list of urls, as sent before the codec existed, are still
+decoded.
 """
 
+import base64
+import binascii
 import json
-from typing import Tuple
+import zlib
+from typing import Any, Dict, List, Optional, Tuple, TypeGuard
+
+import boto3
+
+from . import claim_check
+from .classes import FileTransformerMessage, ReceivedSqsMessage, ScraperMessage
+
+URL_CODEC_VERSION = 1
+# 'json' is the plain list of urls, readable by every consumer
+URL_ENCODINGS = ("json", "v1", "v1-zlib")
+DEFAULT_URL_ENCODING = "v1"
+COMPRESSED_MARKER = "z"
+# Largest decompressed body accepted, SQS bodies are at most 256 KiB
+MAX_DECOMPRESSED_BYTES = 16 * 1024 * 1024
+
+
+class MessageParseError(ValueError):
+    """
+    Raised for a message that does not match its schema. Such
+    messages fail the same way every time they are received.
+    """
+
+
+def encode_urls(urls: List[str], encoding: str = DEFAULT_URL_ENCODING) -> str:
+    """
+    Encodes urls as a scraper message body.
+    Args:
+        urls (List[str]): urls to encode
+        encoding (str): one of 'URL_ENCODINGS'
+    Returns:
+        str: the message body
+    """
+
+    if encoding not in URL_ENCODINGS:
+        raise ValueError(f"Unknown url encoding: '{encoding}'")
+    if encoding == "json":
+        return json.dumps(urls)
+
+    prefixes: Dict[str, int] = {}
+    indexes = []
+    ids = []
+    for url in urls:
+        split = url.rfind("/") + 1
+        indexes.append(prefixes.setdefault(url[:split], len(prefixes)))
+        ids.append(url[split:])
+    body = {"v": URL_CODEC_VERSION, "p": list(prefixes), "u": ids}
+    if len(prefixes) > 1:
+        body["i"] = indexes
+    encoded = json.dumps(body, separators=(",", ":"))
+    if encoding == "v1-zlib":
+        compressed = base64.b64encode(zlib.compress(encoded.encode(), 9))
+        return f"{COMPRESSED_MARKER}{compressed.decode('ascii')}"
+    return encoded
+
+
+def _decompress(body: str) -> str:
+    try:
+        data = base64.b64decode(body[len(COMPRESSED_MARKER) :], validate=True)
+        decompressor = zlib.decompressobj()
+        decoded = decompressor.decompress(data, MAX_DECOMPRESSED_BYTES)
+    except (binascii.Error, zlib.error) as e:
+        raise MessageParseError(f"Invalid compressed body: {e!r}") from e
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise MessageParseError("Compressed body is truncated or too large")
+    return decoded.decode("utf-8", errors="strict")
+
+
+def _is_str_list(value: Any) -> TypeGuard[List[str]]:
+    return isinstance(value, list) and all(isinstance(v, str) for v in value)
+
+
+def decode_urls(body: str) -> List[str]:
+    """
+    Decodes and validates a scraper message body.
+    Args:
+        body (str): body from 'encode_urls' or a JSON list of urls
+    Returns:
+        List[str]: the urls
+    Raises:
+        MessageParseError: if the body does not match the schema
+    """
+
+    if body.startswith(COMPRESSED_MARKER):
+        body = _decompress(body)
+    try:
+        decoded = json.loads(body)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise MessageParseError(f"Invalid JSON body: {e!r}") from e
+
+    if isinstance(decoded, list):
+        urls = decoded
+    elif isinstance(decoded, dict):
+        if decoded.get("v") != URL_CODEC_VERSION:
+            raise MessageParseError(
+                f"Unsupported url codec version: {decoded.get('v')!r}"
+            )
+        prefixes, ids = decoded.get("p"), decoded.get("u")
+        if not _is_str_list(prefixes) or not _is_str_list(ids):
+            raise MessageParseError("'p' and 'u' must be lists of strings")
+        indexes = decoded.get("i", [0] * len(ids))
+        if (
+            not isinstance(indexes, list)
+            or len(indexes) != len(ids)
+            or not all(
+                isinstance(i, int) and 0 <= i < len(prefixes) for i in indexes
+            )
+        ):
+            raise MessageParseError("'i' must index 'p' for every url")
+        urls = [prefixes[i] + url_id for i, url_id in zip(indexes, ids)]
+    else:
+        raise MessageParseError(f"Unexpected body type: {type(decoded)}")
+
+    if not _is_str_list(urls) or not all(urls):
+        raise MessageParseError("Urls must be non-empty strings")
+    return urls
+
+
+def pack_urls(
+    urls: List[str],
+    max_bytes: int = claim_check.MAX_MESSAGE_BYTES,
+    max_urls: Optional[int] = None,
+    encoding: str = DEFAULT_URL_ENCODING,
+) -> List[Tuple[List[str], str]]:
+    """
+    Packs urls, in order, into as few message bodies as possible. Each
+    body holds as many urls as encode to at most 'max_bytes', found by
+    doubling then bisecting the number of urls, so a body is encoded
+    about 2 * log2(urls in it) times.
+    Args:
+        urls (List[str]): urls to pack
+        max_bytes (int): largest body, the message size limit less
+            the size of the message attributes
+        max_urls (Optional[int]): most urls in a body
+        encoding (str): one of 'URL_ENCODINGS'
+    Returns:
+        List[Tuple[List[str], str]]: the urls of each body and the
+            body. A url too large for a body on its own gets a body
+            to itself, see 'claim_check'.
+    """
+
+    def encode(num_urls: int) -> Optional[str]:
+        body = encode_urls(urls[start : start + num_urls], encoding)
+        return body if len(body.encode("utf-8")) <= max_bytes else None
+
+    packed = []
+    start = 0
+    while start < len(urls):
+        limit = min(max_urls or len(urls), len(urls) - start)
+        # Largest number of urls known to fit and smallest known not to
+        fits, fits_body = 1, encode_urls([urls[start]], encoding)
+        too_many = limit + 1
+        num_urls = 2
+        while fits < limit:
+            body = encode(min(num_urls, limit))
+            if body is None:
+                too_many = min(num_urls, limit)
+                break
+            fits, fits_body = min(num_urls, limit), body
+            num_urls *= 2
+        while too_many - fits > 1:
+            middle = (fits + too_many) // 2
+            body = encode(middle)
+            if body is None:
+                too_many = middle
+            else:
+                fits, fits_body = middle, body
+        packed.append((urls[start : start + fits], fits_body))
+        start += fits
+    return packed
+
+
+def _resolve(
+    message: ReceivedSqsMessage, s3_client: boto3.client
+) -> ReceivedSqsMessage:
+    try:
+        return claim_check.resolve(message, s3_client=s3_client)
+    except claim_check.ClaimCheckError as e:
+        raise MessageParseError(str(e)) from e
 
-from .classes import (
-	ReceivedSqsMessage,
-    ScraperMessage,
-    FileTransformerMessage
-)
 
 def scrape_message_parser(
-    message: ReceivedSqsMessage,
+    message: ReceivedSqsMessage, s3_client: boto3.client
 ) -> ScraperMessage:
     """
     Parses a scrape message from the SQS queue. Follows
-    the ScraperMessage structure.
+    the ScraperMessage structure. Claim-checked messages are resolved.
     Args:
         message (ReceivedSqsMessage): message from the SQS queue
+        s3_client (boto3.client): s3 client of the claim-check
     Returns:
         ScraperMessage: parsed message
     """
 
+    message = _resolve(message, s3_client=s3_client)
+    try:
+        bucket_key = message["messageAttributes"]["bucket_key"]["stringValue"]
+    except (KeyError, TypeError) as e:
+        raise MessageParseError("Missing 'bucket_key' attribute") from e
+    if not isinstance(bucket_key, str) or not bucket_key:
+        raise MessageParseError("'bucket_key' must be a non-empty string")
     return ScraperMessage(
         {
-            "urls": json.loads(message["body"]),
+            "urls": decode_urls(message["body"]),
+            "messageId": message["messageId"],
             "receiptHandle": message["receiptHandle"],
-            "bucket_key": message["messageAttributes"]["bucket_key"][
-                "stringValue"
-            ],
+            "bucket_key": bucket_key,
         }
     )
 
 
 def file_transformer_message(
-    message: ReceivedSqsMessage,
+    message: ReceivedSqsMessage, s3_client: boto3.client
 ) -> FileTransformerMessage:
     """
     Parses a file transformer message from the SQS queue. Follows
-    the FileTransformerMessage structure.
+    the FileTransformerMessage structure. Claim-checked messages are
+    resolved.
     Args:
         message (ReceivedSqsMessage): message from the SQS queue
+        s3_client (boto3.client): s3 client of the claim-check
     Returns:
         FileTransformerMessage: parsed message
     """
 
+    message = _resolve(message, s3_client=s3_client)
+    try:
+        attributes = message["messageAttributes"]
+        s3_input_file = attributes["s3_input_file"]["stringValue"]
+        s3_output_bucket_key = attributes["s3_output_bucket_key"][
+            "stringValue"
+        ]
+    except (KeyError, TypeError) as e:
+        raise MessageParseError(f"Missing attribute: {e!r}") from e
     return FileTransformerMessage(
         {
+            "messageId": message["messageId"],
             "receiptHandle": message["receiptHandle"],
-            "s3_input_file": message["messageAttributes"]["s3_input_file"][
-                "stringValue"
-            ],
-            "s3_output_bucket_key": message["messageAttributes"][
-                "s3_output_bucket_key"
-            ]["stringValue"],
+            "s3_input_file": s3_input_file,
+            "s3_output_bucket_key": s3_output_bucket_key,
         }
     )
 
@@ -0,0 +1,329 @@
+"""
+Module for redriving the messages of a dead-letter queue back to a
+target queue.
+
+Several receivers long poll the dead-letter queue concurrently. Each
+received batch is sent to the target queue with 'SendMessageBatch'
+and only the messages that were sent are deleted from the
+dead-letter queue. Nothing is accumulated in memory: every sent and
+deleted message is appended to a JSON Lines checkpoint file, which
+also serves as an archive of what was redriven.
+
+A redrive can be resumed after a crash with the same checkpoint.
+Messages that were sent but not deleted reappear in the dead-letter
+queue once their visibility timeout expires and are only deleted, not
+sent a second time. Messages that were received but not sent simply
+reappear and are sent as usual.
+"""
+
+import json
+import os
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, TextIO
+
+from .classes import RedriveStats
+from .clients import StandardClient
+
+SENT = "sent"
+DELETED = "deleted"
+
+# Longest wait SQS allows for a long poll
+MAX_WAIT_TIME_SECONDS = 20
+PROGRESS_INTERVAL_SECONDS = 10
+
+
+class RedriveCheckpoint:
+    """
+    Append only JSON Lines checkpoint of a redrive. Each line is a
+    'sent' record, with the message, or a 'deleted' record.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): path of the checkpoint file
+        """
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._file: Optional[TextIO] = None
+
+    def load(self) -> Set[str]:
+        """
+        Reads the checkpoint of a previous run.
+        Returns:
+            Set[str]: ids of the messages that were sent but not
+                deleted. Only these are held in memory.
+        """
+
+        pending: Set[str] = set()
+        if not os.path.exists(self.path):
+            return pending
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                # The last line may be cut short by a crash
+                except json.JSONDecodeError:
+                    continue
+                if record["event"] == SENT:
+                    pending.add(record["message_id"])
+                else:
+                    pending.discard(record["message_id"])
+        return pending
+
+    def open(self) -> None:
+        """
+        Opens the checkpoint for appending, after ending a line cut
+        short by a crash so the next record is not lost with it.
+        """
+
+        truncated = False
+        if os.path.exists(self.path) and os.path.getsize(self.path):
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                truncated = f.read(1) != b"\n"
+        # pylint: disable=consider-using-with
+        self._file = open(self.path, "a", encoding="utf-8")
+        if truncated:
+            self._file.write("\n")
+
+    def close(self) -> None:
+        """
+        Closes the checkpoint.
+        """
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def append(self, records: Iterable[Dict]) -> None:
+        """
+        Appends records and syncs them to disk before returning, so
+        a record is never lost once the call it guards is made.
+        Args:
+            records (Iterable[Dict]): records to append
+        """
+
+        lines = "".join(
+            json.dumps(record, separators=(",", ":")) + "\n"
+            for record in records
+        )
+        if not lines:
+            return
+        assert self._file is not None, "checkpoint is not open"
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+
+def _forwardable_attributes(message: Dict) -> Dict:
+    """
+    Gets the message attributes of a received message in the form
+    'SendMessageBatch' expects.
+    """
+
+    return {
+        name: {
+            key: value
+            for key, value in attribute.items()
+            if key in ("DataType", "StringValue", "BinaryValue")
+        }
+        for name, attribute in message.get("MessageAttributes", {}).items()
+    }
+
+
+# pylint: disable=too-many-instance-attributes
+class Redrive:
+    """
+    Redrives a dead-letter queue to a target queue.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        dlq: StandardClient,
+        target_queue: StandardClient,
+        checkpoint: RedriveCheckpoint,
+        receivers: int = 8,
+        visibility_timeout: int = 120,
+        max_empty_receives: int = 1,
+    ):
+        """
+        Args:
+            dlq (StandardClient): dead-letter queue to drain
+            target_queue (StandardClient): queue to send messages to
+            checkpoint (RedriveCheckpoint): checkpoint of the redrive
+            receivers (int): number of concurrent receivers
+            visibility_timeout (int): seconds a received message is
+                hidden for, must cover a send and a delete.
+            max_empty_receives (int): consecutive empty long polls
+                after which a receiver stops.
+        """
+
+        self.dlq = dlq
+        self.target_queue = target_queue
+        self.checkpoint = checkpoint
+        self.receivers = receivers
+        self.visibility_timeout = visibility_timeout
+        self.max_empty_receives = max_empty_receives
+        self._counts: Counter = Counter()
+        self._already_sent: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def _count(self, **counts: int) -> None:
+        with self._lock:
+            for name, count in counts.items():
+                self._counts[name] += count
+
+    @property
+    def stats(self) -> RedriveStats:
+        """
+        Counts of the redrive so far.
+        Returns:
+            RedriveStats: counts of the redrive
+        """
+
+        with self._lock:
+            return RedriveStats(
+                received=self._counts["received"],
+                sent=self._counts["sent"],
+                deleted=self._counts["deleted"],
+                skipped=self._counts["skipped"],
+                failed=self._counts["failed"],
+            )
+
+    def _delete(self, messages: List[Dict]) -> None:
+        """
+        Deletes messages from the dead-letter queue and checkpoints
+        the deletes.
+        """
+
+        if not messages:
+            return
+        result = self.dlq.delete_messages(
+            receipt_handles=[m["ReceiptHandle"] for m in messages],
+            max_workers=1,
+        )
+        deleted = [messages[int(index)] for index in result["successful"]]
+        self.checkpoint.append(
+            {"event": DELETED, "message_id": m["MessageId"]} for m in deleted
+        )
+        with self._lock:
+            for message in deleted:
+                self._already_sent.discard(message["MessageId"])
+        self._count(deleted=len(deleted), failed=len(messages) - len(deleted))
+
+    def process_batch(self, messages: List[Dict]) -> None:
+        """
+        Sends a received batch to the target queue, checkpoints what
+        was sent and deletes it from the dead-letter queue.
+        Args:
+            messages (List[Dict]): messages of a 'ReceiveMessage' call
+        """
+
+        with self._lock:
+            already_sent_ids = {
+                m["MessageId"]
+                for m in messages
+                if m["MessageId"] in self._already_sent
+            }
+        already_sent = [
+            m for m in messages if m["MessageId"] in already_sent_ids
+        ]
+        to_send = [
+            m for m in messages if m["MessageId"] not in already_sent_ids
+        ]
+        self._count(received=len(messages), skipped=len(already_sent))
+
+        sent = []
+        if to_send:
+            result = self.target_queue.send_messages(
+                messages=[
+                    {
+                        "message_body": m["Body"],
+                        "message_attributes": _forwardable_attributes(m),
+                    }
+                    for m in to_send
+                ],
+                max_workers=1,
+            )
+            sent = [to_send[int(index)] for index in result["successful"]]
+            self.checkpoint.append(
+                {
+                    "event": SENT,
+                    "message_id": m["MessageId"],
+                    "body": m["Body"],
+                    "message_attributes": _forwardable_attributes(m),
+                }
+                for m in sent
+            )
+            with self._lock:
+                self._already_sent.update(m["MessageId"] for m in sent)
+            self._count(sent=len(sent), failed=len(to_send) - len(sent))
+
+        self._delete(already_sent + sent)
+
+    def receive(self) -> None:
+        """
+        Receiver loop, long polls the dead-letter queue until it has
+        been empty 'max_empty_receives' times in a row.
+        """
+
+        empty_receives = 0
+        while empty_receives < self.max_empty_receives:
+            response = self.dlq.receive_message(
+                max_number_of_messages=10,
+                wait_time_seconds=MAX_WAIT_TIME_SECONDS,
+                visibility_timeout=self.visibility_timeout,
+            )
+            messages = response.get("Messages", [])
+            if not messages:
+                empty_receives += 1
+                continue
+            empty_receives = 0
+            self.process_batch(messages)
+
+    def run(self) -> RedriveStats:
+        """
+        Runs the redrive until the dead-letter queue is drained.
+        Returns:
+            RedriveStats: counts of the redrive
+        """
+
+        self._already_sent = self.checkpoint.load()
+        if self._already_sent:
+            print(
+                f"Resuming, {len(self._already_sent)} messages were sent "
+                "but not deleted"
+            )
+        self.checkpoint.open()
+        errors: List[Exception] = []
+
+        def receive():
+            try:
+                self.receive()
+            # pylint: disable=broad-except
+            except Exception as e:
+                print(f"Receiver stopped with exception: {repr(e)}")
+                errors.append(e)
+
+        threads = [
+            threading.Thread(target=receive, daemon=True)
+            for _ in range(self.receivers)
+        ]
+        try:
+            for thread in threads:
+                thread.start()
+            alive = threads
+            while alive:
+                alive[0].join(timeout=PROGRESS_INTERVAL_SECONDS)
+                alive = [thread for thread in alive if thread.is_alive()]
+                print(f"Progress: {self.stats}")
+        finally:
+            self.checkpoint.close()
+        if errors:
+            raise errors[0]
+        return self.stats
@@ -0,0 +1,80 @@
+"""
+Script to redrive a dead-letter queue back to its source queue,
+replacing the 'save_backlog_from_dlq' and 'dlq_backlog_to_source'
+scripts. The redrive streams every message it sends to a JSON Lines
+checkpoint and can be resumed after a crash by re-running it with the
+same checkpoint. For local use only.
+
+Usage:
+    python redrive_dlq.py [--receivers 8] [--checkpoint dlq_redrive.jsonl]
+"""
+
+import argparse
+
+import boto3
+
+from sheiva_cloud.sheiva_aws import sqs
+from sheiva_cloud.sheiva_aws.sqs import redrive
+
+CHECKPOINT_FILE_NAME = "dlq_redrive.jsonl"
+
+
+def main(
+    sqs_client: boto3.client,
+    dlq_url: str,
+    target_queue_url: str,
+    checkpoint_file: str,
+    receivers: int,
+    visibility_timeout: int,
+) -> sqs.RedriveStats:
+    """
+    Redrives the dead-letter queue to the target queue.
+    Args:
+        sqs_client (boto3.client): sqs client
+        dlq_url (str): url of the dead-letter queue
+        target_queue_url (str): url of the queue to send messages to
+        checkpoint_file (str): path of the checkpoint file
+        receivers (int): number of concurrent receivers
+        visibility_timeout (int): visibility timeout of received
+            messages in seconds
+    Returns:
+        sqs.RedriveStats: counts of the redrive
+    """
+
+    stats = redrive.Redrive(
+        dlq=sqs.StandardSqsClient(queue_url=dlq_url, sqs_client=sqs_client),
+        target_queue=sqs.StandardSqsClient(
+            queue_url=target_queue_url, sqs_client=sqs_client
+        ),
+        checkpoint=redrive.RedriveCheckpoint(path=checkpoint_file),
+        receivers=receivers,
+        visibility_timeout=visibility_timeout,
+    ).run()
+    print(f"Finished redrive: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Redrive a dead-letter queue to its source queue."
+    )
+    parser.add_argument(
+        "--dlq-url", default=sqs.WORKOUT_SCRAPER_DEADLETTER_QUEUE
+    )
+    parser.add_argument(
+        "--target-queue-url", default=sqs.WORKOUT_SCRAPER_QUEUE
+    )
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE_NAME)
+    parser.add_argument("--receivers", type=int, default=8)
+    parser.add_argument("--visibility-timeout", type=int, default=120)
+    args = parser.parse_args()
+
+    boto3_session = boto3.Session()
+    main(
+        sqs_client=boto3_session.client("sqs"),
+        dlq_url=args.dlq_url,
+        target_queue_url=args.target_queue_url,
+        checkpoint_file=args.checkpoint,
+        receivers=args.receivers,
+        visibility_timeout=args.visibility_timeout,
+    )
@@ -2,31 +2,67 @@
 Module for generic SQS utilities.
 """
 
-from typing import Callable, List
+from typing import Callable, Iterable, List, Optional, Tuple
 
-import boto3
+from sheiva_cloud.sheiva_aws import metrics
 
 from .classes import (
-    SqsEvent,
+    BatchItemFailuresResponse,
     ParsedSqsMessageType,
+    SqsBatchResult,
+    SqsEvent,
     SqsResponse,
 )
+from .clients import StandardClient
+from .message_parsers import MessageParseError
 
 
-def process_sqs_event(
-    sqs_event: SqsEvent, parse_function: Callable
-) -> List[ParsedSqsMessageType]:
+def _dead_letter_attributes(message, error: Exception) -> dict:
     """
-    Takes SQS message event and extracts all the message bodies
-    into a parsed list.
+    Converts the attributes of a received record to the form
+    'SendMessageBatch' expects and adds the parse error.
+    """
+
+    attributes = {
+        name: {
+            key[0].upper() + key[1:]: value
+            for key, value in attribute.items()
+            if key in ("dataType", "stringValue", "binaryValue")
+        }
+        for name, attribute in (message.get("messageAttributes") or {}).items()
+    }
+    attributes["parse_error"] = {
+        "DataType": "String",
+        "StringValue": repr(error)[:1024],
+    }
+    return attributes
+
+
+def parse_sqs_event(
+    sqs_event: SqsEvent,
+    parse_function: Callable[..., ParsedSqsMessageType],
+    dlq: Optional[StandardClient] = None,
+) -> Tuple[List[ParsedSqsMessageType], List[str]]:
+    """
+    Parses the records of an SQS event. Records that do not match
+    their schema, raising 'MessageParseError', would fail on every
+    retry, so when a dead-letter queue is given they are sent to it
+    straight away, unchanged but for a 'parse_error' attribute. Records
+    that fail for other reasons, e.g. a claim-check payload that could
+    not be read, are retried.
     Args:
         sqs_event (SqsEvent): SQS event
         parse_function (Callable): function to parse message
+        dlq (Optional[StandardClient]): queue for records that fail to
+            parse
     Returns:
-        List[ParsedSqsMessageType]: list of parsed SQS messages
+        Tuple[List[ParsedSqsMessageType], List[str]]: parsed messages
+            and the message ids of the records sent to the dead-letter
+            queue, which can be treated as processed.
     """
 
-    parsed_messages = []
+    parsed_messages: List[ParsedSqsMessageType] = []
+    failed = []
     for message in sqs_event["Records"]:
         try:
             parsed_messages.append(parse_function(message))
@@ -36,27 +72,103 @@ def process_sqs_event(
                 f"Error parsing message: {message} "
                 f"with exception: {repr(e)}"
             )
-    return parsed_messages
+            if isinstance(e, MessageParseError):
+                failed.append((message, e))
+    metrics.count("Records", len(sqs_event["Records"]), Stage="ParseEvent")
+    metrics.count(
+        "ParseErrors",
+        len(sqs_event["Records"]) - len(parsed_messages),
+        Stage="ParseEvent",
+    )
+
+    dead_lettered: List[str] = []
+    if dlq is not None and failed:
+        result = dlq.send_messages(
+            messages=[
+                {
+                    "message_body": message["body"],
+                    "message_attributes": _dead_letter_attributes(
+                        message, error
+                    ),
+                }
+                for message, error in failed
+            ]
+        )
+        for failure in result["failed"]:
+            print(f"Error dead-lettering message: {failure}")
+        dead_lettered = [
+            failed[int(index)][0]["messageId"]
+            for index in result["successful"]
+        ]
+        metrics.count("DeadLettered", len(dead_lettered), Stage="ParseEvent")
+    return parsed_messages, dead_lettered
+
+
+def process_sqs_event(
+    sqs_event: SqsEvent, parse_function: Callable[..., ParsedSqsMessageType]
+) -> List[ParsedSqsMessageType]:
+    """
+    Takes SQS message event and extracts all the message bodies
+    into a parsed list.
+    Args:
+        sqs_event (SqsEvent): SQS event
+        parse_function (Callable): function to parse message
+    Returns:
+        List[ParsedSqsMessageType]: list of parsed SQS messages
+    """
+
+    return parse_sqs_event(sqs_event, parse_function)[0]
+
+
+def build_batch_item_failures(
+    sqs_event: SqsEvent, processed_message_ids: Iterable[str]
+) -> BatchItemFailuresResponse:
+    """
+    Builds the Lambda partial batch response for an SQS event. Every
+    record that was not processed, including records that failed to
+    parse, is reported as a failure so it is retried.
+    Args:
+        sqs_event (SqsEvent): SQS event
+        processed_message_ids (Iterable[str]): ids of the messages that
+            were processed successfully
+    Returns:
+        BatchItemFailuresResponse: the batch item failures response
+    """
+
+    processed = set(processed_message_ids)
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": record["messageId"]}
+            for record in sqs_event["Records"]
+            if record["messageId"] not in processed
+        ]
+    }
 
 
 def process_sqs_response(
-    source_queue: boto3.client,
-    dlq: boto3.client,
+    source_queue: StandardClient,
+    dlq: StandardClient,
     sqs_response: SqsResponse,
-):
+) -> Tuple[SqsBatchResult, SqsBatchResult]:
     """
     Function for processing an SQS response. Sending delete response to
     source queue for successfully process messages and sending any failed
-    messages to the dead-letter queue.
+    messages to the dead-letter queue. Both are sent as batch requests.
     Args:
-        source_queue (boto3.client): source_queue of the SQS event
-        dlq (boto3.client): the dead-letter queue for the SQS event
+        source_queue (StandardClient): source_queue of the SQS event
+        dlq (StandardClient): the dead-letter queue for the SQS event
         sqs_response (SqsResponse): the SQS response after processing the
             event.
+    Returns:
+        Tuple[SqsBatchResult, SqsBatchResult]: results of the delete
+            and dead-letter batch requests.
     """
 
-    for receipt_handle in sqs_response["receipt_handles_to_delete"]:
-        source_queue.delete_message(receipt_handle=receipt_handle)
-
-    for message in sqs_response["messages_to_dlq"]:
-        dlq.send_message(**message)
+    delete_result = source_queue.delete_messages(
+        receipt_handles=sqs_response["receipt_handles_to_delete"]
+    )
+    dlq_result = dlq.send_messages(messages=sqs_response["messages_to_dlq"])
+    for result in (delete_result, dlq_result):
+        for failure in result["failed"]:
+            print(f"Error processing SQS response entry: {failure}")
+    return delete_result, dlq_result
@@ -0,0 +1,343 @@
+import pytest
+
+pytest.importorskip("kuda.scrapers")
+
+# pylint: disable=wrong-import-position
+from benchmarks.fakes import FakeS3Client, FakeSqsClient
+from sheiva_cloud.sheiva_aws import s3, sqs
+from sheiva_cloud.sheiva_aws.aws_lambda import scrape_events
+from sheiva_cloud.sheiva_aws.aws_lambda.concurrency import AimdController
+from sheiva_cloud.sheiva_aws.aws_lambda.scrape_cache import ScrapeCache
+from sheiva_cloud.sheiva_aws.s3 import (
+    object_codecs,
+    transform_manifest,
+    url_index,
+)
+
+BUCKET_KEY = "highrise/workout-data/male/age_16_20"
+DLQ_URL = "https://sqs/dlq"
+QUEUE_URL = "https://sqs/queue"
+URLS = [f"https://www.highrise.app/workouts/{i}" for i in range(12)]
+
+
+def workout(url):
+    return {"url": url, "name": f"workout {url}"}
+
+
+class FakeScrape:
+    """
+    Stand-in for kuda's 'scrape_urls', records the urls of each round
+    and fails the urls in 'failing'.
+    """
+
+    def __init__(self):
+        self.failing = set()
+        self.rounds = []
+
+    # pylint: disable=unused-argument
+    def __call__(self, urls, html_parser, batch_size):
+        self.rounds.append(list(urls))
+        return [url if url in self.failing else workout(url) for url in urls]
+
+
+@pytest.fixture(autouse=True)
+def scrape(monkeypatch):
+    fake = FakeScrape()
+    monkeypatch.setattr(scrape_events, "scrape_urls", fake)
+    yield fake
+    url_index._deltas.clear()
+    url_index._generations.clear()
+    url_index._shards.clear()
+
+
+@pytest.fixture
+def s3_client():
+    return FakeS3Client()
+
+
+@pytest.fixture
+def sqs_client():
+    return FakeSqsClient()
+
+
+def record(message_id, urls):
+    message = scrape_events.urls_message(urls, BUCKET_KEY)
+    return {
+        "messageId": message_id,
+        "receiptHandle": f"receipt-{message_id}",
+        "body": message["message_body"],
+        "messageAttributes": {
+            "bucket_key": {"stringValue": BUCKET_KEY, "dataType": "String"}
+        },
+    }
+
+
+def scrape_event(s3_client, sqs_client, records, **kwargs):
+    kwargs.setdefault("scraper", scrape_events.Scraper(html_parser=None))
+    return scrape_events.ScrapeEvent(
+        event={"Records": records},
+        s3_client=s3_client,
+        dlq=sqs.StandardSqsClient(queue_url=DLQ_URL, sqs_client=sqs_client),
+        **kwargs,
+    )
+
+
+def scraped_keys(s3_client):
+    return sorted(
+        key
+        for key in s3_client.objects.get(s3.SHEIVA_SCRAPE_BUCKET, {})
+        if key.startswith(f"{BUCKET_KEY}/")
+    )
+
+
+def scraped_urls(s3_client):
+    return sorted(
+        item["url"]
+        for key in scraped_keys(s3_client)
+        for item in object_codecs.read_items(
+            s3_client=s3_client, key=key, bucket=s3.SHEIVA_SCRAPE_BUCKET
+        )
+    )
+
+
+def queued_urls(sqs_client, queue_url):
+    return [
+        url
+        for message in sqs_client.queues.get(queue_url, {}).values()
+        for url in sqs.message_parsers.decode_urls(message["Body"])
+    ]
+
+
+def test_scrape_rounds_of_async_batch_size(scrape):
+    scraper = scrape_events.Scraper(html_parser=None, async_batch_size=5)
+    rounds = list(scraper.scrape_rounds(URLS))
+
+    assert [round_urls for round_urls, _ in rounds] == scrape.rounds
+    assert [len(round_urls) for round_urls in scrape.rounds] == [5, 5, 2]
+    assert [r for _, results in rounds for r in results] == [
+        workout(url) for url in URLS
+    ]
+
+
+def test_scrape_rounds_follow_the_controller(scrape):
+    scrape.failing = set(URLS[2:5])
+    controller = AimdController(initial=2, maximum=4)
+    scraper = scrape_events.Scraper(
+        html_parser=None, concurrency_controller=controller
+    )
+
+    rounds = list(scraper.scrape_rounds(URLS))
+
+    # Grows after a healthy round, halves after a failed one
+    assert [len(round_urls) for round_urls, _ in rounds] == [2, 3, 1, 2, 3, 1]
+    assert [r for _, results in rounds for r in results][2:5] == URLS[2:5]
+    stats = controller.invocation_stats()
+    assert (stats["rounds"], stats["urls"], stats["failed"]) == (6, 12, 3)
+
+
+def test_scrape_rounds_stop_before_a_round(scrape):
+    scraper = scrape_events.Scraper(html_parser=None, async_batch_size=5)
+    rounds = scraper.scrape_rounds(
+        URLS, should_stop=lambda: len(scrape.rounds) == 2
+    )
+
+    assert [len(round_urls) for round_urls, _ in rounds] == [5, 5]
+
+
+def test_scrape_rounds_fetch_only_urls_missing_from_the_cache(
+    scrape, tmp_path
+):
+    scrape.failing = {URLS[1]}
+    scraper = scrape_events.Scraper(
+        html_parser=None,
+        async_batch_size=5,
+        scrape_cache=ScrapeCache(directory=str(tmp_path)),
+    )
+    list(scraper.scrape_rounds(URLS[:3]))
+    scrape.rounds.clear()
+
+    rounds = list(scraper.scrape_rounds(URLS[:4]))
+
+    # Failed scrapes are not cached
+    assert scrape.rounds == [[URLS[1], URLS[3]]]
+    assert rounds[0] == (
+        [URLS[0], URLS[2]],
+        [workout(URLS[0]), workout(URLS[2])],
+    )
+    assert rounds[1] == ([URLS[1], URLS[3]], [URLS[1], workout(URLS[3])])
+
+
+def test_scrape_cache_spills_to_disk_for_the_next_process(tmp_path):
+    # Room in memory for one result, the older one is spilled
+    ScrapeCache(directory=str(tmp_path), max_memory_bytes=100).put_many(
+        {url: workout(url) for url in URLS[:2]}
+    )
+
+    cache = ScrapeCache(directory=str(tmp_path))
+
+    assert cache.get_many(URLS[:2]) == {URLS[0]: workout(URLS[0])}
+
+
+def test_scraped_file_writer_rolls_files(s3_client):
+    with scrape_events.ScrapedFileWriter(
+        s3_client=s3_client, bucket_key=BUCKET_KEY, max_file_bytes=200
+    ) as writer:
+        for url in URLS:
+            writer.write(workout(url))
+
+    assert len(writer.keys) > 1
+    assert sorted(writer.keys) == scraped_keys(s3_client)
+    assert scraped_urls(s3_client) == sorted(URLS)
+    journal_prefix = (
+        f"{transform_manifest.JOURNAL_DIR}/"
+        f"{transform_manifest.SCRAPED_JOURNAL}/"
+    )
+    journal = [
+        key[len(journal_prefix) :].split("/", 1)[1]
+        for key in s3_client.objects[s3.SHEIVA_SCRAPE_BUCKET]
+        if key.startswith(journal_prefix)
+    ]
+    assert sorted(journal) == sorted(writer.keys)
+
+
+def test_scraped_file_writer_without_workouts_writes_nothing(s3_client):
+    with scrape_events.ScrapedFileWriter(
+        s3_client=s3_client, bucket_key=BUCKET_KEY
+    ) as writer:
+        pass
+
+    assert not writer.keys
+    assert not s3_client.objects
+
+
+def test_scraped_file_writer_aborts_on_error(s3_client):
+    with pytest.raises(RuntimeError):
+        with scrape_events.ScrapedFileWriter(
+            s3_client=s3_client, bucket_key=BUCKET_KEY
+        ) as writer:
+            writer.write(workout(URLS[0]))
+            raise RuntimeError
+
+    assert not scraped_keys(s3_client)
+
+
+def test_parse_messages(s3_client, sqs_client):
+    index = url_index.ScrapedUrlIndex(s3_client=s3_client)
+    index.record(URLS[:2])
+    invalid = record("3", URLS)
+    del invalid["messageAttributes"]
+
+    event = scrape_event(
+        s3_client,
+        sqs_client,
+        [record("1", URLS[:4]), record("2", URLS[3:6]), invalid],
+        scraped_url_index=index,
+    )
+
+    assert [m["urls"] for m in event.messages] == [URLS[2:4], URLS[4:6]]
+    assert event.dead_lettered_ids == ["3"]
+    assert len(sqs_client.queues[DLQ_URL]) == 1
+
+
+def test_process(scrape, s3_client, sqs_client):
+    scrape.failing = {URLS[1]}
+    index = url_index.ScrapedUrlIndex(s3_client=s3_client)
+
+    response = scrape_event(
+        s3_client,
+        sqs_client,
+        [record("1", URLS[:3]), record("2", URLS[3:6])],
+        scraped_url_index=index,
+    ).process()
+
+    assert response == {"batchItemFailures": []}
+    assert scraped_urls(s3_client) == sorted([URLS[0]] + URLS[2:6])
+    assert queued_urls(sqs_client, DLQ_URL) == [URLS[1]]
+    assert index.contains(URLS[:6]) == [True, False, True, True, True, True]
+
+
+def test_process_retries_a_failed_message(scrape, s3_client, sqs_client):
+    scrape.failing = {URLS[0]}
+    event = scrape_event(
+        s3_client, sqs_client, [record("1", URLS[:2]), record("2", URLS[2:4])]
+    )
+    dlq = event.dlq
+    dlq.send_messages = lambda messages, **kwargs: {
+        "successful": [],
+        "failed": [
+            {"id": str(i), "code": "", "message": "", "sender_fault": False}
+            for i in range(len(messages))
+        ],
+    }
+
+    assert event.process() == {"batchItemFailures": [{"itemIdentifier": "1"}]}
+
+
+def test_process_message_error_is_retried(s3_client, sqs_client, monkeypatch):
+    event = scrape_event(
+        s3_client, sqs_client, [record("1", URLS[:2]), record("2", URLS[2:4])]
+    )
+    process_message = event.process_message
+
+    def failing_process_message(message):
+        if message["messageId"] == "2":
+            raise RuntimeError("scrape failed")
+        return process_message(message)
+
+    monkeypatch.setattr(event, "process_message", failing_process_message)
+
+    assert event.process() == {"batchItemFailures": [{"itemIdentifier": "2"}]}
+
+
+def test_process_requeues_urls_left_at_the_deadline(
+    scrape, s3_client, sqs_client
+):
+    remaining_millis = iter([60_000, 1_000])
+    deadline = scrape_events.Deadline(
+        queue=sqs.StandardSqsClient(
+            queue_url=QUEUE_URL, sqs_client=sqs_client
+        ),
+        get_remaining_time_in_millis=lambda: next(remaining_millis),
+        margin_seconds=30,
+    )
+
+    response = scrape_event(
+        s3_client,
+        sqs_client,
+        [record("1", URLS[:5])],
+        scraper=scrape_events.Scraper(html_parser=None, async_batch_size=2),
+        deadline=deadline,
+    ).process()
+
+    assert response == {"batchItemFailures": []}
+    assert scrape.rounds == [URLS[:2]]
+    assert scraped_urls(s3_client) == URLS[:2]
+    assert queued_urls(sqs_client, QUEUE_URL) == URLS[2:5]
+    message = next(iter(sqs_client.queues[QUEUE_URL].values()))
+    assert message["MessageAttributes"]["bucket_key"]["StringValue"] == (
+        BUCKET_KEY
+    )
+
+
+def test_process_retries_a_message_whose_urls_were_not_requeued(
+    s3_client, sqs_client
+):
+    queue = sqs.StandardSqsClient(queue_url=QUEUE_URL, sqs_client=sqs_client)
+    queue.send_messages = lambda messages, **kwargs: {
+        "successful": [],
+        "failed": [
+            {"id": str(i), "code": "", "message": "", "sender_fault": False}
+            for i in range(len(messages))
+        ],
+    }
+
+    response = scrape_event(
+        s3_client,
+        sqs_client,
+        [record("1", URLS[:5])],
+        deadline=scrape_events.Deadline(
+            queue=queue, get_remaining_time_in_millis=lambda: 0
+        ),
+    ).process()
+
+    assert response == {"batchItemFailures": [{"itemIdentifier": "1"}]}
@@ -0,0 +1,196 @@
+import io
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("kuda.data_pipelining.highrise.file_transformers")
+
+# pylint: disable=wrong-import-position
+from benchmarks.fakes import FakeS3Client, FakeSqsClient
+from sheiva_cloud.sheiva_aws import s3, sqs
+from sheiva_cloud.sheiva_aws.aws_lambda import transform_events
+from sheiva_cloud.sheiva_aws.s3 import object_codecs, transform_manifest
+
+DLQ_URL = "https://sqs/dlq"
+INPUT_DIR = "highrise/workout-data/male/age_16_20"
+OUTPUT_DIR = "highrise/transformed-data/male/age_16_20"
+CODEC = object_codecs.get_codec("jsonl-gzip")
+
+
+class FakeParse:
+    """
+    Stand-in for kuda's 'parse_workout_tree', flattens workouts into
+    their 'workouts' component, fails on workouts named 'fail' and
+    records the most files parsed at once.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, workouts):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(0.01)
+            if any(w["name"] == "fail" for w in workouts):
+                raise ValueError("Unparsable workout")
+            return {
+                "workouts": [
+                    {"id": w["url"], "name": w["name"], "date": "2023-01-01"}
+                    for w in workouts
+                ]
+            }
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+@pytest.fixture(name="parse")
+def fixture_parse(monkeypatch):
+    fake = FakeParse()
+    monkeypatch.setattr(transform_events, "parse_workout_tree", fake)
+    return fake
+
+
+@pytest.fixture(name="s3_client")
+def fixture_s3_client():
+    return FakeS3Client()
+
+
+@pytest.fixture(name="sqs_client")
+def fixture_sqs_client():
+    return FakeSqsClient()
+
+
+def put_scraped_file(s3_client, name, workouts):
+    key = f"{INPUT_DIR}/{name}{CODEC.key_extension}"
+    object_codecs.put_items(
+        s3_client, key, workouts, CODEC, bucket=s3.SHEIVA_SCRAPE_BUCKET
+    )
+    return key
+
+
+def make_workouts(name, count):
+    return [
+        {"url": f"https://www.highrise.app/workouts/{name}-{i}", "name": name}
+        for i in range(count)
+    ]
+
+
+def record(message_id, s3_input_file):
+    return {
+        "messageId": message_id,
+        "receiptHandle": f"receipt-{message_id}",
+        "body": "",
+        "messageAttributes": {
+            "s3_input_file": {
+                "stringValue": s3_input_file,
+                "dataType": "String",
+            },
+            "s3_output_bucket_key": {
+                "stringValue": OUTPUT_DIR,
+                "dataType": "String",
+            },
+        },
+    }
+
+
+def transform_event(s3_client, sqs_client, records, **kwargs):
+    return transform_events.HighriseWorkoutTransformEvent(
+        event={"Records": records},
+        s3_client=s3_client,
+        dlq=sqs.StandardSqsClient(queue_url=DLQ_URL, sqs_client=sqs_client),
+        **kwargs,
+    )
+
+
+def transformed_rows(s3_client, name):
+    key = f"{OUTPUT_DIR}/workouts/{name}.csv"
+    for objects in s3_client.objects.values():
+        if key in objects:
+            return pd.read_csv(io.BytesIO(objects[key])).to_dict("records")
+    return None
+
+
+def transformed_files(s3_client):
+    prefix = (
+        f"{transform_manifest.JOURNAL_DIR}/"
+        f"{transform_manifest.TRANSFORMED_JOURNAL}/"
+    )
+    return sorted(
+        key[len(prefix) :].split("/", 1)[1]
+        for key in s3_client.objects[s3.SHEIVA_SCRAPE_BUCKET]
+        if key.startswith(prefix)
+    )
+
+
+@pytest.mark.parametrize("batch_size", [None, 2])
+def test_transforms_every_record(parse, s3_client, sqs_client, batch_size):
+    names = [f"file{i}" for i in range(6)]
+    records = [
+        record(name, put_scraped_file(s3_client, name, make_workouts(name, 3)))
+        for name in names
+    ]
+    event = transform_event(
+        s3_client, sqs_client, records, batch_size=batch_size, max_workers=3
+    )
+
+    assert event.process() == {"batchItemFailures": []}
+    for name in names:
+        rows = transformed_rows(s3_client, name)
+        assert [row["id"] for row in rows] == [
+            w["url"] for w in make_workouts(name, 3)
+        ]
+    assert transformed_files(s3_client) == sorted(
+        r["messageAttributes"]["s3_input_file"]["stringValue"] for r in records
+    )
+    assert 1 < parse.max_in_flight <= 3
+
+
+def test_reports_failed_records(parse, s3_client, sqs_client):
+    # pylint: disable=unused-argument
+    records = [
+        record(
+            "ok", put_scraped_file(s3_client, "ok", make_workouts("ok", 2))
+        ),
+        record(
+            "unparsable",
+            put_scraped_file(s3_client, "bad", make_workouts("fail", 1)),
+        ),
+        record("missing", f"{INPUT_DIR}/missing{CODEC.key_extension}"),
+    ]
+
+    response = transform_event(s3_client, sqs_client, records).process()
+
+    assert sorted(
+        failure["itemIdentifier"] for failure in response["batchItemFailures"]
+    ) == ["missing", "unparsable"]
+    assert transformed_rows(s3_client, "ok") is not None
+    assert transformed_rows(s3_client, "bad") is None
+    assert transformed_files(s3_client) == [
+        records[0]["messageAttributes"]["s3_input_file"]["stringValue"]
+    ]
+
+
+def test_dead_letters_malformed_records(parse, s3_client, sqs_client):
+    # pylint: disable=unused-argument
+    malformed = record("malformed", "")
+    del malformed["messageAttributes"]["s3_output_bucket_key"]
+    records = [
+        record(
+            "ok", put_scraped_file(s3_client, "ok", make_workouts("ok", 1))
+        ),
+        malformed,
+    ]
+
+    event = transform_event(s3_client, sqs_client, records)
+
+    assert event.dead_lettered_ids == ["malformed"]
+    assert [m["messageId"] for m in event.messages] == ["ok"]
+    assert event.process() == {"batchItemFailures": []}
+    assert len(sqs_client.queues[DLQ_URL]) == 1
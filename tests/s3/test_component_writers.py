@@ -0,0 +1,123 @@
+import io
+import json
+
+import pandas as pd
+import pytest
+
+from benchmarks.fakes import FakeS3Client
+from sheiva_cloud.sheiva_aws.s3 import SHEIVA_SCRAPE_BUCKET, component_writers
+
+OUTPUT_DIR = "highrise/transformed/set_components"
+
+
+def write(output_format, batches, component="set_components"):
+    s3_client = FakeS3Client()
+    writer = component_writers.get_component_writer(
+        output_format=output_format,
+        s3_client=s3_client,
+        output_dir=OUTPUT_DIR,
+        file_name="f1",
+        component=component,
+    )
+    for batch in batches:
+        writer.write(batch)
+    writer.close()
+    return s3_client.objects.get(SHEIVA_SCRAPE_BUCKET, {})
+
+
+def read_parquet(objects):
+    pq = pytest.importorskip("pyarrow.parquet")
+    assert list(objects) == [f"{OUTPUT_DIR}/f1.parquet"]
+    return pq.read_table(io.BytesIO(objects[f"{OUTPUT_DIR}/f1.parquet"]))
+
+
+def test_conform_rows():
+    columns = component_writers.component_columns("set_components")
+    values = component_writers.conform_rows(
+        [
+            {"set_id": 1, "reps": 2.0, "weight": 3, "tempo": "slow"},
+            {"set_id": None, "reps": float("nan"), "exercise_name": "Row"},
+        ],
+        columns,
+    )
+    assert values == {
+        "set_id": ["1", None],
+        "exercise_name": [None, "Row"],
+        "reps": [2, None],
+        "weight": [3.0, None],
+        "extra": ['{"tempo": "slow"}', None],
+    }
+
+
+def test_conform_rows_rejects_values_of_another_type():
+    with pytest.raises(ValueError, match="'reps' expects int64"):
+        component_writers.conform_rows(
+            [{"reps": 1.5}],
+            component_writers.component_columns("set_components"),
+        )
+
+
+def test_parquet_keeps_the_declared_schema():
+    table = read_parquet(
+        write(
+            "parquet",
+            [
+                [{"set_id": 1, "reps": None}],
+                [{"set_id": "a", "reps": 2**60, "weight": 20}],
+                [{"set_id": "b", "reps": 3, "note": "new column"}],
+            ],
+        )
+    )
+
+    assert table.schema.names == [
+        "set_id",
+        "exercise_name",
+        "reps",
+        "weight",
+        "extra",
+    ]
+    assert [str(field.type) for field in table.schema] == [
+        "string",
+        "string",
+        "int64",
+        "double",
+        "string",
+    ]
+    assert table.column("set_id").to_pylist() == ["1", "a", "b"]
+    assert table.column("reps").to_pylist() == [None, 2**60, 3]
+    assert json.loads(table.column("extra")[2].as_py()) == {
+        "note": "new column"
+    }
+
+
+def test_parquet_undeclared_component():
+    table = read_parquet(write("parquet", [[{"a": 1}]], component="other"))
+    assert table.schema.names == ["extra"]
+    assert table.column("extra").to_pylist() == ['{"a": 1}']
+
+
+def test_parquet_empty_file_is_not_written():
+    pytest.importorskip("pyarrow")
+    assert not write("parquet", [[]])
+
+
+def test_csv_one_file_with_fixed_columns():
+    objects = write(
+        "csv",
+        [
+            [{"set_id": 1, "reps": 10}],
+            [{"set_id": 2, "reps": None, "note": "new column"}],
+        ],
+    )
+
+    assert list(objects) == [f"{OUTPUT_DIR}/f1.csv"]
+    df = pd.read_csv(io.BytesIO(objects[f"{OUTPUT_DIR}/f1.csv"]), dtype=str)
+    assert list(df.columns) == [
+        "set_id",
+        "exercise_name",
+        "reps",
+        "weight",
+        "extra",
+    ]
+    assert df["reps"].tolist()[0] == "10"
+    assert df["extra"].tolist()[1] == '{"note": "new column"}'
@@ -0,0 +1,101 @@
+import pytest
+
+from benchmarks.fakes import FakeS3Client
+from sheiva_cloud.sheiva_aws.s3 import SHEIVA_SCRAPE_BUCKET, link_store
+
+AGE_GROUP = "age_16_20"
+LINKS = [f"https://www.highrise.app/workouts/{i}" for i in range(25)]
+
+
+@pytest.fixture
+def store():
+    return link_store.LinkStore(s3_client=FakeS3Client(), gender="male")
+
+
+def claim(store, num_links):
+    links, cursor = store.read_links(AGE_GROUP, num_links=num_links)
+    store.advance(AGE_GROUP, cursor=cursor, num_links=len(links))
+    return links
+
+
+def test_write_links(store):
+    cursor = store.write_links(AGE_GROUP, LINKS, chunk_size=10)
+    assert cursor["num_chunks"] == 3
+    assert cursor["total_links"] == 25
+    assert cursor["offset"] == 0
+    assert store.load_cursor(AGE_GROUP) == cursor
+    assert [
+        store.read_chunk(AGE_GROUP, i, cursor["codec"], cursor["generation"])
+        for i in range(3)
+    ] == [LINKS[:10], LINKS[10:20], LINKS[20:]]
+    assert store.age_groups() == [AGE_GROUP]
+
+
+def test_read_links_across_chunk_boundaries(store):
+    store.write_links(AGE_GROUP, LINKS, chunk_size=10)
+
+    assert claim(store, 7) == LINKS[:7]
+    # Spans the first and second chunks
+    assert claim(store, 6) == LINKS[7:13]
+    # Spans the second and third chunks and stops at the end
+    assert claim(store, 100) == LINKS[13:]
+    assert claim(store, 10) == []
+    assert store.load_cursor(AGE_GROUP)["offset"] == 25
+
+
+def test_read_links_does_not_claim(store):
+    store.write_links(AGE_GROUP, LINKS, chunk_size=10)
+    links, _ = store.read_links(AGE_GROUP, num_links=5)
+    assert store.read_links(AGE_GROUP, num_links=5)[0] == links
+
+
+def test_advance_after_rewrite_claims_nothing(store):
+    store.write_links(AGE_GROUP, LINKS, chunk_size=10)
+    links, cursor = store.read_links(AGE_GROUP, num_links=5)
+    store.write_links(AGE_GROUP, LINKS[::-1], chunk_size=10)
+
+    current = store.advance(AGE_GROUP, cursor=cursor, num_links=len(links))
+
+    assert current["offset"] == 0
+    assert current["generation"] != cursor["generation"]
+    assert claim(store, 3) == LINKS[::-1][:3]
+
+
+def test_rewrites_keep_the_previous_generation(store):
+    generations = [
+        store.write_links(AGE_GROUP, LINKS, chunk_size=10)["generation"]
+        for _ in range(3)
+    ]
+    chunks_dir = store.chunks_dir(AGE_GROUP)
+    stored = {
+        key[len(chunks_dir) :].split("/")[0]
+        for key in store.s3_client.objects[SHEIVA_SCRAPE_BUCKET]
+        if key.startswith(chunks_dir)
+    }
+    assert stored == set(generations[1:])
+
+
+def test_load_stats(store):
+    store.write_links(AGE_GROUP, LINKS, chunk_size=10)
+    store.write_links("age_21_25", LINKS[:5], chunk_size=10)
+    claim(store, 12)
+
+    stats = store.load_stats()["age_groups"]
+
+    assert {
+        age_group: (s["total_links"], s["claimed"])
+        for age_group, s in stats.items()
+    } == {AGE_GROUP: (25, 12), "age_21_25": (5, 0)}
+
+
+def test_overlapping_claims_do_not_move_the_cursor_back(store):
+    store.write_links(AGE_GROUP, LINKS, chunk_size=10)
+    slow_links, slow_cursor = store.read_links(AGE_GROUP, num_links=5)
+    assert claim(store, 10) == LINKS[:10]
+
+    current = store.advance(
+        AGE_GROUP, cursor=slow_cursor, num_links=len(slow_links)
+    )
+
+    assert current["offset"] == 10
+    assert store.load_cursor(AGE_GROUP)["offset"] == 10
@@ -0,0 +1,151 @@
+import gzip
+import io
+
+import pytest
+
+from benchmarks.fakes import FakeS3Client
+from sheiva_cloud.sheiva_aws.s3 import object_codecs
+
+BUCKET = "bucket"
+ITEMS = [{"url": "https://example.com/1", "sets": [1, 2.5]}, "é", None]
+CODEC_NAMES = [
+    f"{layout}{compression}"
+    for layout in ("json", "jsonl")
+    for compression in ("", "-gzip", "-zstd")
+]
+
+
+class ContentEncodingS3Client(FakeS3Client):
+    """
+    Fake client that returns the 'ContentEncoding' objects were put
+    with, which 'FakeS3Client' drops.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.content_encodings = {}
+
+    def put_object(self, Bucket, Key, Body=b"", **kwargs):
+        if "ContentEncoding" in kwargs:
+            self.content_encodings[Key] = kwargs["ContentEncoding"]
+        return super().put_object(Bucket=Bucket, Key=Key, Body=Body)
+
+    def get_object(self, Bucket, Key, **kwargs):
+        response = super().get_object(Bucket=Bucket, Key=Key)
+        if Key in self.content_encodings:
+            response["ContentEncoding"] = self.content_encodings[Key]
+        return response
+
+
+@pytest.fixture(name="s3_client")
+def fixture_s3_client():
+    return ContentEncodingS3Client()
+
+
+def test_codec_names():
+    assert sorted(object_codecs.CODECS) == sorted(CODEC_NAMES)
+
+
+@pytest.mark.parametrize("name", CODEC_NAMES)
+def test_round_trip(s3_client, name):
+    codec = object_codecs.get_codec(name)
+    key = f"items{codec.key_extension}"
+    object_codecs.put_items(s3_client, key, ITEMS, codec, bucket=BUCKET)
+
+    assert object_codecs.has_codec_extension(key)
+    assert object_codecs.detect_codec(key) is codec
+    assert codec.decode(s3_client.objects[BUCKET][key]) == ITEMS
+    assert object_codecs.read_items(s3_client, key, bucket=BUCKET) == ITEMS
+    assert list(object_codecs.iter_items(s3_client, key, BUCKET)) == ITEMS
+
+
+@pytest.mark.parametrize("name", CODEC_NAMES)
+def test_item_writer_round_trip(s3_client, name):
+    codec = object_codecs.get_codec(name)
+    key = f"items{codec.key_extension}"
+    with object_codecs.ItemWriter(s3_client, key, codec, BUCKET) as writer:
+        for item in ITEMS:
+            writer.write(item)
+
+    assert writer.num_items == len(ITEMS)
+    assert writer.bytes_written == len(codec.serialise(ITEMS)) - len(
+        codec.prefix + codec.suffix
+    )
+    assert object_codecs.read_items(s3_client, key, bucket=BUCKET) == ITEMS
+    assert list(object_codecs.iter_items(s3_client, key, BUCKET)) == ITEMS
+
+
+def test_item_writer_abort_writes_nothing(s3_client):
+    codec = object_codecs.get_codec("jsonl-gzip")
+    with pytest.raises(RuntimeError):
+        with object_codecs.ItemWriter(
+            s3_client, "items.jsonl.gz", codec, BUCKET
+        ) as writer:
+            writer.write(ITEMS[0])
+            raise RuntimeError("failed")
+
+    assert "items.jsonl.gz" not in s3_client.objects.get(BUCKET, {})
+
+
+@pytest.mark.parametrize("name", CODEC_NAMES)
+def test_content_encoding_detection(s3_client, name):
+    # Keys without the compression extension are read by their
+    # 'ContentEncoding'
+    codec = object_codecs.get_codec(name)
+    key = f"items{codec.extension}"
+    object_codecs.put_items(s3_client, key, ITEMS, codec, bucket=BUCKET)
+
+    assert object_codecs.read_items(s3_client, key, bucket=BUCKET) == ITEMS
+    assert list(object_codecs.iter_items(s3_client, key, BUCKET)) == ITEMS
+
+
+@pytest.mark.parametrize(
+    "key, content_encoding, expected",
+    [
+        ("items.json", None, "json"),
+        ("items.json", "gzip", "json-gzip"),
+        ("items.json", "zstd", "json-zstd"),
+        ("items.json", "br", "json"),
+        ("items.jsonl", None, "jsonl"),
+        ("items.jsonl", "gzip", "jsonl-gzip"),
+        ("items.json.gz", None, "json-gzip"),
+        ("items.jsonl.zst", None, "jsonl-zstd"),
+        # The key extension wins over the 'ContentEncoding'
+        ("items.jsonl.gz", "zstd", "jsonl-gzip"),
+        ("items", None, "json"),
+    ],
+)
+def test_detect_codec(key, content_encoding, expected):
+    codec = object_codecs.detect_codec(key, content_encoding)
+    assert codec.name == expected
+
+
+def test_reads_pretty_printed_json_arrays(s3_client):
+    s3_client.put_object(
+        Bucket=BUCKET, Key="legacy.json", Body=b'[\n  {"a": 1},\n  2\n]\n'
+    )
+
+    assert object_codecs.read_items(s3_client, "legacy.json", BUCKET) == [
+        {"a": 1},
+        2,
+    ]
+    assert list(
+        object_codecs.iter_items(s3_client, "legacy.json", BUCKET)
+    ) == [{"a": 1}, 2]
+
+
+def test_open_object(s3_client):
+    s3_client.put_object(
+        Bucket=BUCKET,
+        Key="links.csv",
+        Body=gzip.compress(b"url\nhttps://example.com\n"),
+        ContentEncoding="gzip",
+    )
+
+    with object_codecs.open_object(s3_client, "links.csv", BUCKET) as stream:
+        assert io.TextIOWrapper(stream).read() == "url\nhttps://example.com\n"
+
+
+def test_get_codec_unsupported():
+    with pytest.raises(ValueError):
+        object_codecs.get_codec("xml")
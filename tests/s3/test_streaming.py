@@ -0,0 +1,50 @@
+import io
+import json
+
+import pytest
+
+from sheiva_cloud.sheiva_aws.s3 import streaming
+
+
+def items(data, chunk_size=streaming.READ_CHUNK_SIZE):
+    return list(
+        streaming.iter_json_array(
+            io.BytesIO(data.encode("utf-8")), chunk_size=chunk_size
+        )
+    )
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, streaming.READ_CHUNK_SIZE])
+def test_iter_json_array(chunk_size):
+    array = [1, -2.5e3, "a, ]", {"b": [1, {}]}, [], None, True, "é"]
+    data = json.dumps(array, indent=2, ensure_ascii=False)
+    assert items(data, chunk_size) == array
+
+
+@pytest.mark.parametrize("data", ["[]", " [ ] ", "\n[\n]\n"])
+def test_iter_json_array_empty(data):
+    assert items(data) == []
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, streaming.READ_CHUNK_SIZE])
+@pytest.mark.parametrize(
+    "data",
+    [
+        "",
+        "{}",
+        "[1 2]",
+        "[1,,2]",
+        "[,1]",
+        "[1,]",
+        "[1, 2",
+        "[1, 2,",
+        '[{"a": 1}',
+        '[{"a": 1',
+        "[1] [2]",
+        "[1]]",
+        "[tru]",
+    ],
+)
+def test_iter_json_array_malformed(data, chunk_size):
+    with pytest.raises(ValueError):
+        items(data, chunk_size)
@@ -0,0 +1,86 @@
+import gzip
+import json
+
+from benchmarks.fakes import FakeS3Client
+from sheiva_cloud.sheiva_aws.s3 import SHEIVA_SCRAPE_BUCKET, transform_manifest
+
+SCRAPED = [f"highrise/workout-data/male/age_16_20/{i}.json" for i in range(3)]
+
+
+def journal_keys(s3_client):
+    return [
+        key
+        for key in s3_client.objects.get(SHEIVA_SCRAPE_BUCKET, {})
+        if key.startswith(transform_manifest.JOURNAL_DIR)
+    ]
+
+
+def test_from_listings():
+    manifest = transform_manifest.TransformManifest.from_listings(
+        scraped_files=SCRAPED,
+        transformed_files=["highrise/transformed/workouts/1.parquet"],
+    )
+    assert manifest.candidates() == [SCRAPED[0], SCRAPED[2]]
+
+
+def test_sync_folds_the_journal():
+    s3_client = FakeS3Client()
+    for key in SCRAPED:
+        transform_manifest.record_scraped_file(s3_client=s3_client, key=key)
+    transform_manifest.record_transformed_file(
+        s3_client=s3_client, key=SCRAPED[1]
+    )
+    manifest = transform_manifest.TransformManifest(set(), set())
+
+    manifest.sync(s3_client)
+
+    assert manifest.candidates() == [SCRAPED[0], SCRAPED[2]]
+
+
+def test_prune_journal_keeps_unsettled_entries():
+    s3_client = FakeS3Client()
+    transform_manifest.record_scraped_file(s3_client=s3_client, key=SCRAPED[0])
+    manifest = transform_manifest.TransformManifest(set(), set())
+    manifest.sync(s3_client)
+
+    assert manifest.prune_journal(s3_client) == 0
+    assert len(journal_keys(s3_client)) == 1
+
+
+def test_prune_journal_deletes_settled_entries(monkeypatch):
+    monkeypatch.setattr(transform_manifest, "JOURNAL_SETTLE_SECONDS", 0)
+    s3_client = FakeS3Client()
+    for key in SCRAPED:
+        transform_manifest.record_scraped_file(s3_client=s3_client, key=key)
+    manifest = transform_manifest.TransformManifest(set(), set())
+    manifest.sync(s3_client)
+    manifest.save(s3_client)
+
+    assert manifest.prune_journal(s3_client) == 3
+    assert not journal_keys(s3_client)
+    loaded = transform_manifest.TransformManifest.load(s3_client)
+    assert loaded is not None
+    assert loaded.candidates() == SCRAPED
+
+
+def test_load_ignores_unknown_fields():
+    s3_client = FakeS3Client()
+    s3_client.put_object(
+        Bucket=SHEIVA_SCRAPE_BUCKET,
+        Key=transform_manifest.MANIFEST_KEY,
+        Body=gzip.compress(
+            json.dumps(
+                {
+                    "version": transform_manifest.MANIFEST_VERSION,
+                    "watermarks": {},
+                    "scraped": SCRAPED,
+                    "transformed": SCRAPED[:1],
+                }
+            ).encode("utf-8")
+        ),
+    )
+
+    manifest = transform_manifest.TransformManifest.load(s3_client)
+
+    assert manifest is not None
+    assert manifest.candidates() == SCRAPED[1:]
@@ -0,0 +1,143 @@
+import json
+
+import pytest
+
+from benchmarks.fakes import FakeS3Client
+from sheiva_cloud.sheiva_aws.s3 import SHEIVA_SCRAPE_BUCKET, url_index
+
+URLS = [f"https://www.highrise.app/workouts/{i}" for i in range(500)]
+NEW_URLS = [f"https://www.highrise.app/workouts/new-{i}" for i in range(100)]
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    yield
+    url_index._deltas.clear()
+    url_index._generations.clear()
+    url_index._shards.clear()
+
+
+@pytest.fixture
+def s3_client():
+    return FakeS3Client()
+
+
+def new_index(s3_client):
+    return url_index.ScrapedUrlIndex(s3_client=s3_client, capacity=10_000)
+
+
+def keys(s3_client, prefix):
+    return sorted(
+        key
+        for key in s3_client.objects.get(SHEIVA_SCRAPE_BUCKET, {})
+        if key.startswith(prefix)
+    )
+
+
+def record_keys(s3_client, method):
+    """
+    Records the key of every call of a method of the client.
+    """
+
+    called_keys = []
+    call = getattr(s3_client, method)
+
+    def recording_call(**kwargs):
+        called_keys.append(kwargs["Key"])
+        return call(**kwargs)
+
+    setattr(s3_client, method, recording_call)
+    return called_keys
+
+
+def test_add_and_contains(s3_client):
+    index = new_index(s3_client)
+    index.add(URLS)
+    assert index.save(owner="male") == 1
+
+    assert all(index.contains(URLS))
+    # False positives are rare at this size
+    assert sum(index.contains(NEW_URLS)) <= 2
+    assert not any(new_index(FakeS3Client()).contains(URLS))
+
+
+def test_record_and_compact(s3_client):
+    index = new_index(s3_client)
+    index.add(URLS)
+    index.save(owner="male")
+
+    delta_key = index.record(NEW_URLS + NEW_URLS[:10])
+    assert index.record([]) is None
+    assert keys(s3_client, url_index.DELTA_DIR) == [delta_key]
+    assert all(index.contains(NEW_URLS))
+
+    assert index.compact(owner="male") == 1
+    assert keys(s3_client, url_index.DELTA_DIR) == []
+    assert index.compact(owner="male") == 0
+    generation = json.loads(
+        s3_client.objects[SHEIVA_SCRAPE_BUCKET][index.generation_key("male")]
+    )
+    assert generation == {
+        "generation": 2,
+        "folded": {"1": [], "2": [delta_key]},
+    }
+    assert all(index.contains(URLS + NEW_URLS))
+    assert index.filter_unscraped([NEW_URLS[0], "a", "b", "a"]) == ["a", "b"]
+
+
+def test_shards_of_every_owner_are_checked(s3_client):
+    index = new_index(s3_client)
+    index.add(URLS[:250])
+    index.save(owner="male")
+    index.add(URLS[250:])
+    index.save(owner="female")
+    assert all(index.contains(URLS))
+
+
+def test_compact_only_writes_changed_shards(s3_client):
+    index = new_index(s3_client)
+    index.add(URLS)
+    index.save(owner="male")
+    puts = record_keys(s3_client, "put_object")
+
+    index.record(URLS[:10])
+    index.compact(owner="male")
+
+    # The urls were already in the shards, only the generation changed
+    assert [key for key in puts if key.startswith(index.layout_dir)] == [
+        index.generation_key("male")
+    ]
+
+
+def test_warm_reader_applies_compactions_without_refetching(s3_client):
+    writer = new_index(s3_client)
+    writer.add(URLS)
+    writer.save(owner="male")
+    reader = new_index(s3_client)
+    assert all(reader.contains(URLS))
+
+    # The reader loads the delta before it is compacted
+    writer.record(NEW_URLS)
+    assert all(reader.contains(NEW_URLS))
+    writer.compact(owner="male")
+
+    gets = record_keys(s3_client, "get_object")
+    assert all(reader.contains(URLS + NEW_URLS))
+    assert gets == [writer.generation_key("male")]
+
+
+def test_reader_that_missed_a_delta_refetches(s3_client):
+    writer = new_index(s3_client)
+    writer.add(URLS)
+    writer.save(owner="male")
+    reader = new_index(s3_client)
+    reader.contains(URLS)
+
+    writer.record(NEW_URLS)
+    writer.compact(owner="male")
+    # As if the delta was compacted by another process
+    url_index._deltas.clear()
+
+    gets = record_keys(s3_client, "get_object")
+    assert all(reader.contains(NEW_URLS))
+    assert any(key.endswith(".bin") for key in gets)
@@ -0,0 +1,149 @@
+import pytest
+
+from benchmarks.fakes import FakeS3Client
+from sheiva_cloud.sheiva_aws.s3 import (
+    SHEIVA_SCRAPE_BUCKET,
+    object_codecs,
+    validation,
+)
+
+PREFIX = f"{validation.SCRAPED_WORKOUTS_DIR}/male"
+CODEC = object_codecs.get_codec("jsonl-gzip")
+
+
+def workout(url, exercise_name="Squat"):
+    return {
+        "url": url,
+        "workout_components": [
+            {
+                "name": "Strength",
+                "sets": [
+                    {
+                        "name": "Set 1",
+                        "set_components": [{"exercise_name": exercise_name}],
+                    }
+                ],
+            }
+        ],
+    }
+
+
+@pytest.fixture(name="s3_client")
+def fixture_s3_client():
+    return FakeS3Client()
+
+
+def put_file(s3_client, age_group, name, workouts, codec=CODEC):
+    key = f"{PREFIX}/{age_group}/{name}{codec.key_extension}"
+    object_codecs.put_items(
+        s3_client, key, workouts, codec, bucket=SHEIVA_SCRAPE_BUCKET
+    )
+    return key
+
+
+def test_validate_workout_valid():
+    assert not list(validation.validate_workout(workout("a")))
+
+
+@pytest.mark.parametrize(
+    "tree, issue, detail",
+    [
+        ({"workout_components": []}, validation.NO_WORKOUT_COMPONENTS, ""),
+        (
+            {"workout_components": [{"name": "Core", "sets": []}]},
+            validation.NO_SETS,
+            "Core",
+        ),
+        (
+            {
+                "workout_components": [
+                    {"name": "Core", "sets": [{"name": "Set 1"}]}
+                ]
+            },
+            validation.NO_SET_COMPONENTS,
+            "Core/Set 1",
+        ),
+        (
+            workout("", exercise_name=""),
+            validation.INVALID_EXERCISE_NAME,
+            "Strength/Set 1",
+        ),
+    ],
+)
+def test_validate_workout_issues(tree, issue, detail):
+    issues = list(validation.validate_workout({**tree, "url": "a"}))
+    assert issues == [{"url": "a", "issue": issue, "detail": detail}]
+
+
+def test_validate_counts_per_age_group(s3_client):
+    put_file(s3_client, "age_16_20", "1", [workout("a"), workout("b")])
+    put_file(
+        s3_client,
+        "age_16_20",
+        "2",
+        [workout("b"), workout("c", exercise_name=None)],
+        codec=object_codecs.get_codec("json"),
+    )
+    put_file(s3_client, "age_21_25", "3", [workout("a"), workout("d")])
+    # Not a scraped file
+    s3_client.put_object(
+        Bucket=SHEIVA_SCRAPE_BUCKET, Key=f"{PREFIX}/age_21_25/notes.txt"
+    )
+
+    report = validation.validate(s3_client, PREFIX, max_workers=2)
+
+    assert report["files"] == 3
+    assert report["workouts"] == 6
+    assert report["unique_workouts"] == 4
+    assert report["duplicates"] == 2
+    assert report["cross_age_group_duplicates"] == 1
+    assert sorted(report["duplicate_samples"]) == ["a", "b"]
+    assert report["issues"] == {validation.INVALID_EXERCISE_NAME: 1}
+    assert report["issue_samples"][0]["url"] == "c"
+    assert report["age_groups"]["age_16_20"] == {
+        "files": 2,
+        "workouts": 4,
+        "duplicates": 1,
+        "issues": {validation.INVALID_EXERCISE_NAME: 1},
+    }
+    assert report["age_groups"]["age_21_25"]["duplicates"] == 1
+    assert report["failed_files"] == []
+
+
+def test_validate_reports_failed_files(s3_client):
+    put_file(s3_client, "age_16_20", "1", [workout("a")])
+    s3_client.put_object(
+        Bucket=SHEIVA_SCRAPE_BUCKET,
+        Key=f"{PREFIX}/age_16_20/2.jsonl",
+        Body=b"{not json\n",
+    )
+
+    report = validation.validate(s3_client, PREFIX)
+
+    assert report["files"] == 1
+    assert report["workouts"] == 1
+    assert [f["key"] for f in report["failed_files"]] == [
+        f"{PREFIX}/age_16_20/2.jsonl"
+    ]
+
+
+def test_validate_given_keys(s3_client):
+    key = put_file(s3_client, "age_16_20", "1", [workout("a")])
+    put_file(s3_client, "age_16_20", "2", [workout("b")])
+
+    report = validation.validate(s3_client, PREFIX, keys=[key])
+
+    assert report["files"] == 1
+    assert report["unique_workouts"] == 1
+
+
+def test_validate_bounds_files_in_flight(s3_client):
+    # More files than 2 * max_workers are scanned in bounded rounds
+    for i in range(20):
+        put_file(s3_client, "age_16_20", str(i), [workout(str(i % 15))])
+
+    report = validation.validate(s3_client, PREFIX, max_workers=2)
+
+    assert report["files"] == 20
+    assert report["duplicates"] == 5
+    assert report["unique_workouts"] == 15
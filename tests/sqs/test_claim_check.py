@@ -0,0 +1,177 @@
+import json
+
+import pytest
+
+from benchmarks.fakes import FakeS3Client, FakeSqsClient
+from sheiva_cloud.sheiva_aws.sqs import claim_check, message_parsers, utils
+from sheiva_cloud.sheiva_aws.sqs.clients.standard import StandardClient
+
+BUCKET = "claim-check-bucket"
+DLQ_URL = "https://sqs/dlq"
+
+
+def received(message):
+    """
+    The record a Lambda receives for a sent message.
+    """
+
+    return {
+        "messageId": "1",
+        "receiptHandle": "r",
+        "body": message["message_body"],
+        "messageAttributes": {
+            name: {
+                "stringValue": attribute["StringValue"],
+                "dataType": attribute["DataType"],
+            }
+            for name, attribute in message["message_attributes"].items()
+        },
+    }
+
+
+def test_message_size_counts_body_and_attributes():
+    message = {
+        "message_body": "é" * 10,
+        "message_attributes": {
+            "key": {"DataType": "String", "StringValue": "value"}
+        },
+    }
+    assert claim_check.message_size(message) == 20 + 3 + 6 + 5
+
+
+def test_offload_and_resolve():
+    s3_client = FakeS3Client()
+    message = {
+        "message_body": "x" * (claim_check.MAX_MESSAGE_BYTES + 1),
+        "message_attributes": {
+            "bucket_key": {"DataType": "String", "StringValue": "a/b"}
+        },
+    }
+
+    offloaded = claim_check.offload(
+        message, s3_client=s3_client, bucket=BUCKET
+    )
+    uri = offloaded["message_body"]
+    assert uri.startswith(f"s3://{BUCKET}/{claim_check.CLAIM_CHECK_PREFIX}/")
+    assert offloaded["message_attributes"] == {
+        claim_check.CLAIM_CHECK_ATTRIBUTE: {
+            "DataType": "String",
+            "StringValue": uri,
+        }
+    }
+    assert claim_check.message_size(offloaded) < 1024
+    [key] = s3_client.objects[BUCKET]
+    assert json.loads(s3_client.objects[BUCKET][key])["body"] == (
+        message["message_body"]
+    )
+
+    resolved = claim_check.resolve(received(offloaded), s3_client=s3_client)
+    assert resolved == received(message)
+
+
+def test_resolve_passes_through_unchecked_messages():
+    s3_client = FakeS3Client()
+    message = received({"message_body": "body", "message_attributes": {}})
+    assert claim_check.resolve(message, s3_client=s3_client) is message
+    assert s3_client.stats.snapshot()["calls"] == {}
+
+
+def test_resolve_missing_payload():
+    s3_client = FakeS3Client()
+    offloaded = claim_check.offload(
+        {"message_body": "body", "message_attributes": {}},
+        s3_client=s3_client,
+        bucket=BUCKET,
+    )
+    s3_client.objects.clear()
+    with pytest.raises(claim_check.ClaimCheckError):
+        claim_check.resolve(received(offloaded), s3_client=s3_client)
+
+
+def scrape_records(s3_client, num_urls):
+    """
+    Records of a plain and a claim-checked scrape message.
+    """
+
+    messages = [
+        {
+            "message_body": message_parsers.encode_urls(
+                [
+                    f"https://www.highrise.app/workouts/{i}"
+                    for i in range(num_urls)
+                ]
+            ),
+            "message_attributes": {
+                "bucket_key": {"DataType": "String", "StringValue": "a/b"}
+            },
+        }
+        for _ in range(2)
+    ]
+    messages[1] = claim_check.offload(
+        messages[1], s3_client=s3_client, bucket=BUCKET
+    )
+    records = [received(message) for message in messages]
+    records[1]["messageId"] = "2"
+    return records
+
+
+def test_missing_payload_is_a_parse_error():
+    s3_client = FakeS3Client()
+    _, offloaded = scrape_records(s3_client, 1)
+    s3_client.objects.clear()
+
+    with pytest.raises(message_parsers.MessageParseError):
+        message_parsers.scrape_message_parser(offloaded, s3_client=s3_client)
+
+
+def test_missing_payload_is_dead_lettered():
+    s3_client = FakeS3Client()
+    sqs_client = FakeSqsClient()
+    records = scrape_records(s3_client, 3)
+    s3_client.objects.clear()
+
+    messages, dead_lettered_ids = utils.parse_sqs_event(
+        sqs_event={"Records": records},
+        parse_function=lambda message: message_parsers.scrape_message_parser(
+            message, s3_client=s3_client
+        ),
+        dlq=StandardClient(queue_url=DLQ_URL, sqs_client=sqs_client),
+    )
+
+    assert [m["messageId"] for m in messages] == ["1"]
+    assert len(messages[0]["urls"]) == 3
+    assert dead_lettered_ids == ["2"]
+    [dead_letter] = sqs_client.queues[DLQ_URL].values()
+    # The record is dead-lettered unchanged but for the parse error
+    assert dead_letter["Body"] == records[1]["body"]
+    attributes = dead_letter["MessageAttributes"]
+    assert claim_check.CLAIM_CHECK_ATTRIBUTE in attributes
+    assert "Missing claim-check payload" in (
+        attributes["parse_error"]["StringValue"]
+    )
+
+
+def test_unreadable_payload_is_retried():
+    class FailingS3Client(FakeS3Client):
+        """
+        S3 client whose reads always fail.
+        """
+
+        def get_object(self, Bucket, Key, **kwargs):
+            raise ConnectionError("Connection reset")
+
+    s3_client = FailingS3Client()
+    sqs_client = FakeSqsClient()
+    records = scrape_records(s3_client, 1)
+
+    messages, dead_lettered_ids = utils.parse_sqs_event(
+        sqs_event={"Records": records},
+        parse_function=lambda message: message_parsers.scrape_message_parser(
+            message, s3_client=s3_client
+        ),
+        dlq=StandardClient(queue_url=DLQ_URL, sqs_client=sqs_client),
+    )
+
+    assert [m["messageId"] for m in messages] == ["1"]
+    assert not dead_lettered_ids
+    assert not sqs_client.queues.get(DLQ_URL)
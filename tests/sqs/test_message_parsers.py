@@ -0,0 +1,129 @@
+import base64
+import json
+import random
+import string
+import zlib
+
+import pytest
+
+from sheiva_cloud.sheiva_aws.sqs import message_parsers
+from sheiva_cloud.sheiva_aws.sqs.message_parsers import (
+    COMPRESSED_MARKER,
+    MessageParseError,
+    decode_urls,
+    encode_urls,
+    pack_urls,
+)
+
+
+def workout_urls(num_urls: int, seed: int = 0):
+    rnd = random.Random(seed)
+    return [
+        "https://www.highrise.app/workouts/"
+        + "".join(rnd.choices(string.hexdigits, k=36))
+        for _ in range(num_urls)
+    ]
+
+
+@pytest.mark.parametrize("encoding", message_parsers.URL_ENCODINGS)
+def test_encode_decode_round_trip(encoding):
+    urls = workout_urls(100) + ["https://other.app/a/b", "https://x/"]
+    assert decode_urls(encode_urls(urls, encoding)) == urls
+
+
+def test_v1_stores_each_prefix_once():
+    urls = workout_urls(3)
+    body = json.loads(encode_urls(urls, "v1"))
+    assert body["p"] == ["https://www.highrise.app/workouts/"]
+    assert "i" not in body
+    assert [body["p"][0] + url_id for url_id in body["u"]] == urls
+
+
+def test_zlib_body_is_compressed_v1():
+    urls = workout_urls(50)
+    body = encode_urls(urls, "v1-zlib")
+    assert body.startswith(COMPRESSED_MARKER)
+    decompressed = zlib.decompress(
+        base64.b64decode(body[len(COMPRESSED_MARKER) :])
+    )
+    assert decompressed.decode() == encode_urls(urls, "v1")
+    assert len(body) < len(encode_urls(urls, "v1"))
+
+
+def test_decodes_plain_json_list():
+    assert decode_urls(json.dumps(["https://x/1"])) == ["https://x/1"]
+
+
+def test_unknown_encoding():
+    with pytest.raises(ValueError):
+        encode_urls(["https://x/1"], "gzip")
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        "not json",
+        "{}",
+        '{"v": 2, "p": ["https://x/"], "u": ["1"]}',
+        '{"v": 1, "p": "https://x/", "u": ["1"]}',
+        '{"v": 1, "p": ["https://x/"], "u": ["1"], "i": [1]}',
+        '{"v": 1, "p": ["https://x/"], "u": ["1", "2"], "i": [0]}',
+        '["https://x/1", 2]',
+        '[""]',
+        "3",
+        f"{COMPRESSED_MARKER}not base64!",
+        f"{COMPRESSED_MARKER}{base64.b64encode(b'not zlib').decode()}",
+    ],
+)
+def test_invalid_bodies(body):
+    with pytest.raises(MessageParseError):
+        decode_urls(body)
+
+
+def test_truncated_compressed_body():
+    body = encode_urls(workout_urls(50), "v1-zlib")
+    with pytest.raises(MessageParseError):
+        decode_urls(body[: len(body) // 2 // 4 * 4])
+
+
+def test_decompressed_size_is_bounded(monkeypatch):
+    body = encode_urls(workout_urls(50), "v1-zlib")
+    monkeypatch.setattr(message_parsers, "MAX_DECOMPRESSED_BYTES", 100)
+    with pytest.raises(MessageParseError):
+        decode_urls(body)
+
+
+@pytest.mark.parametrize("encoding", message_parsers.URL_ENCODINGS)
+def test_pack_urls_fills_bodies_up_to_max_bytes(encoding):
+    urls = workout_urls(5000)
+    max_bytes = 20_000
+    packed = pack_urls(urls, max_bytes=max_bytes, encoding=encoding)
+
+    assert len(packed) > 1
+    assert [url for batch, _ in packed for url in batch] == urls
+    start = 0
+    for batch, body in packed:
+        assert body == encode_urls(batch, encoding)
+        assert len(body.encode("utf-8")) <= max_bytes
+        end = start + len(batch)
+        if end < len(urls):
+            # One more url would not have fit
+            assert (
+                len(encode_urls(urls[start : end + 1], encoding)) > max_bytes
+            )
+        start = end
+
+
+def test_pack_urls_max_urls():
+    packed = pack_urls(workout_urls(25), max_urls=10)
+    assert [len(batch) for batch, _ in packed] == [10, 10, 5]
+
+
+def test_pack_urls_oversized_url_gets_its_own_body():
+    urls = ["https://x/" + "a" * 500, "https://x/1"]
+    packed = pack_urls(urls, max_bytes=100)
+    assert [batch for batch, _ in packed] == [[urls[0]], [urls[1]]]
+
+
+def test_pack_urls_empty():
+    assert pack_urls([]) == []
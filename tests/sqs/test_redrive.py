@@ -0,0 +1,120 @@
+import json
+
+from benchmarks.fakes import FakeSqsClient
+from sheiva_cloud.sheiva_aws.sqs import redrive
+from sheiva_cloud.sheiva_aws.sqs.clients.standard import StandardClient
+
+DLQ_URL = "https://sqs/dlq"
+TARGET_URL = "https://sqs/target"
+
+
+def write_lines(path, records, tail=""):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+        f.write(tail)
+
+
+def test_load_missing_checkpoint(tmp_path):
+    checkpoint = redrive.RedriveCheckpoint(str(tmp_path / "redrive.jsonl"))
+    assert checkpoint.load() == set()
+
+
+def test_load_pending_messages(tmp_path):
+    path = tmp_path / "redrive.jsonl"
+    write_lines(
+        path,
+        [
+            {"event": redrive.SENT, "message_id": "a", "body": "1"},
+            {"event": redrive.SENT, "message_id": "b", "body": "2"},
+            {"event": redrive.DELETED, "message_id": "a"},
+        ],
+    )
+    assert redrive.RedriveCheckpoint(str(path)).load() == {"b"}
+
+
+def test_load_skips_truncated_last_line(tmp_path):
+    path = tmp_path / "redrive.jsonl"
+    write_lines(
+        path,
+        [{"event": redrive.SENT, "message_id": "a", "body": "1"}],
+        tail='{"event":"deleted","message_',
+    )
+    assert redrive.RedriveCheckpoint(str(path)).load() == {"a"}
+
+
+def test_append_after_truncated_line(tmp_path):
+    path = tmp_path / "redrive.jsonl"
+    write_lines(path, [], tail='{"event":"sent","mess')
+    checkpoint = redrive.RedriveCheckpoint(str(path))
+    checkpoint.open()
+    checkpoint.append([{"event": redrive.SENT, "message_id": "a"}])
+    checkpoint.close()
+    assert checkpoint.load() == {"a"}
+
+
+def make_redrive(sqs_client, path):
+    return redrive.Redrive(
+        dlq=StandardClient(DLQ_URL, sqs_client),
+        target_queue=StandardClient(TARGET_URL, sqs_client),
+        checkpoint=redrive.RedriveCheckpoint(str(path)),
+        receivers=1,
+    )
+
+
+def send_to_dlq(sqs_client, bodies):
+    return [
+        sqs_client.send_message(QueueUrl=DLQ_URL, MessageBody=body)[
+            "MessageId"
+        ]
+        for body in bodies
+    ]
+
+
+def test_run(tmp_path):
+    sqs_client = FakeSqsClient()
+    bodies = [f"message {i}" for i in range(15)]
+    send_to_dlq(sqs_client, bodies)
+
+    stats = make_redrive(sqs_client, tmp_path / "redrive.jsonl").run()
+
+    assert stats == {
+        "received": 15,
+        "sent": 15,
+        "deleted": 15,
+        "skipped": 0,
+        "failed": 0,
+    }
+    assert not sqs_client.queues[DLQ_URL]
+    assert sorted(
+        m["Body"] for m in sqs_client.queues[TARGET_URL].values()
+    ) == sorted(bodies)
+    assert redrive.RedriveCheckpoint(
+        str(tmp_path / "redrive.jsonl")
+    ).load() == (set())
+
+
+def test_run_does_not_resend_checkpointed_messages(tmp_path):
+    sqs_client = FakeSqsClient()
+    message_ids = send_to_dlq(sqs_client, ["sent", "not sent"])
+    path = tmp_path / "redrive.jsonl"
+    write_lines(
+        path,
+        [
+            {
+                "event": redrive.SENT,
+                "message_id": message_ids[0],
+                "body": "sent",
+            }
+        ],
+        tail='{"event":"deleted"',
+    )
+
+    stats = make_redrive(sqs_client, path).run()
+
+    assert (stats["received"], stats["sent"], stats["skipped"]) == (2, 1, 1)
+    assert stats["deleted"] == 2
+    assert [m["Body"] for m in sqs_client.queues[TARGET_URL].values()] == [
+        "not sent"
+    ]
+    assert not sqs_client.queues[DLQ_URL]
@@ -0,0 +1,240 @@
+import pytest
+
+from benchmarks.fakes import FakeS3Client, FakeSqsClient
+from sheiva_cloud.sheiva_aws.sqs import claim_check
+from sheiva_cloud.sheiva_aws.sqs.clients import standard
+from sheiva_cloud.sheiva_aws.sqs.clients.standard import (
+    MAX_BATCH_SIZE,
+    StandardClient,
+)
+
+QUEUE_URL = "https://sqs/queue"
+
+
+class FlakySqsClient(FakeSqsClient):
+    """
+    Fake client whose batch requests fail the entries in 'failures'
+    the first times they are sent. Each failure is a
+    '(times, sender_fault)' tuple, 'times' of None fails them forever.
+    """
+
+    def __init__(self, failures=None, errors=0):
+        super().__init__()
+        self.failures = failures or {}
+        # Number of batch requests that raise before any succeeds
+        self.errors = errors
+        self.attempts = {}
+
+    def _split(self, batch):
+        if self.errors:
+            self.errors -= 1
+            raise ConnectionError("Connection reset")
+        succeeded, failed = [], []
+        for entry in batch:
+            attempt = self.attempts.get(entry["Id"], 0)
+            self.attempts[entry["Id"]] = attempt + 1
+            times, sender_fault = self.failures.get(entry["Id"], (0, False))
+            if times is None or attempt < times:
+                failed.append(
+                    {
+                        "Id": entry["Id"],
+                        "Code": "InternalError",
+                        "Message": "failed",
+                        "SenderFault": sender_fault,
+                    }
+                )
+            else:
+                succeeded.append(entry)
+        return succeeded, failed
+
+    def send_message_batch(self, QueueUrl, Entries):
+        succeeded, failed = self._split(Entries)
+        response = super().send_message_batch(QueueUrl, succeeded)
+        return {**response, "Failed": failed}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        succeeded, failed = self._split(Entries)
+        response = super().delete_message_batch(QueueUrl, succeeded)
+        return {**response, "Failed": failed}
+
+
+@pytest.fixture(autouse=True)
+def fixture_no_backoff(monkeypatch):
+    monkeypatch.setattr(standard.time, "sleep", lambda seconds: None)
+
+
+def numbered_messages(count):
+    return [
+        {"message_body": str(i), "message_attributes": {}}
+        for i in range(count)
+    ]
+
+
+def entries(sizes):
+    return [{"Id": str(i), "Size": size} for i, size in enumerate(sizes)]
+
+
+def test_chunk_entries_at_most_ten_entries():
+    chunks = standard._chunk_entries(entries([1] * 25))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    assert [e["Id"] for chunk in chunks for e in chunk] == [
+        str(i) for i in range(25)
+    ]
+
+
+def test_chunk_entries_at_most_max_message_bytes():
+    quarter = claim_check.MAX_MESSAGE_BYTES // 4
+    chunks = standard._chunk_entries(entries([quarter] * 4 + [1, quarter]))
+    assert [len(chunk) for chunk in chunks] == [4, 2]
+    assert all(
+        sum(e["Size"] for e in chunk) <= claim_check.MAX_MESSAGE_BYTES
+        for chunk in chunks
+    )
+
+
+def test_chunk_entries_oversized_entry_is_alone():
+    chunks = standard._chunk_entries(
+        entries([1, claim_check.MAX_MESSAGE_BYTES + 1, 1])
+    )
+    assert [len(chunk) for chunk in chunks] == [1, 1, 1]
+
+
+def test_chunk_entries_without_sizes():
+    chunks = standard._chunk_entries([{"Id": str(i)} for i in range(11)])
+    assert [len(chunk) for chunk in chunks] == [MAX_BATCH_SIZE, 1]
+
+
+def test_send_messages_claim_checks_oversized_messages():
+    s3_client = FakeS3Client()
+    sqs_client = FakeSqsClient()
+    queue = StandardClient(
+        queue_url=QUEUE_URL,
+        sqs_client=sqs_client,
+        s3_client=s3_client,
+        claim_check_bucket="bucket",
+    )
+    messages = [
+        {"message_body": "x" * 100_000, "message_attributes": {}}
+        for _ in range(5)
+    ] + [
+        {
+            "message_body": "y" * (claim_check.MAX_MESSAGE_BYTES + 1),
+            "message_attributes": {},
+        }
+    ]
+
+    result = queue.send_messages(messages)
+
+    assert result == {
+        "successful": [str(i) for i in range(6)],
+        "failed": [],
+    }
+    # Two 100 KB messages fit in a batch request
+    assert sqs_client.stats.snapshot()["calls"] == {"send_message_batch": 3}
+    bodies = [m["Body"] for m in sqs_client.queues[QUEUE_URL].values()]
+    assert sorted(len(body) for body in bodies)[-1] == 100_000
+    assert len(s3_client.objects["bucket"]) == 1
+
+
+def test_send_messages_without_s3_client_fails_oversized_messages():
+    sqs_client = FakeSqsClient()
+    queue = StandardClient(queue_url=QUEUE_URL, sqs_client=sqs_client)
+    result = queue.send_messages(
+        [
+            {"message_body": "x", "message_attributes": {}},
+            {
+                "message_body": "y" * (claim_check.MAX_MESSAGE_BYTES + 1),
+                "message_attributes": {},
+            },
+        ]
+    )
+    assert result["successful"] == ["0"]
+    assert [(f["id"], f["sender_fault"]) for f in result["failed"]] == [
+        ("1", True)
+    ]
+
+
+def test_send_messages_retries_failed_entries():
+    sqs_client = FlakySqsClient(failures={"3": (2, False), "12": (1, False)})
+    queue = StandardClient(queue_url=QUEUE_URL, sqs_client=sqs_client)
+
+    result = queue.send_messages(numbered_messages(15))
+
+    assert result == {
+        "successful": [str(i) for i in range(15)],
+        "failed": [],
+    }
+    assert sqs_client.attempts["3"] == 3
+    assert sqs_client.attempts["12"] == 2
+    assert sqs_client.attempts["0"] == 1
+    # Each message is sent once
+    bodies = [m["Body"] for m in sqs_client.queues[QUEUE_URL].values()]
+    assert sorted(bodies, key=int) == [str(i) for i in range(15)]
+
+
+def test_send_messages_does_not_retry_sender_faults():
+    sqs_client = FlakySqsClient(failures={"1": (None, True)})
+    queue = StandardClient(queue_url=QUEUE_URL, sqs_client=sqs_client)
+
+    result = queue.send_messages(numbered_messages(3))
+
+    assert result["successful"] == ["0", "2"]
+    assert [(f["id"], f["sender_fault"]) for f in result["failed"]] == [
+        ("1", True)
+    ]
+    assert sqs_client.attempts["1"] == 1
+
+
+def test_send_messages_gives_up_after_max_retries():
+    sqs_client = FlakySqsClient(failures={"0": (None, False)})
+    queue = StandardClient(queue_url=QUEUE_URL, sqs_client=sqs_client)
+
+    result = queue.send_messages(numbered_messages(2), max_retries=2)
+
+    assert result["successful"] == ["1"]
+    assert [(f["id"], f["code"]) for f in result["failed"]] == [
+        ("0", "InternalError")
+    ]
+    assert sqs_client.attempts["0"] == 3
+
+
+def test_send_messages_retries_failed_requests():
+    sqs_client = FlakySqsClient(errors=1)
+    queue = StandardClient(queue_url=QUEUE_URL, sqs_client=sqs_client)
+
+    result = queue.send_messages(numbered_messages(5))
+
+    assert result == {
+        "successful": [str(i) for i in range(5)],
+        "failed": [],
+    }
+    assert len(sqs_client.queues[QUEUE_URL]) == 5
+
+
+def test_send_messages_reports_failed_requests():
+    sqs_client = FlakySqsClient(errors=2)
+    queue = StandardClient(queue_url=QUEUE_URL, sqs_client=sqs_client)
+
+    result = queue.send_messages(numbered_messages(2), max_retries=1)
+
+    assert result["successful"] == []
+    assert [
+        (f["id"], f["code"], f["sender_fault"]) for f in result["failed"]
+    ] == [
+        ("0", "ConnectionError", False),
+        ("1", "ConnectionError", False),
+    ]
+
+
+def test_delete_messages_retries_failed_entries():
+    sqs_client = FlakySqsClient(failures={"1": (1, False)})
+    queue = StandardClient(queue_url=QUEUE_URL, sqs_client=sqs_client)
+    queue.send_messages(numbered_messages(3))
+    receipt_handles = list(sqs_client.queues[QUEUE_URL])
+    sqs_client.attempts = {}
+
+    result = queue.delete_messages(receipt_handles)
+
+    assert result == {"successful": ["0", "1", "2"], "failed": []}
+    assert sqs_client.attempts["1"] == 2
+    assert not sqs_client.queues[QUEUE_URL]
@@ -0,0 +1,61 @@
+import pytest
+
+from sheiva_cloud.sheiva_aws import local_clients
+
+BUCKET = "bucket"
+
+
+def test_base_clients_are_abstract():
+    # pylint: disable=abstract-class-instantiated
+    with pytest.raises(TypeError):
+        local_clients.BaseS3Client()
+    with pytest.raises(TypeError):
+        local_clients.BaseSqsClient()
+
+
+def test_local_s3_client(tmp_path):
+    s3_client = local_clients.LocalS3Client(root=str(tmp_path))
+    s3_client.put_object(Bucket=BUCKET, Key="a/b.json", Body=b"[1]")
+
+    response = s3_client.get_object(Bucket=BUCKET, Key="a/b.json")
+    # The file is not held open, so it can be replaced right away
+    s3_client.put_object(Bucket=BUCKET, Key="a/b.json", Body=b"[2]")
+
+    assert response["Body"].read() == b"[1]"
+    assert response["ContentLength"] == 3
+    assert [
+        c["Key"]
+        for c in s3_client.list_objects_v2(Bucket=BUCKET, Prefix="a/")[
+            "Contents"
+        ]
+    ] == ["a/b.json"]
+    s3_client.delete_object(Bucket=BUCKET, Key="a/b.json")
+    with pytest.raises(s3_client.exceptions.NoSuchKey):
+        s3_client.get_object(Bucket=BUCKET, Key="a/b.json")
+    assert s3_client.stats.snapshot()["calls"]["get_object"] == 2
+
+
+def test_local_sqs_client(tmp_path):
+    sqs_client = local_clients.LocalSqsClient(root=str(tmp_path))
+    queue_url = "https://sqs/queue"
+    sqs_client.send_message_batch(
+        QueueUrl=queue_url,
+        Entries=[{"Id": str(i), "MessageBody": str(i)} for i in range(3)],
+    )
+
+    messages = sqs_client.receive_message(
+        QueueUrl=queue_url, MaxNumberOfMessages=10
+    )["Messages"]
+    sqs_client.delete_message(
+        QueueUrl=queue_url, ReceiptHandle=messages[0]["ReceiptHandle"]
+    )
+
+    assert sorted(m["Body"] for m in messages) == ["0", "1", "2"]
+    assert (
+        len(
+            sqs_client.receive_message(
+                QueueUrl=queue_url, MaxNumberOfMessages=10
+            )["Messages"]
+        )
+        == 2
+    )
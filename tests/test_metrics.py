@@ -0,0 +1,149 @@
+import json
+
+import pytest
+
+from benchmarks.fakes import FakeS3Client, FakeSqsClient
+from sheiva_cloud.sheiva_aws import metrics
+
+
+@pytest.fixture(name="enabled")
+def fixture_enabled():
+    was_enabled = metrics.enabled()
+    metrics.set_enabled(True)
+    yield
+    metrics.set_enabled(was_enabled)
+    # pylint: disable=protected-access
+    metrics._metrics.clear()
+
+
+def emitted(capsys):
+    lines = [
+        json.loads(line)
+        for line in capsys.readouterr().out.splitlines()
+        if line.startswith('{"_aws"')
+    ]
+    return {line.get("Stage") or line.get("Operation"): line for line in lines}
+
+
+def test_disabled_records_nothing(monkeypatch, capsys):
+    monkeypatch.setattr(metrics, "_enabled", False)
+    client = FakeS3Client()
+
+    metrics.count("Messages", 3, Stage="Parse")
+    with metrics.timer(Stage="Parse"):
+        pass
+    metrics.flush()
+
+    assert metrics.timer(Stage="Parse") is metrics.timer(Stage="Other")
+    assert metrics.instrument_client(client, "s3") is client
+    assert not capsys.readouterr().out
+
+
+@pytest.mark.usefixtures("enabled")
+def test_flush_emits_emf_lines(capsys):
+    metrics.count("Messages", 3, Stage="Parse")
+    metrics.count("Messages", 2, Stage="Parse")
+    metrics.gauge_bytes("Bytes", 10, Stage="Parse")
+    metrics.gauge_bytes("Bytes", 20, Stage="Parse")
+    metrics.put_metric("Duration", 5, metrics.MILLISECONDS, Stage="Write")
+    metrics.flush()
+
+    lines = emitted(capsys)
+    parse = lines["Parse"]
+    # Counts are summed, other values kept as a distribution
+    assert parse["Messages"] == 5
+    assert parse["Bytes"] == [10, 20]
+    assert parse["FunctionName"] == metrics.FUNCTION_NAME
+    (directive,) = parse["_aws"]["CloudWatchMetrics"]
+    assert directive["Namespace"] == metrics.NAMESPACE
+    assert directive["Dimensions"] == [["FunctionName", "Stage"]]
+    assert directive["Metrics"] == [
+        {"Name": "Messages", "Unit": metrics.COUNT},
+        {"Name": "Bytes", "Unit": metrics.BYTES},
+    ]
+    assert lines["Write"]["Duration"] == 5
+
+    metrics.flush()
+    assert not emitted(capsys)
+
+
+@pytest.mark.usefixtures("enabled")
+def test_flushes_full_metrics(capsys):
+    for _ in range(metrics.MAX_VALUES):
+        metrics.gauge_bytes("Bytes", 1, Stage="Parse")
+
+    assert len(emitted(capsys)["Parse"]["Bytes"]) == metrics.MAX_VALUES
+
+
+@pytest.mark.usefixtures("enabled")
+def test_timed_records_failed_calls(capsys):
+    @metrics.timed(Stage="Parse")
+    def parse(fail):
+        if fail:
+            raise ValueError("failed")
+        return "parsed"
+
+    assert parse(False) == "parsed"
+    with pytest.raises(ValueError):
+        parse(True)
+    metrics.flush()
+
+    durations = emitted(capsys)["Parse"]["Duration"]
+    assert len(durations) == 2
+    assert all(duration >= 0 for duration in durations)
+
+
+@pytest.mark.usefixtures("enabled")
+def test_flushed_flushes_failed_invocations(capsys):
+    @metrics.flushed
+    def handler(event, context):
+        metrics.count("Messages", len(event), Stage="Handler")
+        raise RuntimeError(context)
+
+    with pytest.raises(RuntimeError):
+        handler([1, 2], "context")
+
+    assert emitted(capsys)["Handler"]["Messages"] == 2
+
+
+@pytest.mark.usefixtures("enabled")
+def test_instrumented_s3_client(capsys):
+    client = metrics.instrument_client(FakeS3Client(), "s3")
+    assert metrics.instrument_client(client, "s3") is client
+
+    client.put_object(Bucket="bucket", Key="a", Body=b"12345")
+    client.get_object(Bucket="bucket", Key="a")["Body"].read()
+    with pytest.raises(client.exceptions.NoSuchKey):
+        client.get_object(Bucket="bucket", Key="b")
+    pages = client.get_paginator("list_objects_v2").paginate(Bucket="bucket")
+    assert [c["Key"] for page in pages for c in page["Contents"]] == ["a"]
+    metrics.flush()
+
+    lines = emitted(capsys)
+    assert lines["put_object"]["Calls"] == 1
+    assert lines["put_object"]["BytesUploaded"] == 5
+    assert lines["get_object"]["Calls"] == 1
+    assert lines["get_object"]["Errors"] == 1
+    assert lines["get_object"]["BytesDownloaded"] == 5
+    assert len(lines["get_object"]["Latency"]) == 2
+    assert lines["list_objects_v2"]["Calls"] == 1
+    assert lines["get_object"]["Service"] == "s3"
+
+
+@pytest.mark.usefixtures("enabled")
+def test_instrumented_sqs_client(capsys):
+    client = metrics.instrument_client(FakeSqsClient(), "sqs")
+
+    client.send_message_batch(
+        QueueUrl="queue",
+        Entries=[
+            {"Id": "0", "MessageBody": "abc"},
+            {"Id": "1", "MessageBody": "de"},
+        ],
+    )
+    client.receive_message(QueueUrl="queue", MaxNumberOfMessages=10)
+    metrics.flush()
+
+    lines = emitted(capsys)
+    assert lines["send_message_batch"]["BytesUploaded"] == 5
+    assert lines["receive_message"]["BytesDownloaded"] == 5